@@ -0,0 +1,76 @@
+"""
+Per-chat cache of administrator ids.
+Saves a get_chat_member round-trip on every admin command.
+"""
+from typing import Dict, FrozenSet, Tuple
+import asyncio
+import logging
+import time
+
+from config import ADMIN_CACHE_TTL
+from outbound import Priority, outbound
+
+logger = logging.getLogger(__name__)
+
+class AdminCache:
+    """
+    Caches the set of administrator ids of each chat for `ttl` seconds.
+
+    The set is filled from a single get_chat_administrators call, sent
+    through the outbound scheduler with the priority of command replies
+    since an admin is waiting on it, and is dropped early whenever a ChatMemberUpdated shows a promotion or demotion.
+    Concurrent lookups for the same chat share one in-flight request.
+    """
+    def __init__(self, ttl: float = ADMIN_CACHE_TTL, clock=time.monotonic):
+        self._ttl = ttl
+        self._clock = clock
+        self._admins: Dict[int, Tuple[float, FrozenSet[int]]] = {}
+        self._inflight: Dict[int, asyncio.Future] = {}
+
+    async def get_admin_ids(self, bot, chat_id: int) -> FrozenSet[int]:
+        """
+        Get the administrator ids of a chat, fetching them if the cache is stale.
+        Raises TelegramError if they have to be fetched and the call fails.
+        """
+        cached = self._admins.get(chat_id)
+        if cached and cached[0] > self._clock():
+            return cached[1]
+
+        inflight = self._inflight.get(chat_id)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[chat_id] = future
+        try:
+            administrators = await outbound.call(
+                bot.get_chat_administrators, priority=Priority.CHAT_MESSAGE, chat_id=chat_id
+            )
+            admin_ids = frozenset(member.user.id for member in administrators)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(chat_id, None)
+
+        self._admins[chat_id] = (self._clock() + self._ttl, admin_ids)
+        future.set_result(admin_ids)
+        logger.debug("Cached %d administrators for chat %s", len(admin_ids), chat_id)
+        return admin_ids
+
+    async def is_admin(self, bot, chat_id: int, user_id: int) -> bool:
+        """Check if a user is an administrator of a chat."""
+        return user_id in await self.get_admin_ids(bot, chat_id)
+
+    def invalidate(self, chat_id: int):
+        """Forget the cached administrators of a chat."""
+        self._admins.pop(chat_id, None)
+        logger.debug("Invalidated administrator cache for chat %s", chat_id)
+
+# Global admin cache instance
+admin_cache = AdminCache()
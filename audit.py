@@ -0,0 +1,213 @@
+"""
+Audit trail of membership decisions.
+Every join, restriction, verification, rejection, expiry and unban is
+appended to its own SQLite table with who did it and how long the member
+had waited, and can be exported as chunked CSV files for reports.
+"""
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+import atexit
+import csv
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from config import AUDIT_PATH, AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL, AUDIT_EXPORT_ROWS
+
+logger = logging.getLogger(__name__)
+
+class AuditEvent:
+    """
+    Kinds of audited events.
+    """
+    JOIN = "join"          # actor: whoever added the member, or the member
+    RESTRICT = "restrict"  # actor: the bot
+    VERIFY = "verify"      # actor: the admin, the member after a challenge, or the bot
+    REJECT = "reject"      # actor: the admin, or the bot
+    EXPIRE = "expire"      # actor: the bot
+    UNBAN = "unban"        # actor: the admin
+
+# Columns of the export, in order
+EXPORT_COLUMNS = ("id", "time", "event", "chat_id", "target_id", "actor_id", "latency_seconds", "detail")
+
+class AuditLog:
+    """
+    Append-only event log in SQLite.
+
+    record() only appends to a buffer; a writer thread inserts the buffered
+    events in one transaction every `flush_interval` seconds, or once
+    `batch_size` are waiting, so handlers never wait for the disk. The
+    database is opened with the first event. Triggers reject updates and
+    deletes, so rows can only be added. With an empty `path` events are
+    dropped.
+    """
+    def __init__(self, path: str = AUDIT_PATH, batch_size: int = AUDIT_BATCH_SIZE,
+                 flush_interval: float = AUDIT_FLUSH_INTERVAL, clock=time.time):
+        self.path = path
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._clock = clock
+        self._buffer: List[Tuple] = []
+        self._cond = threading.Condition()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writer: Optional[threading.Thread] = None
+        self._closed = False
+
+    def record(self, event: str, chat_id: int, target_id: int, actor_id: int = None,
+               joined_at: float = None, detail: str = ""):
+        """
+        Append an event. `actor_id` is None for the bot's own actions;
+        `joined_at` is the target's join time, from which the latency of
+        the decision is computed.
+        """
+        if not self.path:
+            return
+        now = self._clock()
+        latency = now - joined_at if joined_at is not None else None
+        with self._cond:
+            if self._closed:
+                return
+            if self._writer is None:
+                self._open()
+            self._buffer.append((now, event, chat_id, target_id, actor_id, latency, detail))
+            if len(self._buffer) >= self._batch_size:
+                self._cond.notify()
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS audit_events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "ts REAL NOT NULL, "
+            "event TEXT NOT NULL, "
+            "chat_id INTEGER NOT NULL, "
+            "target_id INTEGER NOT NULL, "
+            "actor_id INTEGER, "
+            "latency REAL, "
+            "detail TEXT NOT NULL DEFAULT '')"
+        )
+        for statement in ("UPDATE", "DELETE"):
+            self._conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS audit_events_no_{statement.lower()} "
+                f"BEFORE {statement} ON audit_events "
+                "BEGIN SELECT RAISE(ABORT, 'audit events are append-only'); END"
+            )
+        self._writer = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+        logger.debug("Opened audit log at %s", self.path)
+
+    def _take_buffer(self) -> List[Tuple]:
+        batch, self._buffer = self._buffer, []
+        return batch
+
+    def _write(self, batch: List[Tuple]):
+        if not batch:
+            return
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.executemany(
+                "INSERT INTO audit_events (ts, event, chat_id, target_id, actor_id, latency, detail) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                batch
+            )
+            self._conn.execute("COMMIT")
+        except sqlite3.Error:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._buffer) < self._batch_size:
+                    self._cond.wait(self._flush_interval)
+                batch = self._take_buffer()
+                closed = self._closed
+
+            try:
+                self._write(batch)
+            except sqlite3.Error as e:
+                logger.error(f"Error writing {len(batch)} audit events to {self.path}: {e}")
+                with self._cond:
+                    self._buffer[:0] = batch
+
+            if closed:
+                return
+
+    def close(self):
+        """Write the buffered events and close the database."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        if self._writer is not None:
+            self._writer.join()
+            self._conn.close()
+
+def _export_row(row: Tuple) -> Tuple:
+    event_id, ts, event, chat_id, target_id, actor_id, latency, detail = row
+    when = datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="seconds")
+    return (event_id, when, event, chat_id, target_id, actor_id, "" if latency is None else f"{latency:.1f}", detail)
+
+def export_csv(directory: str, path: str = AUDIT_PATH, rows_per_file: int = AUDIT_EXPORT_ROWS,
+               since: float = None, until: float = None, fetch_size: int = 10_000) -> List[str]:
+    """
+    Write the audit events with `since` <= ts < `until`, oldest first, to
+    audit-00001.csv, audit-00002.csv, ... in `directory`, at most
+    `rows_per_file` rows each. Events are read `fetch_size` at a time by
+    id, so memory use stays flat however long the log is. The database is
+    opened read-only and may be written meanwhile. Returns the paths written.
+    """
+    conditions = ""
+    params: Tuple = ()
+    if since is not None:
+        conditions += " AND ts >= ?"
+        params += (since,)
+    if until is not None:
+        conditions += " AND ts < ?"
+        params += (until,)
+    query = (
+        "SELECT id, ts, event, chat_id, target_id, actor_id, latency, detail FROM audit_events "
+        f"WHERE id > ?{conditions} ORDER BY id LIMIT ?"
+    )
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No audit log at {path}")
+    os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    files: List[str] = []
+    handle = None
+    writer = None
+    rows_in_file = 0
+    last_id = 0
+    try:
+        while True:
+            rows = connection.execute(query, (last_id, *params, fetch_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            for row in rows:
+                if handle is None or rows_in_file >= rows_per_file:
+                    if handle is not None:
+                        handle.close()
+                    file_path = os.path.join(directory, f"audit-{len(files) + 1:05d}.csv")
+                    handle = open(file_path, "w", newline="", encoding="utf-8")
+                    writer = csv.writer(handle)
+                    writer.writerow(EXPORT_COLUMNS)
+                    files.append(file_path)
+                    rows_in_file = 0
+                writer.writerow(_export_row(row))
+                rows_in_file += 1
+    finally:
+        if handle is not None:
+            handle.close()
+        connection.close()
+    return files
+
+# Global audit log instance
+audit_log = AuditLog()
@@ -1,153 +1,202 @@
 """
 Telegram bot implementation for user verification in groups.
-Sets up the bot with handlers and webhook server.
+Sets up the bot with handlers and webhook server. Importing this module
+only creates the Flask app; setup_bot() starts the bot.
 """
+import asyncio
 import logging
 import os
-from flask import Flask, request, jsonify
+import threading
+from flask import Flask, request
 from telegram import Update, Bot
 from telegram.ext import (
-    Updater,
+    Application,
+    ApplicationBuilder,
+    CallbackQueryHandler,
     CommandHandler,
-    CallbackContext,
+    ChatMemberHandler,
     MessageHandler,
-    Filters
+    filters
 )
 
-from config import TELEGRAM_TOKEN, WEBHOOK_URL, USE_POLLING, SECRET_KEY
+from challenge import CHALLENGE_PREFIX, challenge_callback, challenge_reply, start_challenge
+from cluster import create_replica
+from config import (
+    TELEGRAM_TOKEN, WEBHOOK_URL, WEBHOOK_SECRET, USE_POLLING, SECRET_KEY, EXPIRY_INTERVAL, CLUSTER_ENABLED,
+    PROMOTION_INTERVAL, TELEGRAM_API_URL
+)
+from dashboard import dashboard
+from expiry import expiry_job
 from handlers import (
     new_member_handler,
     verify_command_handler,
     reject_command_handler,
     list_pending_command_handler,
+    list_pending_callback_handler,
     help_command_handler,
-    error_handler
+    chat_member_update_handler,
+    error_handler,
+    LIST_CALLBACK_PREFIX
 )
+from ingest import webhook_ingestor
+from levels import promotion_job
+from poller import UpdatePoller
+from update_processor import ChatOrderedUpdateProcessor
+from welcome import VERIFY_START_PREFIX
 
-# Set up logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 # Create Flask app
 app = Flask(__name__)
 app.secret_key = SECRET_KEY
 
-# Create bot instance and updater
-updater = None
-dispatcher = None
+# Bot application and the event loop it runs on.
+# Flask serves requests from its own threads, so the application gets a
+# dedicated loop in a background thread and updates are handed over to it.
+application: Application = None
+bot_loop: asyncio.AbstractEventLoop = None
+bot_initialized = False
+
+def build_application() -> Application:
+    """
+    Build the bot application with all handlers registered.
+    """
+    # Updates of one chat stay in order, different chats are handled in parallel
+    application = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .base_url(f"{TELEGRAM_API_URL}/bot")
+        .base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+        .concurrent_updates(ChatOrderedUpdateProcessor())
+        .build()
+    )
+    
+    # Register handlers
+    application.add_handler(CommandHandler("verify", verify_command_handler))
+    application.add_handler(CommandHandler("reject", reject_command_handler))
+    application.add_handler(CommandHandler("listpending", list_pending_command_handler))
+    application.add_handler(CallbackQueryHandler(list_pending_callback_handler, pattern=f"^{LIST_CALLBACK_PREFIX}:"))
+    application.add_handler(CommandHandler("help", help_command_handler))
+    application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, new_member_handler))
+    application.add_handler(ChatMemberHandler(chat_member_update_handler, ChatMemberHandler.CHAT_MEMBER))
+    
+    # Self-service verification, opened from the welcome message button
+    application.add_handler(CommandHandler(
+        "start", start_challenge, filters.ChatType.PRIVATE & filters.Regex(rf"^/start {VERIFY_START_PREFIX}-?\d+$")
+    ))
+    application.add_handler(CallbackQueryHandler(challenge_callback, pattern=f"^{CHALLENGE_PREFIX}:"))
+    application.add_handler(MessageHandler(filters.ChatType.PRIVATE & filters.TEXT & ~filters.COMMAND, challenge_reply))
+    
+    # Register error handler
+    application.add_error_handler(error_handler)
+    
+    # Periodically remove users who were never verified. Always scheduled,
+    # since any group can enable its own timeout. Verified members are
+    # promoted to their next level by a second sweep. In a cluster only the poller sweeps
+    if CLUSTER_ENABLED:
+        replica = create_replica(application)
+        application.bot_data["replica"] = replica
+        application.job_queue.run_repeating(replica.leader_only(expiry_job), interval=EXPIRY_INTERVAL, first=EXPIRY_INTERVAL)
+        application.job_queue.run_repeating(replica.leader_only(promotion_job), interval=PROMOTION_INTERVAL, first=PROMOTION_INTERVAL)
+    else:
+        application.job_queue.run_repeating(expiry_job, interval=EXPIRY_INTERVAL, first=EXPIRY_INTERVAL)
+        application.job_queue.run_repeating(promotion_job, interval=PROMOTION_INTERVAL, first=PROMOTION_INTERVAL)
+    
+    return application
+
+async def start_application(application: Application, use_polling: bool = USE_POLLING):
+    """
+    Start the application and begin receiving updates.
+    """
+    await application.initialize()
+    await application.start()
+    
+    # Start bot based on configuration
+    if CLUSTER_ENABLED:
+        # The replica holding the poller lease fetches updates for everyone
+        logger.info("Bot started as a cluster replica")
+        replica = application.bot_data["replica"]
+        replica_task = asyncio.get_running_loop().create_task(replica.run())
+        application.bot_data["replica_task"] = replica_task
+    elif use_polling:
+        # For local development using polling
+        logger.info("Bot started in polling mode")
+        poller_task = asyncio.get_running_loop().create_task(UpdatePoller(application).run())
+        application.bot_data["poller_task"] = poller_task
+    elif WEBHOOK_URL:
+        # Updates are delivered to the Flask webhook route below
+        webhook_url = f"{WEBHOOK_URL}/{TELEGRAM_TOKEN}"
+        logger.info("Setting webhook to %s", webhook_url)
+        await webhook_ingestor.start(application)
+        await application.bot.set_webhook(
+            url=webhook_url, allowed_updates=Update.ALL_TYPES, secret_token=WEBHOOK_SECRET
+        )
+    else:
+        logger.warning("No webhook URL set and polling disabled. Bot won't receive updates.")
 
-def setup_bot():
-    global updater, dispatcher
+def setup_bot(use_polling: bool = USE_POLLING) -> bool:
+    """
+    Build and start the bot on its own loop thread, polling or behind the
+    webhook route. Called once by the entry point; returns whether the bot
+    is running.
+    """
+    global application, bot_loop, bot_initialized
+    dashboard.mode = "cluster" if CLUSTER_ENABLED else "polling" if use_polling else "webhook"
     if not TELEGRAM_TOKEN or TELEGRAM_TOKEN == "placeholder_token_for_development":
         logger.warning("No valid Telegram token provided. Bot functionality will be limited.")
+        dashboard.status = "bot not initialized"
         return False
     
     try:
-        # Create the Updater
-        updater = Updater(token=TELEGRAM_TOKEN, use_context=True)
-        dispatcher = updater.dispatcher
-        
-        # Register handlers
-        dispatcher.add_handler(CommandHandler("verify", verify_command_handler))
-        dispatcher.add_handler(CommandHandler("reject", reject_command_handler))
-        dispatcher.add_handler(CommandHandler("listpending", list_pending_command_handler))
-        dispatcher.add_handler(CommandHandler("help", help_command_handler))
-        dispatcher.add_handler(MessageHandler(Filters.status_update.new_chat_members, new_member_handler))
+        application = build_application()
         
-        # Register error handler
-        dispatcher.add_error_handler(error_handler)
+        bot_loop = asyncio.new_event_loop()
+        threading.Thread(target=bot_loop.run_forever, name="bot-loop", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(start_application(application, use_polling), bot_loop).result()
         
-        # Start bot based on configuration
-        if USE_POLLING:
-            # For local development using polling
-            logger.info("Bot started in polling mode")
-            updater.start_polling()
-        elif WEBHOOK_URL:
-            webhook_url = f"{WEBHOOK_URL}/{TELEGRAM_TOKEN}"
-            logger.info(f"Setting webhook to {webhook_url}")
-            updater.start_webhook(
-                listen="0.0.0.0",
-                port=5000,
-                url_path=TELEGRAM_TOKEN,
-                webhook_url=webhook_url if WEBHOOK_URL else None
-            )
-        else:
-            logger.warning("No webhook URL set and polling disabled. Bot won't receive updates.")
-        
-        return True
+        bot_initialized = True
     except Exception as e:
         logger.error(f"Error initializing bot: {e}")
-        return False
-
-# Set up the bot
-bot_initialized = setup_bot()
+    dashboard.status = "running" if bot_initialized else "bot not initialized"
+    return bot_initialized
 
 # Webhook setup
 @app.route(f'/{TELEGRAM_TOKEN}', methods=['POST'])
 def webhook():
     """
     Handle incoming webhook requests from Telegram.
+    The update is only queued here and processed after the response is sent.
     """
-    if not bot_initialized or not dispatcher:
+    if not bot_initialized or not application:
         logger.error("Webhook received but bot not initialized")
         return "Bot not initialized", 500
     
-    if request.method == "POST":
-        try:
-            update = Update.de_json(request.get_json(force=True), updater.bot)
-            dispatcher.process_update(update)
-            return "OK"
-        except Exception as e:
-            logger.error(f"Error processing update: {e}")
-            return "Error processing update", 500
+    if not webhook_ingestor.check_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token")):
+        return "Forbidden", 403
     
-    return "Method not allowed", 405
+    if not webhook_ingestor.submit(request.get_data()):
+        logger.warning("Webhook queue full, asking Telegram to retry later")
+        return "Too many pending updates", 429
+    
+    return "OK"
+
+def _dashboard_authorized() -> bool:
+    return dashboard.check_token(request.args.get("token") or request.headers.get("X-Dashboard-Token"))
 
 @app.route('/')
 def index():
     """
-    Simple status page to verify the bot is running.
+    Live dashboard of pending users, verification latency and error rates.
     """
-    status = {
-        "status": "running",
-        "bot_initialized": bot_initialized,
-        "mode": "polling" if USE_POLLING else "webhook"
-    }
-    
-    # For HTML response
-    html_response = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Telegram Verification Bot</title>
-        <link href="https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css" rel="stylesheet">
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-    </head>
-    <body data-bs-theme="dark">
-        <div class="container mt-5">
-            <div class="row justify-content-center">
-                <div class="col-md-8">
-                    <div class="card">
-                        <div class="card-header">
-                            <h3>Telegram Verification Bot Status</h3>
-                        </div>
-                        <div class="card-body">
-                            <p><strong>Status:</strong> Running</p>
-                            <p><strong>Bot Initialized:</strong> {bot_initialized}</p>
-                            <p><strong>Mode:</strong> {"Polling" if USE_POLLING else "Webhook"}</p>
-                            <p class="mt-4">
-                                This bot restricts new members in Telegram groups until an admin verifies them.
-                            </p>
-                        </div>
-                    </div>
-                </div>
-            </div>
-        </div>
-    </body>
-    </html>
+    if not _dashboard_authorized():
+        return "Forbidden", 403
+    return dashboard.render_html()
+
+@app.route('/api/dashboard')
+def dashboard_api():
     """
-    
-    return html_response
+    The dashboard figures as JSON.
+    """
+    if not _dashboard_authorized():
+        return "Forbidden", 403
+    return app.response_class(dashboard.render_json(), mimetype="application/json")
@@ -1,16 +1,9 @@
 """
 Script to run the Telegram bot directly
 """
+import sys
 
-import main
-import logging
+from cli import main
 
 if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO)
-    logging.info("Starting Telegram bot...")
-    
-    # This will call the bot directly
-    if hasattr(main, 'app') and main.app:
-        main.app.run_polling()
-    else:
-        logging.error("Bot application not found in main module")
\ No newline at end of file
+    sys.exit(main(["run", "--mode", "polling"]))
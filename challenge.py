@@ -0,0 +1,355 @@
+"""
+Self-service verification in a private chat with the bot.
+The button on the welcome message opens a challenge: a CAPTCHA, or a
+one-time code sent to the member's student email address. Solving it
+verifies the member without waiting for an admin.
+"""
+from email.message import EmailMessage
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import hmac
+import logging
+import random
+import secrets
+import smtplib
+import time
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import TelegramError
+from telegram.ext import CallbackContext
+
+from config import (
+    CHALLENGE_TTL, CHALLENGE_MAX_ATTEMPTS, STUDENT_EMAIL_DOMAIN,
+    SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, SMTP_STARTTLS, SMTP_SENDER
+)
+from handlers import verify_user
+from outbound import outbound, reply_to
+from storage import student_emails, verification_storage
+from templates import templates
+from welcome import VERIFY_START_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# Callback data prefix of the challenge buttons, followed by ":a:<answer>"
+# for an answer or ":e" to switch to an email code
+CHALLENGE_PREFIX = "chl"
+
+# Emoji CAPTCHA choices and the names members are asked to pick
+EMOJIS = {
+    "🍎": "apple", "🐱": "cat", "🚗": "car", "🌵": "cactus", "🎸": "guitar",
+    "🚀": "rocket", "🍕": "pizza", "🐢": "turtle", "⚽": "ball", "🔑": "key",
+    "🌙": "moon", "📚": "books",
+}
+
+# Reply to an address already bound to another account
+ADDRESS_TAKEN = "That address was already used to verify another account. Ask an admin if this is a mistake."
+
+class Step:
+    """
+    What a challenge is waiting for.
+    """
+    CAPTCHA = "captcha"  # an answer to the CAPTCHA
+    EMAIL = "email"      # a student email address
+    CODE = "code"        # the code sent to that address
+
+def _digest(answer: str) -> str:
+    return hashlib.sha256(answer.strip().lower().encode()).hexdigest()
+
+class ChallengeStore:
+    """
+    Open challenges, one per user, kept in memory.
+
+    A challenge is {"chat_id", "step", "answer", "attempts", "expires_at"},
+    with only a hash of the expected answer, plus "address" once a code was
+    emailed. It expires `ttl` seconds after it was opened. Wrong answers
+    and sent codes count towards `max_attempts`; opening the challenge
+    again does not reset them, so a member who runs out has to wait for it
+    to expire or for an admin.
+    """
+    def __init__(self, ttl: float = CHALLENGE_TTL, max_attempts: int = CHALLENGE_MAX_ATTEMPTS, clock=time.time):
+        self._ttl = ttl
+        self._max_attempts = max_attempts
+        self._clock = clock
+        self._challenges: Dict[int, Dict] = {}
+
+    def _prune(self, now: float):
+        for user_id in [user_id for user_id, record in self._challenges.items() if record["expires_at"] <= now]:
+            del self._challenges[user_id]
+
+    def open(self, user_id: int, chat_id: int) -> Optional[Dict]:
+        """
+        Open a challenge for joining `chat_id`, or continue the open one.
+        Returns None while the user has no attempts left.
+        """
+        now = self._clock()
+        self._prune(now)
+        record = self._challenges.get(user_id)
+        if record is None or record["chat_id"] != chat_id:
+            record = {"chat_id": chat_id, "step": Step.CAPTCHA, "answer": None,
+                      "attempts": 0, "expires_at": now + self._ttl}
+            self._challenges[user_id] = record
+        elif record["attempts"] >= self._max_attempts:
+            return None
+        return record
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        """Get the open challenge of a user, if it has not expired."""
+        record = self._challenges.get(user_id)
+        if record is not None and record["expires_at"] <= self._clock():
+            del self._challenges[user_id]
+            return None
+        return record
+
+    def expect(self, user_id: int, step: str, answer: str = None, address: str = None):
+        """Set what the challenge of a user is waiting for, and where a code was sent."""
+        record = self._challenges[user_id]
+        record["step"] = step
+        record["answer"] = _digest(answer) if answer is not None else None
+        if address is not None:
+            record["address"] = address
+
+    def use_attempt(self, user_id: int) -> bool:
+        """Count an attempt. Returns False if the user had none left."""
+        record = self._challenges[user_id]
+        if record["attempts"] >= self._max_attempts:
+            return False
+        record["attempts"] += 1
+        return True
+
+    def attempts_left(self, user_id: int) -> int:
+        return self._max_attempts - self._challenges[user_id]["attempts"]
+
+    def check(self, user_id: int, answer: str) -> bool:
+        """
+        Check an answer. A right answer closes the challenge; a wrong one
+        uses an attempt.
+        """
+        record = self._challenges[user_id]
+        if record["attempts"] >= self._max_attempts:
+            return False
+        if record["answer"] is not None and hmac.compare_digest(record["answer"], _digest(answer)):
+            del self._challenges[user_id]
+            return True
+        self.use_attempt(user_id)
+        return False
+
+    def close(self, user_id: int):
+        self._challenges.pop(user_id, None)
+
+    def minutes_left(self, user_id: int) -> int:
+        record = self._challenges.get(user_id)
+        return max(1, round((record["expires_at"] - self._clock()) / 60)) if record else 0
+
+class CodeMailer:
+    """
+    Sends one-time codes over SMTP.
+    smtplib blocks, so messages are sent from a worker thread.
+    """
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT, user: str = SMTP_USER,
+                 password: str = SMTP_PASSWORD, starttls: bool = SMTP_STARTTLS, sender: str = SMTP_SENDER):
+        self._host = host
+        self._port = port
+        self._user = user
+        self._password = password
+        self._starttls = starttls
+        self._sender = sender
+
+    def _send(self, address: str, code: str):
+        message = EmailMessage()
+        message["From"] = self._sender
+        message["To"] = address
+        message["Subject"] = f"Your verification code: {code}"
+        message.set_content(
+            f"Your code for the UMFST student group is {code}.\n"
+            f"Send it to the bot within {CHALLENGE_TTL // 60} minutes. "
+            "If you did not ask for it, ignore this email."
+        )
+        with smtplib.SMTP(self._host, self._port, timeout=30) as smtp:
+            if self._starttls:
+                smtp.starttls()
+            if self._user:
+                smtp.login(self._user, self._password)
+            smtp.send_message(message)
+
+    async def send_code(self, address: str, code: str):
+        """Email a code. Raises smtplib.SMTPException or OSError on failure."""
+        await asyncio.to_thread(self._send, address, code)
+
+def student_address(text: str, domain: str = STUDENT_EMAIL_DOMAIN) -> Optional[str]:
+    """Normalize a student email address. Returns None for anything else."""
+    # Imported on first use, it adds noticeably to startup
+    from email_validator import EmailNotValidError, validate_email
+    try:
+        result = validate_email(text.strip(), check_deliverability=False)
+    except EmailNotValidError:
+        return None
+    address_domain = result.domain.lower()
+    if address_domain != domain and not address_domain.endswith("." + domain):
+        return None
+    return result.normalized
+
+def new_captcha() -> Tuple[str, str, Optional[List[List[InlineKeyboardButton]]]]:
+    """
+    Make a CAPTCHA: either a sum to type or an emoji to tap.
+    Returns the question, the answer and the answer buttons, if any.
+    """
+    if random.random() < 0.5:
+        a, b = random.randint(2, 19), random.randint(2, 19)
+        return f"What is {a} + {b}? Reply with the number.", str(a + b), None
+
+    choices = random.sample(list(EMOJIS), 8)
+    emoji = random.choice(choices)
+    buttons = [
+        [InlineKeyboardButton(choice, callback_data=f"{CHALLENGE_PREFIX}:a:{choice}") for choice in row]
+        for row in (choices[:4], choices[4:])
+    ]
+    return f"Tap the {EMOJIS[emoji]}.", emoji, buttons
+
+def email_button() -> List[InlineKeyboardButton]:
+    return [InlineKeyboardButton(f"📧 Use my @{STUDENT_EMAIL_DOMAIN} email instead", callback_data=f"{CHALLENGE_PREFIX}:e")]
+
+async def send_captcha(bot, user_id: int, intro: str = ""):
+    """Ask the next CAPTCHA of an open challenge."""
+    question, answer, buttons = new_captcha()
+    challenges.expect(user_id, Step.CAPTCHA, answer)
+    await outbound.call(
+        bot.send_message,
+        chat_id=user_id,
+        text=intro + question,
+        reply_markup=InlineKeyboardMarkup((buttons or []) + [email_button()])
+    )
+
+async def pass_challenge(bot, user_id: int, chat_id: int, address: str = None):
+    """
+    Verify a member who solved their challenge. An email `address` is bound
+    to the member first, and refused if it already belongs to another one.
+    """
+    if not verification_storage.is_pending_verification(chat_id, user_id):
+        await outbound.call(bot.send_message, chat_id=user_id, text="You are no longer pending verification in that group.")
+        return
+    if address is not None and not student_emails.bind(address, user_id):
+        await outbound.call(bot.send_message, chat_id=user_id, text=ADDRESS_TAKEN)
+        return
+    detail = f"email {address}" if address is not None else "captcha"
+    try:
+        await verify_user(bot, chat_id, user_id, actor_id=user_id, detail=detail)
+    except TelegramError as e:
+        logger.error(f"Error verifying user {user_id} in chat {chat_id} after their challenge: {e}")
+        await outbound.call(bot.send_message, chat_id=user_id, text="Sorry, I couldn't verify you right now. An admin will do it.")
+        return
+    logger.info("User %s verified themselves in chat %s", user_id, chat_id)
+    await outbound.call(bot.send_message, chat_id=user_id, text=templates.render("verified_dm"))
+
+async def fail_attempt(bot, user_id: int, retry):
+    """Tell a member their answer was wrong, and either retry or lock them out."""
+    left = challenges.attempts_left(user_id)
+    if left > 0:
+        await retry(f"❌ That's not right, {left} attempt(s) left.\n\n")
+        return
+    await outbound.call(
+        bot.send_message,
+        chat_id=user_id,
+        text=f"❌ Too many wrong answers. Try again in {challenges.minutes_left(user_id)} minutes, or wait for an admin."
+    )
+
+async def start_challenge(update: Update, context: CallbackContext):
+    """
+    Handle /start v<chat_id>, sent by the button on a welcome message.
+    """
+    user_id = update.effective_user.id
+    try:
+        chat_id = int(context.args[0][len(VERIFY_START_PREFIX):])
+    except (IndexError, ValueError):
+        return
+
+    if not verification_storage.is_pending_verification(chat_id, user_id):
+        await reply_to(update.message, "You don't need to verify in that group, or you were already verified.")
+        return
+
+    if challenges.open(user_id, chat_id) is None:
+        await reply_to(
+            update.message,
+            f"❌ Too many wrong answers. Try again in {challenges.minutes_left(user_id)} minutes, or wait for an admin."
+        )
+        return
+
+    await send_captcha(context.bot, user_id, "👋 Let's get you verified. ")
+
+async def challenge_callback(update: Update, context: CallbackContext):
+    """Handle the buttons of a challenge."""
+    query = update.callback_query
+    user_id = query.from_user.id
+    record = challenges.get(user_id)
+    if record is None:
+        await outbound.call(query.answer, text="This challenge expired. Use the button in the group again.", show_alert=True)
+        return
+    await outbound.call(query.answer)
+
+    # Drop the buttons so an old question can't be answered twice
+    try:
+        await outbound.call(query.edit_message_reply_markup, reply_markup=None)
+    except TelegramError as e:
+        logger.debug("Could not remove challenge buttons for user %s: %s", user_id, e)
+
+    if query.data == f"{CHALLENGE_PREFIX}:e":
+        challenges.expect(user_id, Step.EMAIL)
+        await outbound.call(
+            context.bot.send_message,
+            chat_id=user_id,
+            text=f"Reply with your @{STUDENT_EMAIL_DOMAIN} email address and I'll send you a code."
+        )
+        return
+
+    if record["step"] != Step.CAPTCHA:
+        return
+    if challenges.check(user_id, query.data.split(":", 2)[2]):
+        await pass_challenge(context.bot, user_id, record["chat_id"])
+    else:
+        await fail_attempt(context.bot, user_id, lambda intro: send_captcha(context.bot, user_id, intro))
+
+async def challenge_reply(update: Update, context: CallbackContext):
+    """Handle text sent to the bot in private: CAPTCHA sums, email addresses and codes."""
+    user_id = update.effective_user.id
+    record = challenges.get(user_id)
+    if record is None:
+        return
+    text = update.message.text
+    bot = context.bot
+
+    if record["step"] == Step.EMAIL:
+        address = student_address(text)
+        if address is None:
+            await reply_to(update.message, f"That doesn't look like an @{STUDENT_EMAIL_DOMAIN} address. Please try again.")
+            return
+        if student_emails.owner(address) not in (None, user_id):
+            await reply_to(update.message, ADDRESS_TAKEN)
+            return
+        if not challenges.use_attempt(user_id):
+            await fail_attempt(bot, user_id, None)
+            return
+
+        code = f"{secrets.randbelow(10 ** 6):06d}"
+        try:
+            await mailer.send_code(address, code)
+        except (smtplib.SMTPException, OSError) as e:
+            logger.error(f"Could not email a code to user {user_id}: {e}")
+            await reply_to(update.message, "Sorry, I couldn't send the email. Try again later, or tap the button in the group again to solve a CAPTCHA.")
+            return
+        challenges.expect(user_id, Step.CODE, code, address)
+        logger.info("Sent a verification code to user %s", user_id)
+        await reply_to(update.message, f"📧 I sent a 6-digit code to {address}. Reply with it here.")
+        return
+
+    if record["step"] == Step.CAPTCHA and not text.strip().isdigit():
+        await reply_to(update.message, "Tap one of the buttons, or reply with the number if you were asked a sum.")
+        return
+    if challenges.check(user_id, text):
+        await pass_challenge(bot, user_id, record["chat_id"], record.get("address") if record["step"] == Step.CODE else None)
+    elif record["step"] == Step.CODE:
+        await fail_attempt(bot, user_id, lambda intro: reply_to(update.message, intro + "Reply with the code from the email."))
+    else:
+        await fail_attempt(bot, user_id, lambda intro: send_captcha(bot, user_id, intro))
+
+# Global challenge store and mailer instances
+challenges = ChallengeStore()
+mailer = CodeMailer()
@@ -0,0 +1,347 @@
+"""
+Command line entry point for the bot.
+
+    bot run --mode polling      # the bot with its dashboard, polling Telegram
+    bot run --mode webhook      # the Flask app receiving updates by webhook
+    bot benchmark-startup       # time from process start to the first getUpdates
+    bot benchmark-webhook       # load test of webhook ingestion against a mock Bot API
+    bot benchmark-throughput    # sequential vs concurrent update handling in bot.py
+    bot audit-export DIR        # write the audit log to chunked CSV files
+
+Only the modules a mode needs are imported, and only once it was chosen:
+polling never loads Flask and webhook never loads aiohttp.
+"""
+import time
+
+# Taken first, so startup times include the imports below
+STARTED_AT = time.perf_counter()
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+
+from logs import configure_logging
+
+logger = logging.getLogger(__name__)
+
+MODES = ("polling", "webhook")
+
+# Cold start to the first answered getUpdates, in milliseconds. Currently
+# missed: starts measure about 530-630 ms, most of it the interpreter and
+# the python-telegram-bot and httpx imports
+STARTUP_TARGET_MS = 300
+
+def log_startup_warnings():
+    from config import startup_warnings
+    for warning in startup_warnings():
+        logger.warning(warning)
+
+def create_web_app():
+    """
+    Start the bot behind the Flask app and return the app. Called by
+    main.app on the first request a WSGI server passes it.
+    """
+    configure_logging()
+    log_startup_warnings()
+    import bot
+    bot.setup_bot()
+    return bot.app
+
+def run_polling(args):
+    import asyncio
+    import telegram_bot
+    asyncio.run(telegram_bot.main(
+        started_at=STARTED_AT, exit_after_first_poll=args.exit_after_first_poll, port=args.port
+    ))
+
+def run_webhook(args):
+    import bot
+    bot.setup_bot(use_polling=False)
+    bot.app.run(host='0.0.0.0', port=args.port, debug=False)
+
+RUNNERS = {
+    "polling": run_polling,
+    "webhook": run_webhook,
+}
+
+def benchmark_env(api_url: str, **overrides) -> dict:
+    """Environment of a bot process talking to the Bot API stand-in at `api_url`."""
+    return dict(
+        os.environ,
+        BOT_TOKEN="1:benchmark",
+        TELEGRAM_TOKEN="1:benchmark",
+        TELEGRAM_API_URL=api_url,
+        STORAGE_BACKEND="memory",
+        CLUSTER_ENABLED="False",
+        AUDIT_PATH="",
+        **overrides,
+    )
+
+def benchmark_startup(runs: int = 5, target_ms: float = STARTUP_TARGET_MS) -> float:
+    """
+    Start the bot `runs` times in fresh interpreters against a local stand-in
+    for the Bot API, and time each from spawning the process to answering
+    its first getUpdates. Returns the median in milliseconds.
+    """
+    import subprocess
+    import tempfile
+    from fake_bot_api import FakeBotAPI
+
+    command = [sys.executable, os.path.abspath(__file__), "run", "--mode", "polling", "--exit-after-first-poll"]
+    timings = []
+    # Runs in a scratch directory so bot.log and the database stay untouched
+    with FakeBotAPI() as api, tempfile.TemporaryDirectory() as scratch:
+        env = benchmark_env(api.url)
+        for run in range(runs):
+            api.reset()
+            started = time.perf_counter()
+            process = subprocess.Popen(command, env=env, cwd=scratch,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            answered = api.wait_for("getUpdates", timeout=30)
+            elapsed = (time.perf_counter() - started) * 1000
+            _, stderr = process.communicate(timeout=30)
+            if not answered or process.returncode:
+                raise RuntimeError(f"Bot failed to start (exit code {process.returncode}): {stderr.decode()[-2000:]}")
+            timings.append(elapsed)
+            logger.info("Run %s: first getUpdates after %.0f ms", run + 1, elapsed)
+
+    median = statistics.median(timings)
+    verdict = "within" if median <= target_ms else "above"
+    logger.info(
+        "Cold start to first getUpdates: median %.0f ms, min %.0f ms, max %.0f ms over %s runs, %s the %.0f ms target",
+        median, min(timings), max(timings), runs, verdict, target_ms
+    )
+    return median
+
+def join_update(update_id: int, chat_id: int, user_id: int) -> bytes:
+    """A webhook delivery of one member joining a group."""
+    import json
+    member = {"id": user_id, "is_bot": False, "first_name": f"Member {user_id}"}
+    return json.dumps({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": "Benchmark"},
+            "from": member,
+            "new_chat_members": [member],
+        },
+    }).encode()
+
+def webhook_load(api, scratch: str, updates: int, senders: int, chats: int, **overrides):
+    """
+    Start the bot in webhook mode against `api`, deliver `updates` joins
+    spread over `chats` groups from `senders` threads, and wait until every
+    joiner was restricted. Returns the seconds until all deliveries were
+    acknowledged, the per-delivery response times and the seconds until
+    all were handled, each measured from the first delivery.
+    """
+    import http.client
+    import socket
+    import subprocess
+    import threading
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    # The scheduler's global limit guards Telegram; against the stand-in it
+    # would only measure itself, as would lockdowns of the busy test groups
+    env = benchmark_env(
+        api.url, WEBHOOK_URL="https://benchmark.invalid", WEBHOOK_SECRET="benchmark",
+        API_RATE_LIMIT="1000000", RAID_JOIN_THRESHOLD="1000000", **overrides
+    )
+    command = [sys.executable, os.path.abspath(__file__), "run", "--mode", "webhook", "--port", str(port)]
+    api.reset()
+
+    with open(os.path.join(scratch, "stderr.log"), "w+b") as stderr:
+        process = subprocess.Popen(command, env=env, cwd=scratch, stdout=subprocess.DEVNULL, stderr=stderr)
+        try:
+            deadline = time.monotonic() + 30
+            while not api.wait_for("setWebhook", timeout=0.1) or not _accepting(port):
+                if process.poll() is not None or time.monotonic() > deadline:
+                    stderr.seek(0)
+                    raise RuntimeError(f"Bot failed to start (exit code {process.returncode}): "
+                                       f"{stderr.read().decode()[-2000:]}")
+
+            bodies = [join_update(n, -1001000000000 - n % chats, 1_000_000 + n) for n in range(1, updates + 1)]
+            latencies = []
+            lock = threading.Lock()
+
+            def send(share):
+                connection = http.client.HTTPConnection("127.0.0.1", port)
+                headers = {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": "benchmark"}
+                timings = []
+                for body in share:
+                    while True:
+                        sent = time.perf_counter()
+                        connection.request("POST", "/1:benchmark", body, headers)
+                        response = connection.getresponse()
+                        response.read()
+                        timings.append(time.perf_counter() - sent)
+                        if response.status != 429:
+                            break
+                        # Queue full; Telegram would deliver it again later
+                        time.sleep(0.01)
+                connection.close()
+                with lock:
+                    latencies.extend(timings)
+
+            threads = [threading.Thread(target=send, args=(bodies[i::senders],)) for i in range(senders)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            acknowledged = time.perf_counter() - started
+            if not api.wait_for("restrictChatMember", updates, timeout=300):
+                raise RuntimeError(f"Only {api.calls['restrictChatMember']} of {updates} joins were handled")
+            handled = time.perf_counter() - started
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+    return acknowledged, latencies, handled
+
+def _accepting(port: int) -> bool:
+    import socket
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+def benchmark_webhook(updates: int = 2000, senders: int = 16, chats: int = 100, latency: float = 0.05) -> float:
+    """
+    Load test of the webhook ingest path: start the bot in webhook mode
+    against a local stand-in for the Bot API answering after `latency`
+    seconds, deliver `updates` joins as fast as `senders` connections
+    allow, and time how fast they are acknowledged and handled. Returns
+    the sustained rate of handled updates per second.
+    """
+    import tempfile
+    from fake_bot_api import FakeBotAPI
+
+    with FakeBotAPI(latency) as api, tempfile.TemporaryDirectory() as scratch:
+        acknowledged, latencies, handled = webhook_load(api, scratch, updates, senders, chats)
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    logger.info(
+        "Acknowledged %s webhook deliveries in %.2f s (%.0f/s, median %.1f ms, p99 %.1f ms per delivery)",
+        updates, acknowledged, updates / acknowledged, statistics.median(latencies) * 1000, p99 * 1000
+    )
+    rate = updates / handled
+    logger.info(
+        "Handled all %s joins in %.2f s: %.0f updates/s sustained with %.0f ms Bot API latency",
+        updates, handled, rate, latency * 1000
+    )
+    return rate
+
+def benchmark_throughput(updates: int = 300, chats: int = 50, latency: float = 0.05) -> float:
+    """
+    Before/after throughput of bot.py against a local stand-in for the Bot
+    API answering after `latency` seconds: the same burst of joins is
+    handled once one update at a time, as the blocking dispatcher did, and
+    once with updates of different chats handled concurrently. Returns how
+    many times faster the concurrent run was.
+    """
+    import tempfile
+    from fake_bot_api import FakeBotAPI
+
+    rates = {}
+    with FakeBotAPI(latency) as api, tempfile.TemporaryDirectory() as scratch:
+        for name, overrides in (("one update at a time", {"MAX_CONCURRENT_UPDATES": "1"}), ("concurrent", {})):
+            _, _, handled = webhook_load(api, scratch, updates, 8, chats, **overrides)
+            rates[name] = updates / handled
+            logger.info("%s: %s joins in %.2f s, %.1f updates/s", name.capitalize(), updates, handled, rates[name])
+
+    speedup = rates["concurrent"] / rates["one update at a time"]
+    logger.info("Concurrent handling is %.1fx faster with %.0f ms Bot API latency", speedup, latency * 1000)
+    return speedup
+
+def timestamp(value: str) -> float:
+    """Parse an ISO date or date and time, UTC unless it says otherwise."""
+    from datetime import datetime, timezone
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="bot", description="UMFST verification bot")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="start the bot")
+    run.add_argument("--mode", choices=MODES, default="polling",
+                     help="polling: bot and dashboard on aiohttp; webhook: bot behind the Flask app")
+    run.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5000)),
+                     help="port of the web server (default: $PORT or 5000)")
+    # Used by benchmark-startup
+    run.add_argument("--exit-after-first-poll", action="store_true", help=argparse.SUPPRESS)
+
+    benchmark = commands.add_parser("benchmark-startup", help="time cold starts to the first getUpdates")
+    benchmark.add_argument("--runs", type=int, default=5, help="number of cold starts (default: 5)")
+    benchmark.add_argument("--target", type=float, default=STARTUP_TARGET_MS,
+                           help=f"target median in milliseconds (default: {STARTUP_TARGET_MS})")
+
+    webhook = commands.add_parser("benchmark-webhook", help="load test the webhook ingest path")
+    webhook.add_argument("--updates", type=int, default=2000, help="joins delivered (default: 2000)")
+    webhook.add_argument("--senders", type=int, default=16, help="concurrent connections (default: 16)")
+    webhook.add_argument("--chats", type=int, default=100, help="groups the joins are spread over (default: 100)")
+    webhook.add_argument("--latency", type=float, default=0.05,
+                         help="seconds the Bot API stand-in takes per call (default: 0.05)")
+
+    throughput = commands.add_parser("benchmark-throughput",
+                                     help="compare sequential and concurrent update handling")
+    throughput.add_argument("--updates", type=int, default=300, help="joins delivered per run (default: 300)")
+    throughput.add_argument("--chats", type=int, default=50, help="groups the joins are spread over (default: 50)")
+    throughput.add_argument("--latency", type=float, default=0.05,
+                            help="seconds the Bot API stand-in takes per call (default: 0.05)")
+
+    export = commands.add_parser("audit-export", help="write the audit log to chunked CSV files")
+    export.add_argument("directory", help="where to write audit-00001.csv, audit-00002.csv, ...")
+    export.add_argument("--since", type=timestamp, help="first date to include, e.g. 2025-02-17")
+    export.add_argument("--until", type=timestamp, help="date to stop before, e.g. 2025-06-30")
+    export.add_argument("--rows-per-file", type=int, help="rows per CSV file (default: $AUDIT_EXPORT_ROWS)")
+    return parser
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+
+    if args.command == "benchmark-startup":
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        median = benchmark_startup(args.runs, args.target)
+        # A failing exit status lets CI hold the line on the target
+        return 0 if median <= args.target else 1
+
+    if args.command == "benchmark-webhook":
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        benchmark_webhook(args.updates, args.senders, args.chats, args.latency)
+        return 0
+
+    if args.command == "benchmark-throughput":
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        benchmark_throughput(args.updates, args.chats, args.latency)
+        return 0
+
+    if args.command == "audit-export":
+        from audit import export_csv
+        from config import AUDIT_EXPORT_ROWS
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        try:
+            files = export_csv(args.directory, rows_per_file=args.rows_per_file or AUDIT_EXPORT_ROWS,
+                               since=args.since, until=args.until)
+        except FileNotFoundError as e:
+            logger.error(str(e))
+            return 1
+        logger.info("Wrote %s files to %s", len(files), args.directory)
+        return 0
+
+    configure_logging()
+    log_startup_warnings()
+    RUNNERS[args.mode](args)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""
+Running several bot replicas side by side.
+One replica polls Telegram and queues the updates, every replica processes
+the updates of the chats in the partitions it holds.
+"""
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import Application, CallbackContext
+
+from config import (
+    CLUSTER_STORE_PATH, REPLICA_ID, CLUSTER_LEASE_TTL, CLUSTER_PARTITIONS, CLUSTER_SYNC_INTERVAL
+)
+from storage import chat_settings, verification_storage
+
+logger = logging.getLogger(__name__)
+
+# Name of the lease held by the replica calling getUpdates
+POLLER_LEASE = "poller"
+
+def partition_of(update: Update, partitions: int) -> int:
+    """Partition an update belongs to. All updates of a chat share one."""
+    chat = update.effective_chat
+    return chat.id % partitions if chat else 0
+
+class ClusterStore:
+    """
+    Leases and the shared update queue, kept in a SQLite database.
+
+    SQLite's file locking makes every lease change atomic across processes
+    on one host, which is enough to run several replicas locally or on a
+    shared volume. Another database could replace it behind the same methods.
+    """
+    def __init__(self, path: str, replica_id: str, lease_ttl: float = CLUSTER_LEASE_TTL, clock=time.time):
+        self.path = path
+        self.replica_id = replica_id
+        self.lease_ttl = lease_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cluster_leases ("
+            "name TEXT PRIMARY KEY, "
+            "holder TEXT NOT NULL, "
+            "expires_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cluster_updates ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "partition INTEGER NOT NULL, "
+            "update_id INTEGER NOT NULL UNIQUE, "
+            "data TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS cluster_updates_partition ON cluster_updates (partition, seq)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cluster_state (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+
+    def _transaction(self, callback):
+        """Run `callback(conn)` inside a write transaction."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = callback(self._conn)
+                self._conn.execute("COMMIT")
+                return result
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def acquire_lease(self, name: str) -> bool:
+        """Take or renew a lease. Returns False if another replica holds it."""
+        def acquire(conn):
+            now = self._clock()
+            row = conn.execute("SELECT holder, expires_at FROM cluster_leases WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != self.replica_id and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO cluster_leases (name, holder, expires_at) VALUES (?, ?, ?)",
+                (name, self.replica_id, now + self.lease_ttl)
+            )
+            return True
+        return self._transaction(acquire)
+
+    def release_lease(self, name: str):
+        """Give up a lease so another replica can take it right away."""
+        self._transaction(lambda conn: conn.execute(
+            "DELETE FROM cluster_leases WHERE name = ? AND holder = ?", (name, self.replica_id)
+        ))
+
+    def heartbeat(self) -> int:
+        """Renew this replica's membership. Returns the number of live replicas."""
+        self.acquire_lease(f"replica:{self.replica_id}")
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM cluster_leases WHERE name LIKE 'replica:%' AND expires_at > ?",
+                (self._clock(),)
+            ).fetchone()
+        return max(row[0], 1)
+
+    def get_offset(self) -> int:
+        """The getUpdates offset following the last queued update."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM cluster_state WHERE key = 'offset'").fetchone()
+        return row[0] if row else 0
+
+    def enqueue(self, updates: List[Tuple[int, int, str]], offset: int):
+        """
+        Queue (update_id, partition, data) rows and store the next offset in
+        the same transaction, so a new poller neither skips nor repeats updates.
+        """
+        def enqueue(conn):
+            conn.executemany(
+                "INSERT OR IGNORE INTO cluster_updates (update_id, partition, data) VALUES (?, ?, ?)",
+                updates
+            )
+            conn.execute("INSERT OR REPLACE INTO cluster_state (key, value) VALUES ('offset', ?)", (offset,))
+        self._transaction(enqueue)
+
+    def fetch(self, partition: int, limit: int) -> List[Tuple[int, str]]:
+        """Oldest queued (seq, data) rows of a partition."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT seq, data FROM cluster_updates WHERE partition = ? ORDER BY seq LIMIT ?",
+                (partition, limit)
+            ).fetchall()
+
+    def ack(self, seq: int, lease: str) -> bool:
+        """
+        Drop a processed update from the queue and renew `lease`, but only
+        while this replica still holds it. Returns False if another replica
+        took the lease over; the update then stays queued for it.
+        """
+        def ack(conn):
+            row = conn.execute("SELECT holder FROM cluster_leases WHERE name = ?", (lease,)).fetchone()
+            # Holding it even past expiry is enough: nobody else took it in between
+            if not row or row[0] != self.replica_id:
+                return False
+            conn.execute(
+                "UPDATE cluster_leases SET expires_at = ? WHERE name = ?", (self._clock() + self.lease_ttl, lease)
+            )
+            conn.execute("DELETE FROM cluster_updates WHERE seq = ?", (seq,))
+            return True
+        return self._transaction(ack)
+
+    def queue_depths(self) -> Dict[int, int]:
+        """Number of queued updates per partition."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT partition, COUNT(*) FROM cluster_updates GROUP BY partition"
+            ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class Replica:
+    """
+    One member of a group of bot processes sharing a ClusterStore.
+
+    Every replica competes for the poller lease; the holder calls getUpdates
+    and queues each update under the partition of its chat. Partitions are
+    leased too, and each replica holds at most its fair share of them, so
+    one chat is only ever handled by one replica at a time and in order.
+    A replica that dies loses its leases after `lease_ttl` seconds and the
+    others take over, reprocessing at most the update it was working on.
+    The partition lease is renewed with every update, and an update is only
+    acknowledged while its partition is still held.
+
+    Pending verifications and chat settings are shared through the storage
+    backend and re-read every `sync_interval` seconds. Welcome batches, the
+    admin cache and outbound rate limits stay per process, so API_RATE_LIMIT
+    should be divided by the number of replicas.
+    """
+    def __init__(self, application: Application, store: ClusterStore,
+                 partitions: int = CLUSTER_PARTITIONS, sync_interval: float = CLUSTER_SYNC_INTERVAL,
+                 batch_size: int = 50, idle_interval: float = 0.5):
+        self.application = application
+        self.store = store
+        self._partitions = partitions
+        self._sync_interval = sync_interval
+        self._batch_size = batch_size
+        self._idle_interval = idle_interval
+        self._lease_ttl = store.lease_ttl
+        self._owned: Set[int] = set()
+        self._workers: Dict[int, asyncio.Task] = {}
+        self.is_leader = False
+
+    async def run(self):
+        """Take part in the cluster until cancelled."""
+        logger.info("Replica %s joining the cluster at %s", self.store.replica_id, self.store.path)
+        try:
+            await asyncio.gather(self._poll_loop(), self._balance_loop(), self._sync_loop())
+        finally:
+            for worker in list(self._workers.values()):
+                worker.cancel()
+            if self.is_leader:
+                await asyncio.to_thread(self.store.release_lease, POLLER_LEASE)
+
+    def leader_only(self, callback):
+        """Wrap a job callback so only the current poller runs it."""
+        async def run_on_leader(context: CallbackContext):
+            if self.is_leader:
+                await callback(context)
+        return run_on_leader
+
+    async def _poll_loop(self):
+        bot = self.application.bot
+        # Keep each long poll well inside the lease so it is renewed in time
+        poll_timeout = max(int(self._lease_ttl / 3), 1)
+        while True:
+            leader = await asyncio.to_thread(self.store.acquire_lease, POLLER_LEASE)
+            if leader != self.is_leader:
+                logger.info("Replica %s %s the poller", self.store.replica_id, "became" if leader else "is no longer")
+                self.is_leader = leader
+                if leader:
+                    await bot.delete_webhook()
+            if not leader:
+                await asyncio.sleep(poll_timeout)
+                continue
+
+            offset = await asyncio.to_thread(self.store.get_offset)
+            try:
+                updates = await bot.get_updates(
+                    offset=offset, timeout=poll_timeout, allowed_updates=Update.ALL_TYPES
+                )
+            except TelegramError as e:
+                logger.error(f"Error fetching updates: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not updates:
+                continue
+
+            rows = [
+                (update.update_id, partition_of(update, self._partitions), json.dumps(update.to_dict()))
+                for update in updates
+            ]
+            await asyncio.to_thread(self.store.enqueue, rows, updates[-1].update_id + 1)
+            logger.debug("Queued %s updates", len(rows))
+
+    async def _balance_loop(self):
+        """Keep this replica's share of the partitions leased."""
+        # Start the scan at a different partition on every replica
+        start = hash(self.store.replica_id) % self._partitions
+        while True:
+            live = await asyncio.to_thread(self.store.heartbeat)
+            share = -(-self._partitions // live)
+
+            # Hand back partitions beyond the fair share; workers finish their current update first
+            for partition in sorted(self._owned)[share:]:
+                self._owned.discard(partition)
+
+            for i in range(self._partitions):
+                if len(self._owned) >= share:
+                    break
+                partition = (start + i) % self._partitions
+                if partition in self._owned or partition in self._workers:
+                    continue
+                if await asyncio.to_thread(self.store.acquire_lease, f"partition:{partition}"):
+                    self._owned.add(partition)
+                    worker = asyncio.get_running_loop().create_task(self._work(partition))
+                    self._workers[partition] = worker
+
+            await asyncio.sleep(self._lease_ttl / 3)
+
+    async def _work(self, partition: int):
+        """Process the queued updates of one partition while it is leased."""
+        lease = f"partition:{partition}"
+        bot = self.application.bot
+        try:
+            while partition in self._owned:
+                if not await asyncio.to_thread(self.store.acquire_lease, lease):
+                    logger.warning(f"Lost the lease on partition {partition}")
+                    break
+                rows = await asyncio.to_thread(self.store.fetch, partition, self._batch_size)
+                if not rows:
+                    await asyncio.sleep(self._idle_interval)
+                    continue
+                for seq, data in rows:
+                    if partition not in self._owned:
+                        break
+                    update = Update.de_json(json.loads(data), bot)
+                    # Application.process_update reports handler errors itself
+                    await self.application.process_update(update)
+                    if not await asyncio.to_thread(self.store.ack, seq, lease):
+                        logger.warning(f"Lost the lease on partition {partition}, leaving update {update.update_id} queued")
+                        return
+        finally:
+            self._owned.discard(partition)
+            self._workers.pop(partition, None)
+            await asyncio.to_thread(self.store.release_lease, lease)
+
+    async def _sync_loop(self):
+        """Pick up the verification state and settings other replicas changed."""
+        while True:
+            await asyncio.sleep(self._sync_interval)
+            try:
+                await asyncio.to_thread(verification_storage.sync)
+                # Only the read runs in a thread; the caches listening for
+                # changes are updated on the loop, where handlers read them
+                chat_settings.reload(await asyncio.to_thread(chat_settings.load))
+            except sqlite3.Error as e:
+                logger.error(f"Error syncing shared state: {e}")
+
+def create_replica(application: Application, path: Optional[str] = None) -> Replica:
+    """
+    Create this process's replica from the configuration.
+    """
+    store = ClusterStore(path or CLUSTER_STORE_PATH, REPLICA_ID)
+    return Replica(application, store)
@@ -1,20 +1,171 @@
 """
 Configuration settings for the Telegram bot application.
 """
+import hashlib
 import os
+import socket
 
 # Telegram Bot API token from environment variable
 TELEGRAM_TOKEN = os.environ.get("TELEGRAM_TOKEN", "placeholder_token_for_development")
-if not TELEGRAM_TOKEN or TELEGRAM_TOKEN == "placeholder_token_for_development":
-    print("Warning: Using placeholder token. Set TELEGRAM_TOKEN environment variable for production.")
+
+# Telegram ID of the main admin (@UMFST_Admin). They can act in every group
+# and receive new member notifications unless a group configures otherwise
+ADMIN_ID = int(os.environ.get("ADMIN_ID", 7582664657))
 
 # Webhook settings
 WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
-if not WEBHOOK_URL and os.environ.get("ENVIRONMENT") == "production":
-    print("Warning: No WEBHOOK_URL environment variable set for production environment.")
+
+# Secret Telegram sends back with every webhook delivery; derived from the
+# token by default so every worker process agrees on it
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or hashlib.sha256(TELEGRAM_TOKEN.encode()).hexdigest()
+# Webhook deliveries queued before new ones are refused with 429
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", 10000))
+# Tasks decoding queued webhook deliveries
+WEBHOOK_CONSUMERS = int(os.environ.get("WEBHOOK_CONSUMERS", 4))
+# Number of recent update ids remembered to drop re-deliveries
+RECENT_UPDATES_SIZE = int(os.environ.get("RECENT_UPDATES_SIZE", 10000))
+# Seconds without updates after which the saved offset is ignored; after a
+# week without updates Telegram picks the next update id at random
+OFFSET_MAX_AGE = float(os.environ.get("OFFSET_MAX_AGE", 6 * 24 * 60 * 60))
+
+# Seconds a getUpdates long poll waits for new updates
+POLL_TIMEOUT = int(os.environ.get("POLL_TIMEOUT", 30))
+# Updates fetched per getUpdates call (Telegram allows at most 100)
+POLL_BATCH_SIZE = int(os.environ.get("POLL_BATCH_SIZE", 100))
 
 # Local development settings
 USE_POLLING = os.environ.get("USE_POLLING", "True").lower() in ("true", "1", "t")
 
 # Flask settings
 SECRET_KEY = os.environ.get("SESSION_SECRET", os.urandom(24).hex())
+
+# Storage settings
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sqlite").lower()
+STORAGE_PATH = os.environ.get("STORAGE_PATH", "verification.db")
+
+# Verification expiry settings
+# Seconds a user may stay unverified before being removed (0 disables expiry)
+VERIFICATION_TIMEOUT = int(os.environ.get("VERIFICATION_TIMEOUT", 24 * 60 * 60))
+EXPIRY_INTERVAL = int(os.environ.get("EXPIRY_INTERVAL", 60))
+EXPIRY_BATCH_SIZE = int(os.environ.get("EXPIRY_BATCH_SIZE", 500))
+
+# Verification levels: verified members can send text at first, media after
+# LEVEL_MEDIA_DELAY seconds and links and invites LEVEL_LINKS_DELAY seconds
+# after that. A delay of 0 skips the wait.
+LEVEL_MEDIA_DELAY = int(os.environ.get("LEVEL_MEDIA_DELAY", 24 * 60 * 60))
+LEVEL_LINKS_DELAY = int(os.environ.get("LEVEL_LINKS_DELAY", 2 * 24 * 60 * 60))
+# Seconds between promotion sweeps
+PROMOTION_INTERVAL = int(os.environ.get("PROMOTION_INTERVAL", 60))
+
+# Join-flood detection: RAID_JOIN_THRESHOLD joins within RAID_WINDOW seconds
+# put a chat in lockdown, which ends RAID_COOLDOWN seconds after the joins
+# slow down. Joiners are restricted in batches every LOCKDOWN_BATCH_INTERVAL seconds
+RAID_JOIN_THRESHOLD = int(os.environ.get("RAID_JOIN_THRESHOLD", 20))
+RAID_WINDOW = float(os.environ.get("RAID_WINDOW", 60))
+RAID_COOLDOWN = float(os.environ.get("RAID_COOLDOWN", 5 * 60))
+LOCKDOWN_BATCH_INTERVAL = float(os.environ.get("LOCKDOWN_BATCH_INTERVAL", 2))
+
+# Spam scoring of joining accounts: scores of SPAM_REJECT_SCORE or more that
+# include a spam-specific signal are removed without asking an admin. If
+# SPAM_TRUST_SCORE is set, scores at or below it are verified straight away;
+# by default every other joiner waits for an admin. Accounts with ids from
+# SPAM_NEW_ID_THRESHOLD on count as recently created
+SPAM_REJECT_SCORE = float(os.environ.get("SPAM_REJECT_SCORE", 5))
+SPAM_TRUST_SCORE = float(os.environ["SPAM_TRUST_SCORE"]) if os.environ.get("SPAM_TRUST_SCORE") else None
+SPAM_NEW_ID_THRESHOLD = int(os.environ.get("SPAM_NEW_ID_THRESHOLD", 8_000_000_000))
+
+# Self-service verification in a private chat with the bot: seconds a
+# challenge stays valid and wrong answers allowed before the member has to
+# wait for it to expire or for an admin
+CHALLENGE_TTL = int(os.environ.get("CHALLENGE_TTL", 10 * 60))
+CHALLENGE_MAX_ATTEMPTS = int(os.environ.get("CHALLENGE_MAX_ATTEMPTS", 3))
+# Domain of the student addresses accepted for email codes (subdomains included)
+STUDENT_EMAIL_DOMAIN = os.environ.get("STUDENT_EMAIL_DOMAIN", "umfst.ro")
+# SMTP server sending the codes. Point it at a local stand-in for testing,
+# e.g. SMTP_HOST=localhost SMTP_PORT=1025 with `python -m aiosmtpd -n`
+SMTP_HOST = os.environ.get("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", 25))
+SMTP_USER = os.environ.get("SMTP_USER", "")
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "False").lower() in ("true", "1", "t")
+SMTP_SENDER = os.environ.get("SMTP_SENDER", f"noreply@{STUDENT_EMAIL_DOMAIN}")
+
+# Outgoing Bot API calls per second, kept under Telegram's ~30/s global limit
+API_RATE_LIMIT = float(os.environ.get("API_RATE_LIMIT", 25))
+
+# Seconds a chat's administrator list is cached before being fetched again
+ADMIN_CACHE_TTL = int(os.environ.get("ADMIN_CACHE_TTL", 600))
+
+# Maximum number of concurrent API calls made by a bulk /verify or /reject
+BULK_CONCURRENCY = int(os.environ.get("BULK_CONCURRENCY", 8))
+
+# Messages per minute the bot may post in a single group (Telegram allows ~20)
+CHAT_MESSAGE_RATE = float(os.environ.get("CHAT_MESSAGE_RATE", 20))
+# Maximum number of Bot API requests awaiting a response at once
+OUTBOUND_MAX_IN_FLIGHT = int(os.environ.get("OUTBOUND_MAX_IN_FLIGHT", 64))
+# How many times a call is retried after a RetryAfter answer
+OUTBOUND_MAX_RETRIES = int(os.environ.get("OUTBOUND_MAX_RETRIES", 3))
+
+# Seconds joins are collected before one combined welcome message is sent
+WELCOME_WINDOW = float(os.environ.get("WELCOME_WINDOW", 3))
+# Maximum number of members greeted by a single welcome message
+WELCOME_MAX_BATCH = int(os.environ.get("WELCOME_MAX_BATCH", 50))
+
+# Secret required to open the dashboard, as ?token= or an X-Dashboard-Token
+# header; the dashboard is not served while it is unset
+DASHBOARD_TOKEN = os.environ.get("DASHBOARD_TOKEN", "")
+# Seconds a dashboard render is reused before it is built again
+DASHBOARD_CACHE_TTL = float(os.environ.get("DASHBOARD_CACHE_TTL", 5))
+
+# Pending users shown per page of /listpending
+LIST_PAGE_SIZE = int(os.environ.get("LIST_PAGE_SIZE", 10))
+
+# Maximum number of updates handled at once across all chats
+MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", 256))
+
+# Cluster settings. With CLUSTER_ENABLED, several replicas share STORAGE_PATH,
+# one of them polls Telegram and updates are spread across all of them
+CLUSTER_ENABLED = os.environ.get("CLUSTER_ENABLED", "False").lower() in ("true", "1", "t")
+CLUSTER_STORE_PATH = os.environ.get("CLUSTER_STORE_PATH", STORAGE_PATH)
+REPLICA_ID = os.environ.get("REPLICA_ID", f"{socket.gethostname()}-{os.getpid()}")
+# Seconds a replica keeps the poller role or a partition without renewing it
+CLUSTER_LEASE_TTL = float(os.environ.get("CLUSTER_LEASE_TTL", 15))
+# Number of partitions chats are spread over; one replica handles a partition at a time
+CLUSTER_PARTITIONS = int(os.environ.get("CLUSTER_PARTITIONS", 16))
+# Seconds between reads of the changes made by other replicas
+CLUSTER_SYNC_INTERVAL = float(os.environ.get("CLUSTER_SYNC_INTERVAL", 1))
+
+# Logging. bot.log gets one JSON object per line and is rotated at
+# LOG_MAX_BYTES, or on the LOG_ROTATE_WHEN schedule ("midnight", "H", ...) if set
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.environ.get("LOG_FILE", "bot.log")
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", 5))
+LOG_ROTATE_WHEN = os.environ.get("LOG_ROTATE_WHEN", "")
+# Share of debug and info records kept per logger, e.g. "httpx=0.01,storage=0.1".
+# Warnings and errors are always kept
+LOG_SAMPLING = os.environ.get("LOG_SAMPLING", "")
+
+# Audit trail of membership decisions, kept in its own SQLite file.
+# An empty AUDIT_PATH turns it off
+AUDIT_PATH = os.environ.get("AUDIT_PATH", "audit.db")
+# Events are written in one transaction once this many are waiting, or every AUDIT_FLUSH_INTERVAL seconds
+AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", 500))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", 1))
+# Rows per CSV file written by the audit export
+AUDIT_EXPORT_ROWS = int(os.environ.get("AUDIT_EXPORT_ROWS", 1_000_000))
+
+# Bot API server, e.g. a local telegram-bot-api instance
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+
+def startup_warnings() -> list:
+    """
+    Configuration problems to report when the bot starts. Importing this
+    module never prints anything; the entry point logs these instead.
+    """
+    warnings = []
+    if not TELEGRAM_TOKEN or TELEGRAM_TOKEN == "placeholder_token_for_development":
+        warnings.append("Using placeholder token. Set TELEGRAM_TOKEN environment variable for production.")
+    if not WEBHOOK_URL and os.environ.get("ENVIRONMENT") == "production":
+        warnings.append("No WEBHOOK_URL environment variable set for production environment.")
+    return warnings
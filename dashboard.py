@@ -0,0 +1,176 @@
+"""
+Live status dashboard for admins.
+Served as JSON and HTML by the bot's web server, from aggregates kept up to
+date as members join and are handled.
+"""
+from datetime import datetime, timezone
+from html import escape
+from typing import Callable, Dict, Tuple
+from urllib.parse import quote
+import hmac
+import json
+import threading
+import time
+
+from config import DASHBOARD_CACHE_TTL, DASHBOARD_TOKEN
+from metrics import ActivityStats, activity
+from storage import MemberVerificationStorage, verification_storage
+
+# Member events shown as hourly rates
+MEMBER_EVENTS = ("join", "verify", "reject", "expire")
+
+def _format_duration(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 60 * 60:
+        return f"{seconds / 60:.1f}m"
+    return f"{seconds / 3600:.1f}h"
+
+class Dashboard:
+    """
+    Builds the dashboard from in-memory aggregates: pending counts per
+    chat from the verification storage and rolling event counts and
+    verification latencies from ActivityStats. The store itself is never
+    scanned.
+
+    Renders are cached for `ttl` seconds and built by one request at a
+    time, so several open dashboards cost one build per `ttl` between
+    them, whichever thread serves them.
+
+    The figures name every chat, so web servers only serve them to
+    requests passing check_token(); without a `token` nobody does.
+    """
+    def __init__(self, ttl: float = DASHBOARD_CACHE_TTL, stats: ActivityStats = activity,
+                 storage: MemberVerificationStorage = verification_storage, clock=time.monotonic,
+                 token: str = DASHBOARD_TOKEN):
+        # Set by the entry point running the bot
+        self.mode = "unknown"
+        self.status = "starting"
+        self._ttl = ttl
+        self._stats = stats
+        self._storage = storage
+        self._clock = clock
+        self._token = token.encode()
+        self._started_at = time.time()
+        self._cache: Dict[str, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def check_token(self, token: str) -> bool:
+        """Check the token a dashboard request came with."""
+        return bool(self._token) and hmac.compare_digest((token or "").encode(), self._token)
+
+    def _cached(self, kind: str, build: Callable[[], str]) -> str:
+        with self._lock:
+            entry = self._cache.get(kind)
+            now = self._clock()
+            if entry is None or now - entry[0] >= self._ttl:
+                entry = (now, build())
+                self._cache[kind] = entry
+            return entry[1]
+
+    def snapshot(self) -> Dict:
+        """Current figures as a JSON-serializable dict."""
+        pending = self._storage.count_pending_by_chat()
+        totals = self._stats.totals()
+        minutes = self._stats.window
+        calls = totals.get("api_call", 0)
+        errors = totals.get("api_error", 0)
+        latency = self._stats.latency_percentiles()
+
+        return {
+            "status": self.status,
+            "mode": self.mode,
+            "uptime_seconds": int(time.time() - self._started_at),
+            "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "window_minutes": minutes,
+            "pending": {
+                "total": sum(pending.values()),
+                "by_chat": {
+                    str(chat_id): count
+                    for chat_id, count in sorted(pending.items(), key=lambda item: item[1], reverse=True)
+                },
+            },
+            "verification_latency_seconds": {
+                "verified": self._stats.verification_count(),
+                **{f"p{percentile:g}": round(value, 1) for percentile, value in latency.items()},
+            },
+            "events_per_hour": {
+                event: round(totals.get(event, 0) * 60 / minutes, 1) for event in MEMBER_EVENTS
+            },
+            "api": {
+                "calls_per_minute": round(calls / minutes, 2),
+                "errors_per_minute": round(errors / minutes, 2),
+                "error_rate": round(errors / calls, 4) if calls else 0.0,
+            },
+        }
+
+    def render_json(self) -> str:
+        return self._cached("json", lambda: json.dumps(self.snapshot()))
+
+    def render_html(self) -> str:
+        return self._cached("html", lambda: self._html(self.snapshot()))
+
+    def _html(self, data: Dict) -> str:
+        latency = data["verification_latency_seconds"]
+        latency_cells = "".join(
+            f"<td>{_format_duration(latency[key]) if key in latency else '–'}</td>" for key in ("p50", "p90", "p99")
+        )
+        rates = "".join(
+            f"<tr><td>{escape(event)}</td><td>{rate:g}</td></tr>" for event, rate in data["events_per_hour"].items()
+        )
+        chats = "".join(
+            f"<tr><td><code>{escape(chat_id)}</code></td><td>{count}</td></tr>"
+            for chat_id, count in data["pending"]["by_chat"].items()
+        ) or '<tr><td colspan="2">Nobody is waiting for verification</td></tr>'
+        api = data["api"]
+
+        return f"""<!DOCTYPE html>
+<html>
+<head>
+    <title>UMFST Verification Bot Dashboard</title>
+    <link href="https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css" rel="stylesheet">
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <meta http-equiv="refresh" content="{max(int(self._ttl), 5)}">
+</head>
+<body data-bs-theme="dark">
+    <div class="container mt-5">
+        <h3>UMFST Verification Bot</h3>
+        <p>
+            <strong>Status:</strong> {escape(data["status"])} &middot;
+            <strong>Mode:</strong> {escape(data["mode"])} &middot;
+            <strong>Uptime:</strong> {_format_duration(data["uptime_seconds"])} &middot;
+            <a href="/api/dashboard?token={escape(quote(self._token.decode()))}">JSON</a>
+        </p>
+        <div class="row mt-4">
+            <div class="col-md-6">
+                <h5>Pending verifications: {data["pending"]["total"]}</h5>
+                <table class="table table-sm">
+                    <tr><th>Chat</th><th>Pending</th></tr>
+                    {chats}
+                </table>
+            </div>
+            <div class="col-md-6">
+                <h5>Time to verification ({latency["verified"]} verified)</h5>
+                <table class="table table-sm">
+                    <tr><th>p50</th><th>p90</th><th>p99</th></tr>
+                    <tr>{latency_cells}</tr>
+                </table>
+                <h5 class="mt-4">Events per hour (last {data["window_minutes"]} minutes)</h5>
+                <table class="table table-sm">
+                    {rates}
+                </table>
+                <h5 class="mt-4">Bot API</h5>
+                <p>
+                    {api["calls_per_minute"]:g} calls/min &middot; {api["errors_per_minute"]:g} errors/min
+                    &middot; error rate {api["error_rate"]:.2%}
+                </p>
+            </div>
+        </div>
+        <p class="text-muted">Generated {escape(data["generated_at"])}</p>
+    </div>
+</body>
+</html>
+"""
+
+# Global dashboard instance
+dashboard = Dashboard()
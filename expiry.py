@@ -0,0 +1,102 @@
+"""
+Automatic expiry of pending verifications.
+Removes users who were not verified within the configured timeout.
+"""
+import asyncio
+import logging
+import time
+from telegram.ext import CallbackContext
+from telegram.error import BadRequest, TelegramError
+
+from audit import AuditEvent, audit_log
+from config import EXPIRY_BATCH_SIZE
+from idempotency import action_log
+from metrics import activity
+from outbound import Priority, outbound
+from storage import chat_settings, verification_storage
+from welcome import Outcome, welcome_aggregator
+
+logger = logging.getLogger(__name__)
+
+# Prevents a slow sweep from overlapping with the next scheduled one
+_sweep_lock = asyncio.Lock()
+
+async def kick_expired_user(bot, chat_id: int, user_id: int, user_data: dict) -> bool:
+    """
+    Kick a user whose verification expired and clean up their welcome message.
+    Returns True if the user was removed from the pending list.
+    """
+    # Takes the verify claim, so an admin or the challenge verifying the
+    # user at the same time either wins or waits for the sweep to pass
+    with action_log.once(chat_id, user_id, "verify") as first:
+        if not first or not verification_storage.is_pending_verification(chat_id, user_id):
+            logger.debug("User %s in chat %s was handled since the expiry sweep started", user_id, chat_id)
+            return False
+        return await _kick(bot, chat_id, user_id, user_data)
+
+async def _kick(bot, chat_id: int, user_id: int, user_data: dict) -> bool:
+    try:
+        # Ban and immediately unban, the same "kick" as /reject
+        await outbound.call(bot.ban_chat_member, priority=Priority.BACKGROUND, chat_id=chat_id, user_id=user_id)
+        await outbound.call(bot.unban_chat_member, priority=Priority.BACKGROUND, chat_id=chat_id, user_id=user_id)
+    except BadRequest as e:
+        # The user already left or the bot lost its rights; retrying won't help
+        logger.warning(f"Could not kick expired user {user_id} from chat {chat_id}: {e}")
+    except TelegramError as e:
+        logger.error(f"Error kicking expired user {user_id} from chat {chat_id}: {e}")
+        return False
+
+    verification_storage.remove_pending_verification(chat_id, user_id)
+    activity.record("expire")
+    audit_log.record(AuditEvent.EXPIRE, chat_id, user_id, joined_at=user_data.get("joined_at"))
+
+    # Shared welcome messages are edited; a message nobody else needs is deleted
+    message_id = user_data.get("message_id")
+    handled = welcome_aggregator.mark_handled(bot, chat_id, user_id, message_id, Outcome.EXPIRED)
+    if message_id and not handled and not verification_storage.get_users_by_message(chat_id, message_id):
+        try:
+            await outbound.call(bot.delete_message, priority=Priority.BACKGROUND, chat_id=chat_id, message_id=message_id)
+        except TelegramError as e:
+            logger.debug("Could not delete welcome message %s in chat %s: %s", message_id, chat_id, e)
+
+    logger.info("User %s removed from chat %s after verification timeout", user_id, chat_id)
+    return True
+
+async def expire_pending_verifications(bot, batch_size: int = EXPIRY_BATCH_SIZE) -> int:
+    """
+    Kick up to `batch_size` users pending for longer than their chat's
+    verification timeout, oldest first. Returns the number of users removed.
+    """
+    timeouts = [timeout for timeout in chat_settings.values("verification_timeout") if timeout > 0]
+    if not timeouts:
+        return 0
+
+    # Fetch with the shortest timeout in use, then apply each chat's own
+    now = time.time()
+    expired = [
+        (chat_id, user_id, user_data)
+        for chat_id, user_id, user_data in verification_storage.get_pending_older_than(min(timeouts), now)
+        if 0 < chat_settings.get(chat_id, "verification_timeout") <= now - user_data["joined_at"]
+    ]
+    if not expired:
+        return 0
+
+    expired.sort(key=lambda entry: entry[2]["joined_at"])
+    removed = 0
+    for chat_id, user_id, user_data in expired[:batch_size]:
+        if await kick_expired_user(bot, chat_id, user_id, user_data):
+            removed += 1
+
+    logger.info("Expiry sweep removed %s of %s expired users", removed, len(expired))
+    return removed
+
+async def expiry_job(context: CallbackContext):
+    """
+    JobQueue callback running one expiry sweep.
+    """
+    if _sweep_lock.locked():
+        logger.debug("Previous expiry sweep still running, skipping")
+        return
+
+    async with _sweep_lock:
+        await expire_pending_verifications(context.bot)
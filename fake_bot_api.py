@@ -0,0 +1,106 @@
+"""
+Local stand-in for the Telegram Bot API, used by the benchmarks.
+Answers every method with a plausible result after an optional delay and
+counts the calls, so a bot started with TELEGRAM_API_URL pointing here can
+be timed without a token or network access.
+"""
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import json
+import threading
+import time
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+
+def _result(method: str, params: dict):
+    if method == "getMe":
+        return BOT_USER
+    if method == "getUpdates":
+        return []
+    if method == "getUserProfilePhotos":
+        return {"total_count": 1, "photos": []}
+    if method == "getChatAdministrators":
+        return []
+    if method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+        try:
+            chat_id = int(json.loads(params.get("chat_id", "0")))
+        except ValueError:
+            chat_id = 0
+        return {
+            "message_id": 1, "date": int(time.time()), "from": BOT_USER,
+            "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+            "text": "",
+        }
+    return True
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "FakeBotAPI"
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        method = self.path.rsplit("/", 1)[-1]
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            params = {key: json.dumps(value) for key, value in json.loads(body or b"{}").items()}
+        else:
+            params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        reply = json.dumps({"ok": True, "result": _result(method, params)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+        self.server.count(method)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeBotAPI(ThreadingHTTPServer):
+    """
+    Bot API stand-in on a free local port, answering each call after
+    `latency` seconds. Use as a context manager; `url` is the value for
+    TELEGRAM_API_URL.
+    """
+    daemon_threads = True
+    # The bot opens up to OUTBOUND_MAX_IN_FLIGHT connections at once
+    request_queue_size = 256
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._cond = threading.Condition()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, method: str):
+        with self._cond:
+            self.calls[method] += 1
+            self._cond.notify_all()
+
+    def wait_for(self, method: str, count: int = 1, timeout: float = None) -> bool:
+        """Wait until `method` was answered `count` times in total."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.calls[method] >= count, timeout)
+
+    def handle_error(self, request, client_address):
+        # Connections cut by a bot process shutting down are expected
+        pass
+
+    def reset(self):
+        with self._cond:
+            self.calls.clear()
+
+    def __enter__(self) -> "FakeBotAPI":
+        threading.Thread(target=self.serve_forever, name="fake-bot-api", daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
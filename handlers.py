@@ -1,140 +1,266 @@
 """
 Handler functions for Telegram bot events and commands.
 """
+import asyncio
 import logging
-from telegram import Update, ChatMember
+from functools import partial
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import CallbackContext
-from telegram.error import TelegramError
+from telegram.error import BadRequest, TelegramError
 
-from storage import verification_storage
-from utils import get_restricted_permissions, get_full_permissions, get_user_name, is_admin
+from admin_cache import admin_cache
+from audit import AuditEvent, audit_log
+from config import BULK_CONCURRENCY, LIST_PAGE_SIZE
+from idempotency import action_log
+from levels import grant_level
+from metrics import activity
+from outbound import Priority, outbound, reply_to
+from raid import raid_guard
+from scoring import Verdict, apply_verdict, spam_scoring
+from storage import chat_settings, verification_storage
+from templates import permissions, templates
+from utils import get_user_name, get_display_name, is_admin
+from welcome import Outcome, welcome_aggregator
 
 logger = logging.getLogger(__name__)
 
-def new_member_handler(update: Update, context: CallbackContext):
+# Telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+
+# Callback data prefix of the /listpending buttons
+LIST_CALLBACK_PREFIX = "lp"
+
+async def is_chat_admin(bot, chat_id: int, user_id: int) -> bool:
     """
-    Handle new members joining the chat.
-    Restrict their permissions and notify them about verification.
+    Check if a user is one of the chat's Telegram administrators or an
+    extra admin configured for the chat. Raises TelegramError if the
+    administrators can't be fetched.
     """
-    if not update.message or not update.message.new_chat_members:
-        return
+    if user_id in chat_settings.get(chat_id, "admin_ids"):
+        return True
+    return await admin_cache.is_admin(bot, chat_id, user_id)
+
+async def check_admin(update: Update, context: CallbackContext) -> bool:
+    """
+    Check if the sender of a command is an admin of the chat,
+    replying with an explanation if they are not.
+    """
+    chat_id = update.effective_chat.id
+    user_id = update.effective_user.id
     
+    try:
+        if await is_chat_admin(context.bot, chat_id, user_id):
+            return True
+        await reply_to(update.message, "Only admins can use this command.")
+    except TelegramError as e:
+        logger.error(f"Error checking admin status for user {user_id}: {e}")
+        await reply_to(update.message, "Failed to verify admin status. Please try again later.")
+    
+    return False
+
+async def welcome_new_member(update: Update, context: CallbackContext, new_member):
+    """
+    Restrict a new member and queue them for the combined welcome message.
+    """
     chat_id = update.effective_chat.id
+    user_id = new_member.id
     
-    # Process each new member
-    for new_member in update.message.new_chat_members:
-        # Skip if the new member is the bot itself
-        if new_member.id == context.bot.id:
-            logger.info(f"Bot was added to group {chat_id}")
-            continue
-        
-        user_id = new_member.id
+    # A replayed join, or a user still pending from an earlier join, needs nothing new
+    if verification_storage.is_pending_verification(chat_id, user_id):
+        return
+    with action_log.once(chat_id, user_id, "join") as first:
+        # The same join is already being handled
+        if not first:
+            return
+        audit_log.record(AuditEvent.JOIN, chat_id, user_id, actor_id=update.effective_user.id)
+        # During a join flood the raid guard restricts joiners silently in batches
+        if raid_guard.on_join(context.bot, chat_id, new_member, chat_title=update.effective_chat.title):
+            return
+        # Obvious spam accounts are removed and obviously genuine ones verified without an admin
+        score = await spam_scoring.evaluate(new_member, context.bot)
+        if score.verdict != Verdict.REVIEW:
+            try:
+                await apply_verdict(context.bot, chat_id, new_member, score)
+            except TelegramError as e:
+                logger.error(f"Error handling scored member {user_id} in chat {chat_id}: {e}")
+            return
         
         try:
             # Restrict the new member
-            context.bot.restrict_chat_member(
-                chat_id=chat_id,
-                user_id=user_id,
-                permissions=get_restricted_permissions()
-            )
-            
-            # Send verification message
-            user_name = get_user_name(new_member)
-            welcome_message = (
-                f"👋 Welcome {user_name}!\n\n"
-                f"To prevent spam, you've been temporarily restricted from sending messages "
-                f"in this group until an admin verifies you.\n\n"
-                f"Admins can use /verify {user_id} to approve or /reject {user_id} to remove this user."
-            )
-            
-            message = update.message.reply_text(welcome_message)
-            
-            # Store the pending verification
-            verification_storage.add_pending_verification(
+            await outbound.call(
+                context.bot.restrict_chat_member,
+                priority=Priority.MODERATION,
                 chat_id=chat_id,
                 user_id=user_id,
-                username=new_member.username,
-                first_name=new_member.first_name,
-                last_name=new_member.last_name,
-                message_id=message.message_id
+                permissions=permissions.get("restricted"),
+                use_independent_chat_permissions=True
             )
-            
-            logger.info(f"New member {user_id} restricted in chat {chat_id}, awaiting verification")
-            
+            audit_log.record(AuditEvent.RESTRICT, chat_id, user_id)
         except TelegramError as e:
             logger.error(f"Error restricting new member {user_id} in chat {chat_id}: {e}")
+            return
+        
+        # Store the pending verification, the welcome message id is filled in once it is sent
+        verification_storage.add_pending_verification(
+            chat_id=chat_id,
+            user_id=user_id,
+            username=new_member.username,
+            first_name=new_member.first_name,
+            last_name=new_member.last_name
+        )
+        welcome_aggregator.add_member(context.bot, chat_id, new_member)
+    
+    logger.info("New member %s restricted in chat %s, awaiting verification", user_id, chat_id)
 
-def verify_command_handler(update: Update, context: CallbackContext):
+async def new_member_handler(update: Update, context: CallbackContext):
     """
-    Handle /verify command from admins.
-    Grant permissions to a verified user.
+    Handle new members joining the chat.
+    Restrict their permissions and notify them about verification.
     """
-    if not update.message:
+    if not update.message or not update.message.new_chat_members:
         return
     
     chat_id = update.effective_chat.id
-    user_id = update.effective_user.id
     
-    # Check if command sender is an admin
-    try:
-        chat_member = context.bot.get_chat_member(chat_id, user_id)
-        if not is_admin(chat_member):
-            update.message.reply_text("Only admins can use this command.")
-            return
-    except TelegramError as e:
-        logger.error(f"Error checking admin status for user {user_id}: {e}")
-        update.message.reply_text("Failed to verify admin status. Please try again later.")
-        return
-    
-    # Get the user ID to verify
-    if not context.args:
-        update.message.reply_text("Please specify a user ID to verify.\nUsage: /verify USER_ID")
-        return
+    # Process each new member
+    new_members = []
+    for new_member in update.message.new_chat_members:
+        # Skip if the new member is the bot itself
+        if new_member.id == context.bot.id:
+            logger.info("Bot was added to group %s", chat_id)
+            continue
+        new_members.append(new_member)
     
-    try:
-        target_user_id = int(context.args[0])
-    except ValueError:
-        update.message.reply_text("Invalid user ID. Please use a numeric ID.")
-        return
+    await asyncio.gather(*(welcome_new_member(update, context, new_member) for new_member in new_members))
+
+def resolve_target_users(chat_id: int, args):
+    """
+    Resolve the arguments of /verify or /reject into pending user ids.
     
-    # Check if user is pending verification
-    user_data = verification_storage.get_pending_verification(chat_id, target_user_id)
-    if not user_data:
-        update.message.reply_text("This user is not pending verification or has already been verified.")
-        return
+    Accepts numeric ids, @usernames, id ranges (FIRST-LAST, matching the
+    pending users whose id falls in the range) and the keyword "all".
+    Returns the matched ids in order, without duplicates, and the
+    arguments that did not match any pending user.
+    """
+    pending_users = verification_storage.get_all_pending_users(chat_id)
+    targets = {}
+    unresolved = []
     
-    try:
-        # Grant permissions to the user
-        context.bot.restrict_chat_member(
-            chat_id=chat_id,
-            user_id=target_user_id,
-            permissions=get_full_permissions()
-        )
+    for arg in args:
+        if arg.lower() == "all":
+            targets.update(dict.fromkeys(pending_users))
+            continue
         
-        # Get user's name or ID for the message
-        try:
-            target_member = context.bot.get_chat_member(chat_id, target_user_id)
-            user_name = get_user_name(target_member.user)
-        except TelegramError:
-            user_name = f"User {target_user_id}"
+        if arg.isdigit():
+            if int(arg) in pending_users:
+                targets[int(arg)] = None
+            else:
+                unresolved.append(arg)
+            continue
         
-        # Remove from pending verification
-        verification_storage.remove_pending_verification(chat_id, target_user_id)
+        first, separator, last = arg.partition("-")
+        if separator and first.isdigit() and last.isdigit():
+            low, high = sorted((int(first), int(last)))
+            matched = [user_id for user_id in pending_users if low <= user_id <= high]
+            if matched:
+                targets.update(dict.fromkeys(matched))
+            else:
+                unresolved.append(arg)
+            continue
         
-        # Send verification success message
-        admin_name = get_user_name(update.effective_user)
-        update.message.reply_text(f"✅ {user_name} has been verified by {admin_name}. Welcome to the group!")
+        pending = verification_storage.find_pending_by_username(arg, chat_id)
+        if pending and pending[0] == chat_id:
+            targets[pending[1]] = None
+        else:
+            unresolved.append(arg)
+    
+    return list(targets), unresolved
+
+async def verify_user(bot, chat_id: int, user_id: int, actor_id: int = None, detail: str = ""):
+    """
+    Grant the first verification level to a pending user and remove them from the pending list.
+    `actor_id` is who verified them and `detail` how, for the audit log.
+    """
+    with action_log.once(chat_id, user_id, "verify") as first:
+        if not first:
+            return
+        user_data = verification_storage.get_pending_verification(chat_id, user_id)
+        # Recording the level also ends the pending verification
+        await grant_level(bot, chat_id, user_id)
+        audit_log.record(AuditEvent.VERIFY, chat_id, user_id, actor_id, user_data["joined_at"] if user_data else None,
+                         detail=detail)
+        if user_data:
+            activity.record_verification(user_data["joined_at"])
+            welcome_aggregator.mark_handled(bot, chat_id, user_id, user_data.get("message_id"), Outcome.VERIFIED)
+
+async def reject_user(bot, chat_id: int, user_id: int, actor_id: int = None):
+    """
+    Kick a pending user from the group and remove them from the pending list.
+    `actor_id` is who rejected them, for the audit log.
+    """
+    with action_log.once(chat_id, user_id, "reject") as first:
+        if not first:
+            return
+        # Ban the user
+        await outbound.call(bot.ban_chat_member, priority=Priority.MODERATION, chat_id=chat_id, user_id=user_id)
         
-        logger.info(f"User {target_user_id} verified in chat {chat_id} by admin {user_id}")
+        # Immediately unban to convert it to a "kick" (not a permanent ban)
+        await outbound.call(bot.unban_chat_member, priority=Priority.MODERATION, chat_id=chat_id, user_id=user_id)
+        activity.record("reject")
         
-    except TelegramError as e:
-        logger.error(f"Error verifying user {target_user_id} in chat {chat_id}: {e}")
-        update.message.reply_text(f"Failed to verify user: {e}")
+        user_data = verification_storage.remove_pending_verification(chat_id, user_id)
+        audit_log.record(AuditEvent.REJECT, chat_id, user_id, actor_id, user_data["joined_at"] if user_data else None)
+        if user_data:
+            welcome_aggregator.mark_handled(bot, chat_id, user_id, user_data.get("message_id"), Outcome.REJECTED)
 
-def reject_command_handler(update: Update, context: CallbackContext):
+async def apply_to_users(bot, chat_id: int, user_ids, action):
     """
-    Handle /reject command from admins.
-    Remove a user from the group.
+    Run `action(bot, chat_id, user_id)` for every user concurrently,
+    with at most BULK_CONCURRENCY actions in flight.
+    Returns the ids that succeeded and a {user_id: error} dict of failures.
+    """
+    semaphore = asyncio.BoundedSemaphore(BULK_CONCURRENCY)
+    
+    async def run(user_id):
+        async with semaphore:
+            await action(bot, chat_id, user_id)
+    
+    results = await asyncio.gather(*(run(user_id) for user_id in user_ids), return_exceptions=True)
+    
+    succeeded = []
+    failed = {}
+    for user_id, result in zip(user_ids, results):
+        if isinstance(result, TelegramError):
+            failed[user_id] = result
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            succeeded.append(user_id)
+    
+    return succeeded, failed
+
+def format_bulk_summary(verb: str, admin_name: str, names, failed_names, unresolved) -> str:
+    """
+    Build the single reply summarizing a bulk /verify or /reject,
+    keeping it under Telegram's message length limit.
+    """
+    lines = []
+    if names:
+        lines.append(f"{verb} {len(names)} user(s) by {admin_name}: {', '.join(names)}")
+    if failed_names:
+        lines.append(f"\nFailed for {len(failed_names)} user(s):")
+        lines.extend(f"• {name}: {error}" for name, error in failed_names)
+    if unresolved:
+        lines.append(f"\nNot pending verification: {', '.join(unresolved)}")
+    
+    summary = "\n".join(lines)
+    if len(summary) > MAX_MESSAGE_LENGTH:
+        summary = summary[:MAX_MESSAGE_LENGTH - 1] + "…"
+    return summary
+
+async def bulk_command(update: Update, context: CallbackContext, command: str, action, verb: str, single_message: str):
+    """
+    Shared implementation of /verify and /reject for one or many users.
     """
     if not update.message:
         return
@@ -143,139 +269,220 @@ def reject_command_handler(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
     
     # Check if command sender is an admin
-    try:
-        chat_member = context.bot.get_chat_member(chat_id, user_id)
-        if not is_admin(chat_member):
-            update.message.reply_text("Only admins can use this command.")
-            return
-    except TelegramError as e:
-        logger.error(f"Error checking admin status for user {user_id}: {e}")
-        update.message.reply_text("Failed to verify admin status. Please try again later.")
+    if not await check_admin(update, context):
         return
     
-    # Get the user ID to reject
+    # Get the users to act on
     if not context.args:
-        update.message.reply_text("Please specify a user ID to reject.\nUsage: /reject USER_ID")
+        await reply_to(update.message, 
+            f"Please specify the users to {command}.\n"
+            f"Usage: /{command} USER_ID [USER_ID ...] | @username | FIRST_ID-LAST_ID | all"
+        )
         return
     
-    try:
-        target_user_id = int(context.args[0])
-    except ValueError:
-        update.message.reply_text("Invalid user ID. Please use a numeric ID.")
+    target_user_ids, unresolved = resolve_target_users(chat_id, context.args)
+    if not target_user_ids:
+        await reply_to(update.message, "This user is not pending verification or has already been verified.")
         return
     
-    # Check if user is pending verification
-    user_data = verification_storage.get_pending_verification(chat_id, target_user_id)
-    if not user_data:
-        update.message.reply_text("This user is not pending verification or has already been verified.")
-        return
+    # Keep the stored names, the pending entries are removed by the action
+    pending_users = verification_storage.get_all_pending_users(chat_id)
+    names = {target: get_display_name(target, pending_users.get(target)) for target in target_user_ids}
     
-    try:
-        # Get user's name or ID for the message
-        try:
-            target_member = context.bot.get_chat_member(chat_id, target_user_id)
-            user_name = get_user_name(target_member.user)
-        except TelegramError:
-            user_name = f"User {target_user_id}"
-        
-        # Ban the user
-        context.bot.ban_chat_member(chat_id=chat_id, user_id=target_user_id)
-        
-        # Immediately unban to convert it to a "kick" (not a permanent ban)
-        context.bot.unban_chat_member(chat_id=chat_id, user_id=target_user_id)
-        
-        # Remove from pending verification
-        verification_storage.remove_pending_verification(chat_id, target_user_id)
-        
-        # Send rejection message
-        admin_name = get_user_name(update.effective_user)
-        update.message.reply_text(f"❌ {user_name} has been rejected and removed from the group by {admin_name}.")
-        
-        logger.info(f"User {target_user_id} rejected in chat {chat_id} by admin {user_id}")
-        
-    except TelegramError as e:
-        logger.error(f"Error rejecting user {target_user_id} in chat {chat_id}: {e}")
-        update.message.reply_text(f"Failed to reject user: {e}")
+    succeeded, failed = await apply_to_users(context.bot, chat_id, target_user_ids, partial(action, actor_id=user_id))
+    
+    admin_name = get_user_name(update.effective_user)
+    if len(succeeded) == 1 and not failed and not unresolved:
+        await reply_to(update.message, single_message.format(user_name=names[succeeded[0]], admin_name=admin_name))
+    else:
+        await reply_to(update.message, format_bulk_summary(
+            verb,
+            admin_name,
+            [names[target] for target in succeeded],
+            [(names[target], error) for target, error in failed.items()],
+            unresolved
+        ))
+    
+    for target, error in failed.items():
+        logger.error(f"Error running /{command} for user {target} in chat {chat_id}: {error}")
+    logger.info("/%s by admin %s in chat %s: %s succeeded, %s failed", command, user_id, chat_id, len(succeeded), len(failed))
+
+async def verify_command_handler(update: Update, context: CallbackContext):
+    """
+    Handle /verify command from admins.
+    Grant permissions to one or more verified users.
+    """
+    await bulk_command(
+        update, context, "verify", verify_user, "✅ Verified",
+        "✅ {user_name} has been verified by {admin_name}. Welcome to the group!"
+    )
 
-def list_pending_command_handler(update: Update, context: CallbackContext):
+async def reject_command_handler(update: Update, context: CallbackContext):
+    """
+    Handle /reject command from admins.
+    Remove one or more users from the group.
+    """
+    await bulk_command(
+        update, context, "reject", reject_user, "❌ Rejected and removed",
+        "❌ {user_name} has been rejected and removed from the group by {admin_name}."
+    )
+
+def format_pending_user(user_id: int, user_data) -> str:
+    """
+    Format one line of the pending users list.
+    """
+    username = user_data.get("username", "")
+    first_name = user_data.get("first_name", "")
+    last_name = user_data.get("last_name", "")
+    
+    user_display = ""
+    if username:
+        user_display += f"@{username} "
+    if first_name or last_name:
+        name_parts = []
+        if first_name:
+            name_parts.append(first_name)
+        if last_name:
+            name_parts.append(last_name)
+        user_display += f"({' '.join(name_parts)})"
+    
+    if not user_display:
+        user_display = f"User {user_id}"
+    
+    return f"• {user_display} - ID: {user_id}"
+
+def render_pending_page(chat_id: int, page: int):
+    """
+    Build the text and inline keyboard for one page of pending users.
+    Only the users on the requested page are read from storage.
+    Returns (None, None) if nobody is pending.
+    """
+    total = verification_storage.count_pending(chat_id)
+    if not total:
+        return None, None
+    
+    page_count = (total + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE
+    page = max(0, min(page, page_count - 1))
+    users = verification_storage.get_pending_page(chat_id, page * LIST_PAGE_SIZE, LIST_PAGE_SIZE)
+    
+    lines = [f"Users awaiting verification ({total}), page {page + 1}/{page_count}:\n"]
+    keyboard = []
+    for user_id, user_data in users:
+        lines.append(format_pending_user(user_id, user_data))
+        name = get_display_name(user_id, user_data)
+        keyboard.append([
+            InlineKeyboardButton(f"✅ {name}", callback_data=f"{LIST_CALLBACK_PREFIX}:v:{user_id}:{page}"),
+            InlineKeyboardButton("❌ Reject", callback_data=f"{LIST_CALLBACK_PREFIX}:r:{user_id}:{page}")
+        ])
+    
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("◀ Prev", callback_data=f"{LIST_CALLBACK_PREFIX}:p:{page - 1}"))
+    if page < page_count - 1:
+        navigation.append(InlineKeyboardButton("Next ▶", callback_data=f"{LIST_CALLBACK_PREFIX}:p:{page + 1}"))
+    if navigation:
+        keyboard.append(navigation)
+    
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+async def list_pending_command_handler(update: Update, context: CallbackContext):
     """
     Handle /listpending command from admins.
-    List all users awaiting verification.
+    Show the first page of users awaiting verification, with buttons to
+    verify or reject them and to move between pages.
     """
     if not update.message:
         return
     
     chat_id = update.effective_chat.id
-    user_id = update.effective_user.id
     
     # Check if command sender is an admin
+    if not await check_admin(update, context):
+        return
+    
+    text, keyboard = render_pending_page(chat_id, 0)
+    if text is None:
+        await reply_to(update.message, "No users are currently awaiting verification.")
+        return
+    
+    await reply_to(update.message, text, reply_markup=keyboard)
+
+async def list_pending_callback_handler(update: Update, context: CallbackContext):
+    """
+    Handle the inline buttons of the /listpending message.
+    Verifies, rejects or changes page, then edits the same message.
+    """
+    query = update.callback_query
+    chat_id = query.message.chat.id
+    
     try:
-        chat_member = context.bot.get_chat_member(chat_id, user_id)
-        if not is_admin(chat_member):
-            update.message.reply_text("Only admins can use this command.")
+        if not await is_chat_admin(context.bot, chat_id, query.from_user.id):
+            await outbound.call(query.answer, text="Only admins can use these buttons.", show_alert=True)
             return
     except TelegramError as e:
-        logger.error(f"Error checking admin status for user {user_id}: {e}")
-        update.message.reply_text("Failed to verify admin status. Please try again later.")
+        logger.error(f"Error checking admin status for user {query.from_user.id}: {e}")
+        await outbound.call(query.answer, text="Failed to verify admin status. Please try again later.")
         return
     
-    # Get all pending users
-    pending_users = verification_storage.get_all_pending_users(chat_id)
+    _, action, *values = query.data.split(":")
+    page = int(values[-1])
+    notice = None
     
-    if not pending_users:
-        update.message.reply_text("No users are currently awaiting verification.")
-        return
+    if action in ("v", "r"):
+        target_user_id = int(values[0])
+        user_data = verification_storage.get_pending_verification(chat_id, target_user_id)
+        user_name = get_display_name(target_user_id, user_data)
+        if not user_data:
+            notice = f"{user_name} is no longer pending verification."
+        else:
+            try:
+                if action == "v":
+                    await verify_user(context.bot, chat_id, target_user_id, actor_id=query.from_user.id)
+                    notice = f"✅ {user_name} has been verified."
+                else:
+                    await reject_user(context.bot, chat_id, target_user_id, actor_id=query.from_user.id)
+                    notice = f"❌ {user_name} has been rejected and removed."
+                logger.info("User %s handled (%s) in chat %s by admin %s", target_user_id, action, chat_id, query.from_user.id)
+            except TelegramError as e:
+                logger.error(f"Error handling user {target_user_id} in chat {chat_id}: {e}")
+                notice = f"Failed to update {user_name}: {e}"
     
-    # Build message with list of pending users
-    message = "Users awaiting verification:\n\n"
+    await outbound.call(query.answer, text=notice)
     
-    for user_id, user_data in pending_users.items():
-        username = user_data.get("username", "")
-        first_name = user_data.get("first_name", "")
-        last_name = user_data.get("last_name", "")
-        
-        user_display = ""
-        if username:
-            user_display += f"@{username} "
-        if first_name or last_name:
-            name_parts = []
-            if first_name:
-                name_parts.append(first_name)
-            if last_name:
-                name_parts.append(last_name)
-            user_display += f"({' '.join(name_parts)})"
-        
-        if not user_display:
-            user_display = f"User {user_id}"
-        
-        message += f"• {user_display} - ID: {user_id}\n"
-        message += f"  Commands: /verify {user_id} | /reject {user_id}\n\n"
+    text, keyboard = render_pending_page(chat_id, page)
+    try:
+        await outbound.call(
+            context.bot.edit_message_text,
+            chat_id=chat_id,
+            message_id=query.message.message_id,
+            text=text or "No users are currently awaiting verification.",
+            reply_markup=keyboard
+        )
+    except BadRequest as e:
+        # Raised when the page did not change, e.g. double taps
+        logger.debug("Could not edit pending list in chat %s: %s", chat_id, e)
+
+async def chat_member_update_handler(update: Update, context: CallbackContext):
+    """
+    Handle chat member status changes.
+    Drop the cached admin list when someone is promoted or demoted.
+    """
+    member_update = update.chat_member
+    if not member_update:
+        return
     
-    update.message.reply_text(message)
+    if is_admin(member_update.old_chat_member) != is_admin(member_update.new_chat_member):
+        admin_cache.invalidate(member_update.chat.id)
 
-def help_command_handler(update: Update, context: CallbackContext):
+async def help_command_handler(update: Update, context: CallbackContext):
     """
     Handle /help command to provide information about the bot.
     """
-    help_text = (
-        "🤖 *Verification Bot Help* 🤖\n\n"
-        "*For Admins:*\n"
-        "/verify USER_ID - Approve a user and grant chat permissions\n"
-        "/reject USER_ID - Remove a user from the group\n"
-        "/listpending - Show all users awaiting verification\n"
-        "/help - Show this help message\n\n"
-        "*How it works:*\n"
-        "1. When new users join, they are restricted from sending messages\n"
-        "2. An admin must verify them using the /verify command\n"
-        "3. Once verified, users can participate in the chat\n"
-        "4. Alternatively, admins can reject users with /reject"
-    )
-    
-    update.message.reply_text(help_text, parse_mode="Markdown")
+    await reply_to(update.message, templates.render("help"), parse_mode=templates.parse_mode("help"))
 
-def error_handler(update: object, context: CallbackContext) -> None:
+async def error_handler(update: object, context: CallbackContext) -> None:
     """
-    Handle errors in the dispatcher.
+    Handle errors raised while processing updates.
     Log them for debugging.
     """
     logger.error(f"Exception while handling an update: {context.error}")
@@ -0,0 +1,160 @@
+"""
+Protection against handling the same update or action twice.
+Telegram re-delivers updates after timeouts and restarts; these helpers
+make sure a replay causes no extra API calls.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Set, Tuple
+import logging
+import threading
+import time
+
+from config import OFFSET_MAX_AGE, RECENT_UPDATES_SIZE
+from storage import backend
+from storage_backend import StorageBackend, MemoryBackend
+
+logger = logging.getLogger(__name__)
+
+class RecentUpdateIds:
+    """
+    Bounded set of the update ids seen most recently.
+    Telegram re-delivers an update when it gets no answer in time, and
+    those copies are recognised here.
+    """
+    def __init__(self, size: int = RECENT_UPDATES_SIZE):
+        self._size = size
+        self._ids: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, update_id: int) -> bool:
+        """Remember an update id. Returns False if it was already seen."""
+        with self._lock:
+            if update_id in self._ids:
+                return False
+            self._ids[update_id] = None
+            if len(self._ids) > self._size:
+                self._ids.popitem(last=False)
+            return True
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+class ProcessedUpdates:
+    """
+    Tracks which updates were handled, across restarts.
+
+    Recent ids are kept in a RecentUpdateIds set. On top of it, the
+    highest id below which every update has finished (the offset) is saved
+    to the backend at most every `checkpoint_interval` seconds, and any
+    update at or below the saved offset is ignored after a restart.
+
+    After a week without updates Telegram picks the next update id at
+    random, possibly below the offset. An offset with no update for
+    `max_age` seconds, whether loaded or in memory, is therefore dropped
+    and only the recent ids are checked until updates move it again.
+    """
+    def __init__(self, backend: StorageBackend = None, size: int = RECENT_UPDATES_SIZE,
+                 checkpoint_interval: float = 1.0, clock=time.monotonic,
+                 max_age: float = OFFSET_MAX_AGE, wall_clock=time.time):
+        self._backend = backend or MemoryBackend()
+        self._recent = RecentUpdateIds(size)
+        self._checkpoint_interval = checkpoint_interval
+        self._clock = clock
+        self._max_age = max_age
+        self._wall_clock = wall_clock
+        self._lock = threading.Lock()
+        self._in_flight: Set[int] = set()
+        self.offset, saved_at = self._backend.load_offset()
+        self._highest = self.offset
+        self._saved = self.offset
+        self._saved_at = clock()
+        # An offset saved without a time predates this check and may be stale
+        self._seen_at = saved_at or 0.0
+        self._expire_offset(wall_clock())
+
+    def _expire_offset(self, now: float):
+        """Drop the offset if no update moved past it for `max_age` seconds."""
+        if self.offset and now - self._seen_at >= self._max_age:
+            logger.info("Ignoring offset %s, too old to trust: Telegram restarts update ids "
+                        "after a week without updates", self.offset)
+            self.offset = self._highest = self._saved = 0
+
+    def begin(self, update_id: int) -> bool:
+        """Mark an update as being handled. Returns False for a duplicate."""
+        with self._lock:
+            now = self._wall_clock()
+            self._expire_offset(now)
+            self._seen_at = now
+            duplicate = update_id <= self.offset
+        if duplicate or not self._recent.add(update_id):
+            logger.debug("Ignoring duplicate update %s", update_id)
+            return False
+        with self._lock:
+            self._in_flight.add(update_id)
+            self._highest = max(self._highest, update_id)
+        return True
+
+    def finish(self, update_id: int):
+        """Mark an update as handled and checkpoint the offset if it is due."""
+        with self._lock:
+            self._in_flight.discard(update_id)
+            self.offset = min(self._in_flight) - 1 if self._in_flight else self._highest
+        if self._clock() - self._saved_at >= self._checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Save the current offset if it moved."""
+        offset = self.offset
+        self._saved_at = self._clock()
+        if offset > self._saved:
+            self._backend.save_offset(offset)
+            self._saved = offset
+
+class ActionLog:
+    """
+    Claims (chat_id, user_id, action) moderation steps while they run, so
+    the same join, verify or reject arriving twice at once, e.g. from two
+    admins, makes its API calls only once.
+
+    Nothing is remembered once a step finishes: replayed updates are
+    dropped by ProcessedUpdates, and a member who is rejected and joins
+    again, or an admin repeating an action, must be handled again.
+    """
+    def __init__(self):
+        self._in_flight: Set[Tuple[int, int, str]] = set()
+        self._lock = threading.Lock()
+
+    def begin(self, chat_id: int, user_id: int, action: str) -> bool:
+        """Claim an action. Returns False if it is already running."""
+        key = (chat_id, user_id, action)
+        with self._lock:
+            if key in self._in_flight:
+                return False
+            self._in_flight.add(key)
+            return True
+
+    def finish(self, chat_id: int, user_id: int, action: str):
+        """Release a claimed action."""
+        with self._lock:
+            self._in_flight.discard((chat_id, user_id, action))
+
+    @contextmanager
+    def once(self, chat_id: int, user_id: int, action: str):
+        """
+        Context manager yielding True if the action should run now:
+        `with action_log.once(chat_id, user_id, "verify") as first: ...`
+        """
+        first = self.begin(chat_id, user_id, action)
+        if not first:
+            logger.debug("Skipping repeated %s of user %s in chat %s", action, user_id, chat_id)
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self.finish(chat_id, user_id, action)
+
+# Global instances
+processed_updates = ProcessedUpdates(backend)
+action_log = ActionLog()
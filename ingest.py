@@ -0,0 +1,115 @@
+"""
+Fast ingestion of webhook deliveries.
+The HTTP handler only queues the raw body; parsing and processing happen
+on the bot's event loop, after Telegram already got its answer.
+"""
+from collections import deque
+from typing import Deque, List
+import asyncio
+import hmac
+import json
+import logging
+import threading
+from telegram import Update
+from telegram.ext import Application
+
+from config import WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE, WEBHOOK_CONSUMERS
+from idempotency import RecentUpdateIds
+
+logger = logging.getLogger(__name__)
+
+class WebhookIngestor:
+    """
+    Bounded hand-off from the web server's threads to the bot's event loop.
+
+    submit() is called from the request handler: it checks nothing but the
+    queue size and returns at once. `consumers` tasks on the bot's loop
+    decode the queued bodies, drop updates whose id was seen recently and
+    put the rest on the application's update queue, so they are processed
+    by its update processor exactly as polled updates are.
+    """
+    def __init__(self, secret: str = WEBHOOK_SECRET, max_size: int = WEBHOOK_QUEUE_SIZE,
+                 consumers: int = WEBHOOK_CONSUMERS, recent: RecentUpdateIds = None):
+        self._secret = secret.encode()
+        self._max_size = max_size
+        self._consumer_count = consumers
+        self._recent = recent or RecentUpdateIds()
+        self._queue: Deque[bytes] = deque()
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop = None
+        self._wakeup: asyncio.Event = None
+        self._consumers: List[asyncio.Task] = []
+        self.stats = {"accepted": 0, "rejected": 0, "duplicates": 0, "invalid": 0}
+
+    def check_secret(self, token: str) -> bool:
+        """Check the X-Telegram-Bot-Api-Secret-Token header of a delivery."""
+        return hmac.compare_digest((token or "").encode(), self._secret)
+
+    def submit(self, body: bytes) -> bool:
+        """
+        Queue the raw body of a delivery. Thread-safe.
+        Returns False when the queue is full; Telegram will deliver it again.
+        """
+        if self._loop is None:
+            return False
+        with self._lock:
+            if len(self._queue) >= self._max_size:
+                self.stats["rejected"] += 1
+                return False
+            self._queue.append(body)
+            self.stats["accepted"] += 1
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        return True
+
+    async def start(self, application: Application):
+        """Start the consumers on the running loop."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._consumers = [
+            self._loop.create_task(self._consume(application)) for _ in range(self._consumer_count)
+        ]
+        logger.info("Webhook ingestion started with %s consumers", self._consumer_count)
+
+    async def stop(self):
+        """Stop the consumers. Bodies still queued are dropped and will be re-delivered."""
+        for consumer in self._consumers:
+            consumer.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+        self._consumers = []
+
+    def _take(self) -> bytes:
+        with self._lock:
+            return self._queue.popleft() if self._queue else None
+
+    async def _consume(self, application: Application):
+        while True:
+            body = self._take()
+            if body is None:
+                self._wakeup.clear()
+                # A body may have arrived between the check and the clear
+                body = self._take()
+                if body is None:
+                    await self._wakeup.wait()
+                    continue
+
+            try:
+                data = json.loads(body)
+                update_id = data["update_id"]
+            except (ValueError, KeyError, TypeError) as e:
+                self.stats["invalid"] += 1
+                logger.warning(f"Dropping malformed webhook delivery: {e}")
+                continue
+
+            if not self._recent.add(update_id):
+                self.stats["duplicates"] += 1
+                logger.debug("Dropping duplicate delivery of update %s", update_id)
+                continue
+
+            await application.update_queue.put(Update.de_json(data, application.bot))
+
+    def queue_depth(self) -> int:
+        """Number of deliveries waiting to be decoded."""
+        return len(self._queue)
+
+# Global webhook ingestor instance
+webhook_ingestor = WebhookIngestor()
@@ -0,0 +1,133 @@
+"""
+Graduated verification levels.
+Verified members start with text only and are promoted to media, then to
+full permissions, as the delays configured for their chat pass.
+"""
+from enum import IntEnum
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import time
+from telegram.ext import CallbackContext
+from telegram.error import BadRequest, TelegramError
+
+from outbound import Priority, outbound
+from storage import chat_settings, verification_storage
+from templates import permissions
+
+logger = logging.getLogger(__name__)
+
+# Seconds before a failed promotion is tried again
+PROMOTION_RETRY_DELAY = 5 * 60
+
+# Prevents a slow sweep from overlapping with the next scheduled one
+_sweep_lock = asyncio.Lock()
+
+class Level(IntEnum):
+    PENDING = 0
+    TEXT = 1
+    MEDIA = 2
+    FULL = 3
+
+# Permission preset granted at each level
+LEVEL_PRESETS = {
+    Level.PENDING: "restricted",
+    Level.TEXT: "text",
+    Level.MEDIA: "media",
+    Level.FULL: "verified",
+}
+
+# Chat setting holding the wait before each level; levels without one follow at once
+LEVEL_DELAYS = {
+    Level.MEDIA: "media_delay",
+    Level.FULL: "links_delay",
+}
+
+def promotion_delay(chat_id: int, level: Level) -> int:
+    """Seconds a member spends at `level` before the next one."""
+    setting = LEVEL_DELAYS.get(level + 1)
+    return chat_settings.get(chat_id, setting) if setting else 0
+
+def settle_level(chat_id: int, level: Level, since: float, now: float = None) -> Tuple[Level, Optional[float]]:
+    """
+    Find the highest level reached by a member who got `level` at `since`,
+    and when the next promotion is due (None once at the last level).
+    Levels with no delay are passed through immediately.
+    """
+    now = time.time() if now is None else now
+    promote_at = since
+    while level < Level.FULL:
+        promote_at += promotion_delay(chat_id, level)
+        if promote_at > now:
+            return level, promote_at
+        level = Level(level + 1)
+    return level, None
+
+async def grant_level(bot, chat_id: int, user_id: int, level: Level = Level.TEXT,
+                      priority: Priority = Priority.MODERATION) -> Level:
+    """
+    Restrict a member to the permissions of `level`, or of a higher level
+    if the delays before it are 0, and schedule their next promotion.
+    Returns the level granted.
+    """
+    level, promote_at = settle_level(chat_id, level, time.time())
+    await outbound.call(
+        bot.restrict_chat_member,
+        priority=priority,
+        chat_id=chat_id,
+        user_id=user_id,
+        permissions=permissions.get(LEVEL_PRESETS[level], chat_id),
+        use_independent_chat_permissions=True
+    )
+    verification_storage.set_level(chat_id, user_id, int(level), promote_at)
+    return level
+
+async def promote_members(bot, now: float = None) -> int:
+    """
+    Apply every promotion that is due, one chat at a time. Members who
+    are due for more than one level get the highest in a single call.
+    Returns the number of members promoted.
+    """
+    now = time.time() if now is None else now
+    due: Dict[int, List[Tuple[int, Dict]]] = verification_storage.pop_due_promotions(now)
+    promoted = 0
+    for chat_id, members in due.items():
+        for user_id, record in members:
+            level, promote_at = settle_level(chat_id, Level(record["level"] + 1), record["promote_at"], now)
+            try:
+                await outbound.call(
+                    bot.restrict_chat_member,
+                    priority=Priority.BACKGROUND,
+                    chat_id=chat_id,
+                    user_id=user_id,
+                    permissions=permissions.get(LEVEL_PRESETS[level], chat_id),
+                    use_independent_chat_permissions=True
+                )
+            except BadRequest as e:
+                # The member left or the bot lost its rights; retrying won't help
+                logger.warning(f"Could not promote user {user_id} in chat {chat_id}: {e}")
+                verification_storage.clear_level(chat_id, user_id)
+                continue
+            except TelegramError as e:
+                logger.error(f"Error promoting user {user_id} in chat {chat_id}: {e}")
+                verification_storage.set_level(chat_id, user_id, record["level"], now + PROMOTION_RETRY_DELAY)
+                continue
+
+            verification_storage.set_level(chat_id, user_id, int(level), promote_at)
+            promoted += 1
+            logger.debug("User %s in chat %s promoted to level %s", user_id, chat_id, level.name)
+
+    if promoted:
+        logger.info("Promotion sweep promoted %s members in %s chats", promoted, len(due))
+    return promoted
+
+async def promotion_job(context: CallbackContext):
+    """
+    JobQueue callback running one promotion sweep.
+    """
+    if _sweep_lock.locked():
+        logger.debug("Previous promotion sweep still running, skipping")
+        return
+
+    async with _sweep_lock:
+        await promote_members(context.bot)
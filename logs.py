@@ -0,0 +1,160 @@
+"""
+Logging pipeline.
+Records are put on a queue by the thread that logs them and written to
+stdout and a rotating JSON log file by a background thread, so disk I/O
+never runs on the event loop. Every record carries the id of the update
+being handled, and high-volume loggers can be sampled.
+"""
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from typing import Dict, Optional
+import atexit
+import copy
+import json
+import logging
+import queue
+import sys
+import threading
+
+from config import LOG_LEVEL, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_ROTATE_WHEN, LOG_SAMPLING
+
+# Id of the update being handled, set by the update processor. Tasks
+# started while handling an update inherit it, so the restriction, welcome
+# message and notifications caused by one join share an id
+correlation_id: ContextVar[Optional[str]] = ContextVar("correlation_id", default=None)
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s'
+
+class CorrelationFilter(logging.Filter):
+    """
+    Stamps records with the current correlation id. Must run where the
+    record is logged, before it is queued.
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get() or "-"
+        return True
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps one in every 1/rate debug and info records of the given loggers
+    and their children, e.g. {"storage": 0.1} keeps every tenth. Warnings
+    and errors always pass. Dropped records are never formatted.
+    """
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self._every = {name: max(1, round(1 / rate)) for name, rate in rates.items() if rate > 0}
+        self._dropped = {name for name, rate in rates.items() if rate <= 0}
+        self._seen: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _rule(self, name: str) -> Optional[str]:
+        while name:
+            if name in self._every or name in self._dropped:
+                return name
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rule = self._rule(record.name)
+        if rule is None:
+            return True
+        if rule in self._dropped:
+            return False
+        with self._lock:
+            seen = self._seen.get(rule, 0)
+            self._seen[rule] = seen + 1
+        return seen % self._every[rule] == 0
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, correlation id and
+    message, plus the traceback if there is one.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "correlation_id": getattr(record, "correlation_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Rendered before the record was queued
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments now, as they may change once queued, but keep
+        # the traceback apart for the JSON output
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _TRACEBACKS.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_TRACEBACKS = logging.Formatter()
+
+def parse_sample_rates(text: str) -> Dict[str, float]:
+    """Parse "logger=rate,logger=rate" as in LOG_SAMPLING."""
+    rates = {}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        name, _, rate = item.partition("=")
+        try:
+            rates[name.strip()] = float(rate)
+        except ValueError:
+            raise ValueError(f"Invalid LOG_SAMPLING entry {item.strip()!r}, expected logger=rate") from None
+    return rates
+
+def file_handler(path: str = LOG_FILE, max_bytes: int = LOG_MAX_BYTES, backup_count: int = LOG_BACKUP_COUNT,
+                 when: str = LOG_ROTATE_WHEN) -> logging.Handler:
+    """Rotate on a schedule if `when` is set, otherwise by size."""
+    if when:
+        return TimedRotatingFileHandler(path, when=when, backupCount=backup_count, encoding="utf-8", utc=True)
+    return RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+
+_listener: Optional[QueueListener] = None
+
+def configure_logging(level: str = LOG_LEVEL, path: str = LOG_FILE, sampling: str = LOG_SAMPLING):
+    """
+    Route all logging through the queue: text to stdout, JSON lines to
+    `path`. Does nothing if logging is already configured.
+    """
+    global _listener
+    root = logging.getLogger()
+    if root.handlers:
+        return
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    log_file = file_handler(path)
+    log_file.setFormatter(JsonFormatter())
+
+    records = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    # Both run where records are logged, so sampled-out records are never formatted
+    handler.addFilter(SamplingFilter(parse_sample_rates(sampling)))
+    handler.addFilter(CorrelationFilter())
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(records, console, log_file, respect_handler_level=True)
+    _listener.start()
+    # Write out whatever is still queued when the process exits
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Write out the queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,76 +1,30 @@
-from flask import Flask
-import os
+"""
+WSGI entry point, e.g. `gunicorn main:app`.
+Importing this module starts nothing: the bot and its Flask app are built
+by the first request, such as the platform's health check, so a master
+process loading it before forking workers never polls or sets a webhook.
+"""
+import threading
 
-# Flask app setup
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", os.urandom(24).hex())
+from cli import create_web_app
 
-# Bot configuration
-BOT_TOKEN = os.environ.get("TELEGRAM_TOKEN")
-ADMIN_ID = 7582664657  # Telegram ID of @UMFST_Admin
-
-@app.route('/')
-def index():
-    """Status page showing bot information"""
-    status_html = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>UMFST Campus Verification Bot</title>
-        <link href="https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css" rel="stylesheet">
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-    </head>
-    <body data-bs-theme="dark">
-        <div class="container mt-5">
-            <div class="row justify-content-center">
-                <div class="col-md-8">
-                    <div class="card">
-                        <div class="card-header">
-                            <h3>UMFST Campus Verification Bot</h3>
-                        </div>
-                        <div class="card-body">
-                            <p><strong>Status:</strong> Ready</p>
-                            <p><strong>Bot Mode:</strong> Polling</p>
-                            <p><strong>Admin ID:</strong> """ + str(ADMIN_ID) + """</p>
-                            <p class="mt-4">
-                                This bot restricts new members in UMFST campus Telegram groups until they're verified
-                                by providing their student ID or enrollment proof to an admin.
-                            </p>
-                            <div class="mt-4">
-                                <h5>Features:</h5>
-                                <ul>
-                                    <li>Automatically restricts new members when they join</li>
-                                    <li>Notifies admin about new members requiring verification</li>
-                                    <li>Admin can verify or reject members with simple commands</li>
-                                    <li>Helps maintain a secure community of actual students</li>
-                                </ul>
-                            </div>
-                            <div class="mt-4">
-                                <h5>Commands:</h5>
-                                <ul>
-                                    <li><code>/verify @username</code> - Grant permissions to a verified user</li>
-                                    <li><code>/reject @username</code> - Remove a user from the group</li>
-                                    <li><code>/unban @username</code> - Unban a user so they can rejoin the group</li>
-                                    <li><code>/unban_id [user_id]</code> - Unban a user by their ID number</li>
-                                </ul>
-                            </div>
-                            <div class="alert alert-info mt-4">
-                                <strong>Note:</strong> When you want to start the bot, run the following steps:
-                                <ol>
-                                    <li>Install python-telegram-bot v22.1: <code>pip install "python-telegram-bot==22.1"</code></li>
-                                    <li>Copy main.py content from your original code</li>
-                                    <li>Run the bot using: <code>python main.py</code></li>
-                                </ol>
-                            </div>
-                        </div>
-                    </div>
-                </div>
-            </div>
-        </div>
-    </body>
-    </html>
+class LazyApp:
+    """
+    WSGI app building the real one with `factory` on its first request.
     """
-    return status_html
+    def __init__(self, factory):
+        self._factory = factory
+        self._app = None
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if self._app is None:
+            with self._lock:
+                if self._app is None:
+                    self._app = self._factory()
+        return self._app(environ, start_response)
+
+app = LazyApp(create_web_app)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    create_web_app().run(host='0.0.0.0', port=5000, debug=False)
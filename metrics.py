@@ -0,0 +1,299 @@
+"""
+Prometheus-style metrics.
+Counters and histograms are recorded on the hot path without locks and
+rendered in the Prometheus text format when /metrics is scraped.
+"""
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, List, Sequence, Tuple
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from a cached reply to a slow API call
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Shards:
+    """
+    One dict of values per thread. Each thread only writes its own shard,
+    so recording needs no lock; scrapes add the shards up.
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._all: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def get(self) -> Dict:
+        shard = getattr(self._local, "values", None)
+        if shard is None:
+            shard = self._local.values = {}
+            with self._lock:
+                self._all.append(shard)
+        return shard
+
+    def snapshots(self) -> List[Dict]:
+        with self._lock:
+            shards = list(self._all)
+        # dict.copy() is atomic, so a shard being written is read consistently
+        return [shard.copy() for shard in shards]
+
+class Counter:
+    """
+    Monotonic counter with labels: `counter.inc("send_message")`.
+    """
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._shards = _Shards()
+
+    def inc(self, *labels, amount: float = 1):
+        shard = self._shards.get()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self) -> Dict[Tuple, float]:
+        totals: Dict[Tuple, float] = {}
+        for shard in self._shards.snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value:g}")
+        return lines
+
+class Histogram:
+    """
+    Histogram with fixed buckets and labels: `histogram.observe(0.12, "verify")`.
+    Each label set keeps one count per bucket plus the sum and count.
+    """
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._shards = _Shards()
+
+    def observe(self, value: float, *labels):
+        shard = self._shards.get()
+        entry = shard.get(labels)
+        if entry is None:
+            # One slot per bucket, one for +Inf, then the sum
+            entry = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def time(self, *labels):
+        """Context manager observing the time spent in its block."""
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        totals: Dict[Tuple, List] = {}
+        for shard in self._shards.snapshots():
+            for labels, entry in shard.items():
+                total = totals.setdefault(labels, [0] * len(entry))
+                for index, value in enumerate(list(entry)):
+                    total[index] += value
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, entry in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), entry):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket_labels = _format_labels(self.labels, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {entry[-1]:g}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+class _Timer:
+    __slots__ = ("_histogram", "_labels", "_started")
+
+    def __init__(self, histogram: Histogram, labels: Tuple):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._started, *self._labels)
+        return False
+
+class Gauge:
+    """
+    Gauge read when scraped: `collect()` returns {label values: value}.
+    Nothing is recorded on the hot path.
+    """
+    def __init__(self, name: str, help: str, collect: Callable[[], Dict[Tuple, float]], labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self._collect()
+        except Exception as e:
+            logger.error(f"Error collecting {self.name}: {e}")
+            return lines
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value:g}")
+        return lines
+
+class MetricsRegistry:
+    """
+    The metrics exposed at /metrics, by name.
+    """
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        """Add a metric, replacing any earlier one with the same name."""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, collect: Callable[[], Dict[Tuple, float]], labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, collect, labels))
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+# Verification latency buckets in seconds, from 10 seconds to a week
+VERIFICATION_BUCKETS = (
+    10, 30, 60, 2 * 60, 5 * 60, 10 * 60, 30 * 60, 60 * 60, 2 * 60 * 60, 4 * 60 * 60,
+    8 * 60 * 60, 12 * 60 * 60, 24 * 60 * 60, 2 * 24 * 60 * 60, 7 * 24 * 60 * 60,
+)
+
+class ActivityStats:
+    """
+    Rolling aggregates for the dashboard, updated as events happen.
+
+    Events ("join", "verify", "reject", "expire", "api_call", "api_error")
+    are counted in one slot per minute over the last `window_minutes`
+    minutes, and the time from join to verification goes into a histogram.
+    Recording touches one slot; reading adds up at most `window_minutes`
+    slots, never the store.
+    """
+    def __init__(self, window_minutes: int = 60, buckets: Sequence[float] = VERIFICATION_BUCKETS, clock=time.time):
+        self._window = window_minutes
+        self._clock = clock
+        self._minutes = [-1] * window_minutes
+        self._slots: List[Dict[str, int]] = [{} for _ in range(window_minutes)]
+        self._buckets = tuple(buckets)
+        self._latencies = [0] * (len(self._buckets) + 1)
+
+    def record(self, event: str, amount: int = 1):
+        minute = int(self._clock() // 60)
+        index = minute % self._window
+        if self._minutes[index] != minute:
+            self._minutes[index] = minute
+            self._slots[index] = {}
+        slot = self._slots[index]
+        slot[event] = slot.get(event, 0) + amount
+
+    def record_verification(self, joined_at: float):
+        """Count a verification of a member who joined at `joined_at`."""
+        self.record("verify")
+        self._latencies[bisect_left(self._buckets, self._clock() - joined_at)] += 1
+
+    def totals(self) -> Dict[str, int]:
+        """Events counted over the window."""
+        oldest = int(self._clock() // 60) - self._window
+        totals: Dict[str, int] = {}
+        for minute, slot in zip(list(self._minutes), list(self._slots)):
+            if minute > oldest:
+                for event, count in slot.items():
+                    totals[event] = totals.get(event, 0) + count
+        return totals
+
+    @property
+    def window(self) -> int:
+        """Length of the window in minutes."""
+        return self._window
+
+    def latency_percentiles(self, percentiles: Sequence[float] = (50, 90, 99)) -> Dict[float, float]:
+        """
+        Estimate verification latency percentiles in seconds, interpolating
+        within buckets. Empty when nobody was verified yet.
+        """
+        counts = list(self._latencies)
+        total = sum(counts)
+        if not total:
+            return {}
+        bounds = (0,) + self._buckets + (self._buckets[-1] * 2,)
+        results = {}
+        for percentile in percentiles:
+            target = total * percentile / 100
+            cumulative = 0
+            for index, count in enumerate(counts):
+                if count and cumulative + count >= target:
+                    low, high = bounds[index], bounds[index + 1]
+                    results[percentile] = low + (high - low) * (target - cumulative) / count
+                    break
+                cumulative += count
+        return results
+
+    def verification_count(self) -> int:
+        return sum(self._latencies)
+
+def instrument_handlers(application):
+    """Time every callback registered on an application, labelled by its name."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = timed(handler.callback)
+
+def timed(callback):
+    """Wrap a handler callback so its latency is recorded in handler_latency."""
+    name = getattr(callback, "__name__", repr(callback))
+
+    @wraps(callback)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            handler_latency.observe(time.perf_counter() - started, name)
+    return wrapper
+
+# Global registry and the metrics recorded on the hot path
+metrics = MetricsRegistry()
+handler_latency = metrics.histogram(
+    "bot_handler_duration_seconds", "Time spent in each update handler.", ["handler"]
+)
+api_latency = metrics.histogram(
+    "bot_api_request_duration_seconds", "Latency of Bot API calls by method.", ["method"]
+)
+api_errors = metrics.counter(
+    "bot_api_errors_total", "Failed Bot API calls by method and error.", ["method", "error"]
+)
+api_retry_after = metrics.counter(
+    "bot_api_retry_after_total", "RetryAfter answers received, by method.", ["method"]
+)
+activity = ActivityStats()
@@ -0,0 +1,254 @@
+"""
+Central scheduler for outgoing Telegram Bot API calls.
+Keeps the bot under Telegram's global and per-group rate limits.
+"""
+from enum import IntEnum
+from typing import Dict, List, Tuple
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from telegram.error import RetryAfter
+
+from config import API_RATE_LIMIT, CHAT_MESSAGE_RATE, OUTBOUND_MAX_IN_FLIGHT, OUTBOUND_MAX_RETRIES
+from metrics import activity, api_errors, api_latency, api_retry_after
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+class Priority(IntEnum):
+    """
+    Priority classes of outgoing calls. Lower values are sent first.
+    """
+    MODERATION = 0    # restrict, ban and unban calls
+    CHAT_MESSAGE = 1  # welcome messages and command replies
+    ADMIN_DM = 2      # notifications sent to admins
+    BACKGROUND = 3    # expiry sweeps and other housekeeping
+
+# Methods that post into a chat and count towards Telegram's per-group limit
+CHAT_MESSAGE_METHODS = frozenset({
+    "send_message", "send_photo", "send_document", "send_sticker", "send_animation",
+    "forward_message", "copy_message", "edit_message_text", "edit_message_reply_markup",
+})
+
+class OutboundRequest:
+    """
+    A queued Bot API call and the future its caller is waiting on.
+    """
+    __slots__ = ("priority", "seq", "method", "kwargs", "chat_id", "future", "attempts")
+
+    def __init__(self, priority: Priority, seq: int, method, kwargs: Dict, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.method = method
+        self.kwargs = kwargs
+        self.chat_id = kwargs.get("chat_id")
+        self.future = future
+        self.attempts = 0
+
+class OutboundScheduler:
+    """
+    Sends Bot API calls through a global token bucket and per-group buckets.
+
+    Calls posting messages into a group first take a token from that group's
+    bucket; a group that is over its limit only delays its own messages.
+    Ready calls are then dispatched in priority order as the global bucket
+    allows. A RetryAfter answer to a message in a group comes from that
+    group's limit, so only the group's messages are held back for the
+    requested time; any other RetryAfter comes from the global limit and
+    pauses all dispatching. Either way the call is re-queued.
+    """
+    def __init__(self, global_rate: float = API_RATE_LIMIT, chat_rate_per_minute: float = CHAT_MESSAGE_RATE,
+                 max_in_flight: int = OUTBOUND_MAX_IN_FLIGHT, max_retries: int = OUTBOUND_MAX_RETRIES,
+                 clock=time.monotonic):
+        self._clock = clock
+        self._global_bucket = TokenBucket(global_rate, clock=clock)
+        self._chat_rate = chat_rate_per_minute / 60
+        self._chat_capacity = chat_rate_per_minute
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._chat_paused_until: Dict[int, float] = {}
+        self._max_in_flight = max_in_flight
+        self._max_retries = max_retries
+
+        self._seq = itertools.count()
+        self._ready: List[Tuple[int, int, OutboundRequest]] = []
+        self._delayed: List[Tuple[float, int, OutboundRequest]] = []
+        self._paused_until = 0.0
+        self._in_flight = 0
+
+        # Created lazily so they bind to the loop the bot runs on
+        self._wakeup: asyncio.Event = None
+        self._slots: asyncio.Semaphore = None
+        self._worker: asyncio.Task = None
+
+        self.stats = {"sent": 0, "failed": 0, "retry_after": 0}
+
+    async def call(self, method, priority: Priority = Priority.CHAT_MESSAGE, **kwargs):
+        """
+        Queue a Bot API call, e.g. `call(bot.send_message, chat_id=..., text=...)`,
+        and wait for its result.
+        """
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        request = OutboundRequest(priority, next(self._seq), method, kwargs, future)
+
+        delay = 0.0
+        if self._is_group_message(request):
+            bucket = self._chat_buckets.get(request.chat_id)
+            if bucket is None:
+                bucket = TokenBucket(self._chat_rate, self._chat_capacity, clock=self._clock)
+                self._chat_buckets[request.chat_id] = bucket
+            delay = max(bucket.reserve(), self._chat_paused_until.get(request.chat_id, 0.0) - self._clock())
+
+        self._schedule(request, self._clock() + delay)
+        return await future
+
+    def _is_group_message(self, request: OutboundRequest) -> bool:
+        # Group and channel ids are negative, private chats are positive
+        return (
+            isinstance(request.chat_id, int)
+            and request.chat_id < 0
+            and getattr(request.method, "__name__", "") in CHAT_MESSAGE_METHODS
+        )
+
+    def _schedule(self, request: OutboundRequest, not_before: float):
+        if not_before > self._clock():
+            heapq.heappush(self._delayed, (not_before, request.seq, request))
+        else:
+            heapq.heappush(self._ready, (request.priority, request.seq, request))
+        self._wakeup.set()
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self._max_in_flight)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    def _promote(self, now: float):
+        """Move delayed calls whose time has come to the ready queue."""
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, request = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, (request.priority, request.seq, request))
+
+    async def _sleep(self, timeout: float = None):
+        """Sleep until `timeout` elapses or a new call is queued."""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = self._clock()
+            self._promote(now)
+
+            if self._paused_until > now:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            if not self._ready:
+                await self._sleep(self._delayed[0][0] - now if self._delayed else None)
+                continue
+
+            # Wait for the global budget before picking, so a more urgent
+            # call queued in the meantime goes first
+            delay = self._global_bucket.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                self._promote(self._clock())
+
+            await self._slots.acquire()
+            _, _, request = heapq.heappop(self._ready)
+            if request.future.done():
+                self._slots.release()
+                continue
+            # Queued before its group was paused
+            resume_at = self._chat_resume_at(request)
+            if resume_at:
+                self._slots.release()
+                self._schedule(request, resume_at)
+                continue
+
+            self._in_flight += 1
+            asyncio.get_running_loop().create_task(self._send(request))
+
+    async def _send(self, request: OutboundRequest):
+        method = getattr(request.method, "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            result = await request.method(**request.kwargs)
+        except RetryAfter as e:
+            self.stats["retry_after"] += 1
+            api_retry_after.inc(method)
+            request.attempts += 1
+            if request.attempts > self._max_retries:
+                self.stats["failed"] += 1
+                self._set_exception(request, e)
+                return
+            resume_at = self._clock() + e.retry_after
+            if self._is_group_message(request):
+                logger.warning(f"Flood limit hit on {method} in chat {request.chat_id}, "
+                               f"pausing its messages for {e.retry_after}s")
+                paused_until = self._chat_paused_until.get(request.chat_id, 0.0)
+                self._chat_paused_until[request.chat_id] = max(paused_until, resume_at)
+            else:
+                logger.warning(f"Flood limit hit on {method}, pausing for {e.retry_after}s")
+                self._paused_until = max(self._paused_until, resume_at)
+            self._schedule(request, resume_at)
+        except Exception as e:
+            self.stats["failed"] += 1
+            api_errors.inc(method, type(e).__name__)
+            activity.record("api_error")
+            self._set_exception(request, e)
+        else:
+            self.stats["sent"] += 1
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            api_latency.observe(time.perf_counter() - started, method)
+            activity.record("api_call")
+            self._in_flight -= 1
+            self._slots.release()
+
+    def _chat_resume_at(self, request: OutboundRequest) -> float:
+        """When a paused group may be sent messages again, or 0 if it is not paused."""
+        if not self._is_group_message(request):
+            return 0.0
+        paused_until = self._chat_paused_until.get(request.chat_id)
+        if paused_until is None:
+            return 0.0
+        if paused_until <= self._clock():
+            del self._chat_paused_until[request.chat_id]
+            return 0.0
+        return paused_until
+
+    def _set_exception(self, request: OutboundRequest, error: BaseException):
+        if not request.future.done():
+            request.future.set_exception(error)
+
+    def queue_depths(self) -> Dict[str, int]:
+        """Number of calls waiting in each priority class, delayed and in flight."""
+        depths = {priority.name.lower(): 0 for priority in Priority}
+        for priority, _, _ in self._ready:
+            depths[Priority(priority).name.lower()] += 1
+        depths["delayed"] = len(self._delayed)
+        depths["in_flight"] = self._in_flight
+        return depths
+
+async def reply_to(message, text: str, priority: Priority = Priority.CHAT_MESSAGE, **kwargs):
+    """
+    Reply to a message through the outbound scheduler.
+    """
+    return await outbound.call(
+        message.get_bot().send_message,
+        priority=priority,
+        chat_id=message.chat_id,
+        text=text,
+        reply_to_message_id=message.message_id,
+        **kwargs
+    )
+
+# Global outbound scheduler instance
+outbound = OutboundScheduler()
@@ -0,0 +1,249 @@
+"""
+Join-flood detection.
+When a chat receives joins faster than a human audience would produce them,
+it goes into lockdown: joiners are restricted silently in batches, without
+welcome messages or admin notifications, and admins get one alert.
+"""
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import logging
+import time
+from telegram.error import BadRequest, TelegramError
+
+from audit import AuditEvent, audit_log
+from config import RAID_JOIN_THRESHOLD, RAID_WINDOW, RAID_COOLDOWN, LOCKDOWN_BATCH_INTERVAL
+from idempotency import action_log
+from outbound import Priority, outbound
+from storage import chat_settings, verification_storage
+from templates import permissions
+
+logger = logging.getLogger(__name__)
+
+class JoinRateDetector:
+    """
+    Sliding-window join counter per chat.
+
+    A chat trips the detector when `threshold` joins fall within `window`
+    seconds. Only the last `threshold` join times of a chat are kept, so
+    checking a join is O(1). Once tripped, the chat stays locked down until
+    `cooldown` seconds pass with fewer than half the threshold in a window.
+    """
+    def __init__(self, threshold: int = RAID_JOIN_THRESHOLD, window: float = RAID_WINDOW,
+                 cooldown: float = RAID_COOLDOWN, clock: Callable[[], float] = time.monotonic):
+        self.threshold = max(2, threshold)
+        self.window = window
+        self.cooldown = cooldown
+        self.clock = clock
+        self._joins: Dict[int, Deque[float]] = {}
+        self._locked_until: Dict[int, float] = {}
+
+    def _count_recent(self, joins: Deque[float], now: float) -> int:
+        while joins and joins[0] <= now - self.window:
+            joins.popleft()
+        return len(joins)
+
+    def record(self, chat_id: int, now: float = None) -> bool:
+        """Count a join. Returns True if the chat is locked down after it."""
+        now = self.clock() if now is None else now
+        joins = self._joins.get(chat_id)
+        if joins is None:
+            joins = self._joins[chat_id] = deque(maxlen=self.threshold)
+        joins.append(now)
+        recent = self._count_recent(joins, now)
+
+        if self.is_locked(chat_id, now):
+            # Hysteresis: a slower but steady stream keeps the lockdown on
+            if recent >= self.threshold // 2:
+                self._locked_until[chat_id] = now + self.cooldown
+            return True
+        if recent >= self.threshold:
+            self._locked_until[chat_id] = now + self.cooldown
+            return True
+        return False
+
+    def is_locked(self, chat_id: int, now: float = None) -> bool:
+        """Check whether a chat is still locked down, ending lockdowns that ran out."""
+        until = self._locked_until.get(chat_id)
+        if until is None:
+            return False
+        now = self.clock() if now is None else now
+        if now < until:
+            return True
+        del self._locked_until[chat_id]
+        if not self._count_recent(self._joins.get(chat_id, deque()), now):
+            self._joins.pop(chat_id, None)
+        return False
+
+def replay(joins: Iterable[Tuple[float, int]], threshold: int = RAID_JOIN_THRESHOLD,
+           window: float = RAID_WINDOW, cooldown: float = RAID_COOLDOWN) -> List[Tuple[float, int, str]]:
+    """
+    Run recorded (timestamp, chat_id) joins through a detector and return
+    its (timestamp, chat_id, "lockdown" | "normal") transitions. The end of
+    a lockdown is reported at the first join after it ran out. Meant for
+    tuning the thresholds against join logs of real raids.
+    """
+    detector = JoinRateDetector(threshold, window, cooldown, clock=lambda: 0.0)
+    locked = set()
+    transitions = []
+    for now, chat_id in sorted(joins):
+        for other in [other for other in locked if not detector.is_locked(other, now)]:
+            locked.discard(other)
+            transitions.append((now, other, "normal"))
+        if detector.record(chat_id, now) and chat_id not in locked:
+            locked.add(chat_id)
+            transitions.append((now, chat_id, "lockdown"))
+    return transitions
+
+class Lockdown:
+    """
+    State of a chat in lockdown.
+    """
+    __slots__ = ("chat_id", "chat_title", "started_at", "ended_at", "queue", "restricted", "alert", "task")
+
+    def __init__(self, chat_id: int, chat_title: str = None, started_at: float = 0.0):
+        self.chat_id = chat_id
+        self.chat_title = chat_title
+        self.started_at = started_at
+        self.ended_at: Optional[float] = None
+        self.queue: Dict[int, object] = {}
+        self.restricted = 0
+        self.alert: Optional[Tuple[int, int]] = None
+        self.task: Optional[asyncio.Task] = None
+
+class RaidGuard:
+    """
+    Routes joins around the normal welcome flow while a chat is raided.
+
+    on_join() is called for every join before the usual handling. While
+    the chat is locked down it takes the joiner over: members are queued
+    and restricted every `batch_interval` seconds, stored as pending like
+    any other joiner, and nobody is greeted or notified individually.
+    Admins get one alert when the lockdown starts, edited into a summary
+    when it ends.
+    """
+    def __init__(self, detector: JoinRateDetector = None, batch_interval: float = LOCKDOWN_BATCH_INTERVAL):
+        self.detector = detector or JoinRateDetector()
+        self._batch_interval = batch_interval
+        self._lockdowns: Dict[int, Lockdown] = {}
+
+    def is_locked(self, chat_id: int) -> bool:
+        return chat_id in self._lockdowns
+
+    def on_join(self, bot, chat_id: int, user, chat_title: str = None) -> bool:
+        """
+        Count a join. Returns True if the chat is locked down and the
+        joiner was queued, in which case the caller does nothing more.
+        """
+        if not self.detector.record(chat_id):
+            return False
+
+        lockdown = self._lockdowns.get(chat_id)
+        if lockdown is None:
+            lockdown = Lockdown(chat_id, chat_title, self.detector.clock())
+            self._lockdowns[chat_id] = lockdown
+            lockdown.task = asyncio.get_running_loop().create_task(self._run(bot, lockdown))
+            logger.warning(f"Join flood in chat {chat_id}, entering lockdown")
+        lockdown.queue[user.id] = user
+        return True
+
+    async def _run(self, bot, lockdown: Lockdown):
+        """Restrict queued joiners in batches until the lockdown runs out."""
+        await self._alert(bot, lockdown)
+        try:
+            while True:
+                await asyncio.sleep(self._batch_interval)
+                await self._flush(bot, lockdown)
+                if not lockdown.queue and not self.detector.is_locked(lockdown.chat_id):
+                    break
+        finally:
+            del self._lockdowns[lockdown.chat_id]
+            lockdown.ended_at = self.detector.clock()
+
+        logger.warning(f"Lockdown of chat {lockdown.chat_id} ended after restricting {lockdown.restricted} members")
+        await self._alert(bot, lockdown)
+
+    async def _flush(self, bot, lockdown: Lockdown):
+        batch, lockdown.queue = lockdown.queue, {}
+        if batch:
+            results = await asyncio.gather(
+                *(self._restrict(bot, lockdown.chat_id, user) for user in batch.values()),
+                return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"Error handling a joiner during lockdown of chat {lockdown.chat_id}: {result}")
+            lockdown.restricted += sum(1 for result in results if result is True)
+            logger.info("Lockdown of chat %s: restricted a batch of %d joiners", lockdown.chat_id, len(batch))
+
+    async def _restrict(self, bot, chat_id: int, user) -> bool:
+        if verification_storage.is_pending_verification(chat_id, user.id):
+            return False
+        try:
+            with action_log.once(chat_id, user.id, "join") as first:
+                if not first:
+                    return False
+                await outbound.call(
+                    bot.restrict_chat_member,
+                    priority=Priority.MODERATION,
+                    chat_id=chat_id,
+                    user_id=user.id,
+                    permissions=permissions.get("restricted"),
+                    use_independent_chat_permissions=True
+                )
+                audit_log.record(AuditEvent.RESTRICT, chat_id, user.id, detail="lockdown")
+        except TelegramError as e:
+            logger.error(f"Error restricting user {user.id} in chat {chat_id} during lockdown: {e}")
+            return False
+
+        verification_storage.add_pending_verification(
+            chat_id=chat_id,
+            user_id=user.id,
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name
+        )
+        return True
+
+    def render_alert(self, lockdown: Lockdown) -> str:
+        """Build the lockdown alert, or its summary once the lockdown is over."""
+        where = f" {lockdown.chat_title}" if lockdown.chat_title else f" chat {lockdown.chat_id}"
+        if lockdown.ended_at is None:
+            return (
+                f"🚨 Join flood in{where}: {self.detector.threshold} or more joins within "
+                f"{self.detector.window:.0f}s. Lockdown is on: new members are restricted "
+                "without welcome messages or notifications until the joins slow down."
+            )
+        minutes = (lockdown.ended_at - lockdown.started_at) / 60
+        return (
+            f"✅ Lockdown of{where} ended after {minutes:.0f} minutes. "
+            f"{lockdown.restricted} members who joined meanwhile were restricted and are waiting "
+            "for verification."
+        )
+
+    async def _alert(self, bot, lockdown: Lockdown):
+        """Send the lockdown alert, or edit it into the summary."""
+        notify_chat_id = chat_settings.get(lockdown.chat_id, "notify_chat_id")
+        if not notify_chat_id:
+            return
+        try:
+            if lockdown.alert is None:
+                message = await outbound.call(
+                    bot.send_message, priority=Priority.ADMIN_DM, chat_id=notify_chat_id, text=self.render_alert(lockdown)
+                )
+                lockdown.alert = (notify_chat_id, message.message_id)
+            else:
+                await outbound.call(
+                    bot.edit_message_text,
+                    priority=Priority.ADMIN_DM,
+                    chat_id=lockdown.alert[0],
+                    message_id=lockdown.alert[1],
+                    text=self.render_alert(lockdown)
+                )
+        except BadRequest as e:
+            logger.debug("Could not update lockdown alert for chat %s: %s", lockdown.chat_id, e)
+        except TelegramError as e:
+            logger.error(f"Error sending lockdown alert for chat {lockdown.chat_id}: {e}")
+
+# Global raid guard instance
+raid_guard = RaidGuard()
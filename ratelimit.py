@@ -0,0 +1,35 @@
+"""
+Rate limiting helpers for outgoing Telegram Bot API calls.
+"""
+import threading
+import time
+
+class TokenBucket:
+    """
+    Token bucket allowing `rate` operations per second with bursts up to `capacity`.
+
+    `reserve()` never sleeps itself: it takes a token (possibly going into
+    debt) and returns how long the caller has to wait before using it, so
+    the same bucket works for blocking and asyncio code.
+    """
+    def __init__(self, rate: float, capacity: float = None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens: float = 1) -> float:
+        """Take `tokens` and return the number of seconds to wait before using them."""
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
@@ -12,13 +12,24 @@ if [ -z "$TELEGRAM_TOKEN" ]; then
     exit 1
 fi
 
+# Seconds to wait before restarting; doubled after each quick crash
+delay=1
+
 # Function to run the bot
 run_bot() {
     echo "Starting bot at $(date)"
-    python3 telegram_bot.py
-    echo "Bot exited at $(date) with status $?"
-    echo "Restarting in 5 seconds..."
-    sleep 5
+    started=$(date +%s)
+    python3 cli.py run --mode polling
+    status=$?
+    echo "Bot exited at $(date) with status $status"
+    # A bot that ran for a while restarts straight away, a crash loop backs off
+    if [ $(( $(date +%s) - started )) -ge 60 ]; then
+        delay=1
+    elif [ $delay -lt 30 ]; then
+        delay=$(( delay * 2 ))
+    fi
+    echo "Restarting in $delay seconds..."
+    sleep $delay
 }
 
 # Keep running the bot even if it crashes
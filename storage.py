@@ -2,16 +2,30 @@
 In-memory storage for the Telegram verification bot.
 Manages pending user verifications.
 """
-from typing import Dict, Set
+from types import MappingProxyType
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+import bisect
+import heapq
 import threading
 import logging
+import time
+
+from config import (
+    STORAGE_BACKEND, STORAGE_PATH, ADMIN_ID, VERIFICATION_TIMEOUT, CLUSTER_ENABLED, REPLICA_ID,
+    LEVEL_MEDIA_DELAY, LEVEL_LINKS_DELAY
+)
+from metrics import activity
+from storage_backend import StorageBackend, MemoryBackend, create_backend
 
 logger = logging.getLogger(__name__)
 
+_EMPTY = MappingProxyType({})
+
 class MemberVerificationStorage:
     """
-    Simple in-memory storage for pending member verifications.
-    
+    In-memory storage for pending member verifications, optionally
+    persisted through a StorageBackend.
+
     Stores users who need verification with the format:
     {
         chat_id: {
@@ -19,59 +33,489 @@ class MemberVerificationStorage:
                 "username": username,
                 "first_name": first_name,
                 "last_name": last_name,
-                "message_id": message_id
+                "message_id": message_id,
+                "joined_at": timestamp
             }
         }
     }
+
+    Every change is also appended to the backend, and the backend's log is
+    loaded back on startup so pending users survive a restart.
+
+    Secondary indexes are kept alongside the main dict:
+    - a case-insensitive username index: username -> {chat_id: user_id}
+    - a min-heap of (joined_at, chat_id, user_id) for age-based queries.
+      Removed users are dropped from the heap lazily.
+    - a welcome message index: (chat_id, message_id) -> {user_id}, since
+      several users can share one combined welcome message.
+    - a per-chat list of (joined_at, user_id) kept sorted, so pages of
+      pending users can be sliced without walking the whole chat.
+
+    Verified members who have not reached the last verification level yet
+    are tracked separately as {chat_id: {user_id: {"level": level,
+    "promote_at": timestamp}}}, with a min-heap of (promote_at, chat_id,
+    user_id) to find due promotions. Stale heap entries are skipped lazily.
     """
-    def __init__(self):
-        self._pending_verifications: Dict[int, Dict[int, Dict]] = {}
+    def __init__(self, backend: StorageBackend = None):
+        self._backend = backend or MemoryBackend()
+        members = self._backend.load()
+        self._pending_verifications: Dict[int, Dict[int, Dict]] = members.get("add", {})
+        self._levels: Dict[int, Dict[int, Dict]] = members.get("level", {})
+        self._promotion_heap: List[Tuple[float, int, int]] = [
+            (record["promote_at"], chat_id, user_id)
+            for chat_id, users in self._levels.items()
+            for user_id, record in users.items()
+            if record.get("promote_at") is not None
+        ]
+        heapq.heapify(self._promotion_heap)
+        self._username_index: Dict[str, Dict[int, int]] = {}
+        self._join_heap: List[Tuple[float, int, int]] = []
+        self._message_index: Dict[Tuple[int, int], Set[int]] = {}
+        self._join_order: Dict[int, List[Tuple[float, int]]] = {}
+        self._snapshots: Dict[int, Mapping[int, Dict]] = {}
+        self._count = 0
         self._lock = threading.RLock()
+
+        now = time.time()
+        for chat_id, users in self._pending_verifications.items():
+            for user_id, user_data in users.items():
+                user_data.setdefault("joined_at", now)
+                self._index(chat_id, user_id, user_data)
+        heapq.heapify(self._join_heap)
+
         logger.debug("Initialized member verification storage")
-    
-    def add_pending_verification(self, chat_id: int, user_id: int, username: str = None, 
+
+    def _index(self, chat_id: int, user_id: int, user_data: Dict):
+        """Add a user to the secondary indexes. The heap is not re-balanced."""
+        username = user_data.get("username")
+        if username:
+            self._username_index.setdefault(username.lower(), {})[chat_id] = user_id
+        self._join_heap.append((user_data["joined_at"], chat_id, user_id))
+        bisect.insort(self._join_order.setdefault(chat_id, []), (user_data["joined_at"], user_id))
+        self._index_message(chat_id, user_id, user_data)
+        self._count += 1
+
+    def _index_message(self, chat_id: int, user_id: int, user_data: Dict):
+        message_id = user_data.get("message_id")
+        if message_id:
+            self._message_index.setdefault((chat_id, message_id), set()).add(user_id)
+
+    def _unindex_message(self, chat_id: int, user_id: int, user_data: Dict):
+        message_id = user_data.get("message_id")
+        if message_id:
+            users = self._message_index.get((chat_id, message_id))
+            if users:
+                users.discard(user_id)
+                if not users:
+                    del self._message_index[(chat_id, message_id)]
+
+    def _unindex(self, chat_id: int, user_id: int, user_data: Dict):
+        """Remove a user from the secondary indexes. Heap entries expire lazily."""
+        username = user_data.get("username")
+        if username:
+            key = username.lower()
+            chats = self._username_index.get(key)
+            if chats and chats.get(chat_id) == user_id:
+                del chats[chat_id]
+                if not chats:
+                    del self._username_index[key]
+        self._unindex_message(chat_id, user_id, user_data)
+        order = self._join_order.get(chat_id)
+        if order:
+            key = (user_data["joined_at"], user_id)
+            position = bisect.bisect_left(order, key)
+            if position < len(order) and order[position] == key:
+                del order[position]
+        self._count -= 1
+
+        # Rebuild the heap once stale entries dominate it
+        if len(self._join_heap) > 2 * self._count + 64:
+            self._join_heap = [entry for entry in self._join_heap if self._is_live(entry)]
+            heapq.heapify(self._join_heap)
+
+    def _is_live(self, entry: Tuple[float, int, int]) -> bool:
+        """Check if a heap entry still describes a pending user."""
+        joined_at, chat_id, user_id = entry
+        user_data = self._pending_verifications.get(chat_id, {}).get(user_id)
+        return user_data is not None and user_data["joined_at"] == joined_at
+
+    def add_pending_verification(self, chat_id: int, user_id: int, username: str = None,
                                 first_name: str = None, last_name: str = None, message_id: int = None):
-        """Add a user to the pending verification list."""
+        """
+        Add a user to the pending verification list.
+        A user who is already pending keeps their welcome message and join
+        time, so adding them again does not orphan the message.
+        """
+        user_data = {
+            "username": username,
+            "first_name": first_name,
+            "last_name": last_name,
+            "message_id": message_id,
+            "joined_at": time.time()
+        }
         with self._lock:
-            if chat_id not in self._pending_verifications:
-                self._pending_verifications[chat_id] = {}
-            
-            self._pending_verifications[chat_id][user_id] = {
-                "username": username,
-                "first_name": first_name,
-                "last_name": last_name,
-                "message_id": message_id
-            }
-            
-            logger.debug(f"Added pending verification for user {user_id} in chat {chat_id}")
-    
+            previous = self._pending_verifications.get(chat_id, {}).get(user_id)
+            if previous is not None:
+                user_data["joined_at"] = previous["joined_at"]
+                if message_id is None:
+                    user_data["message_id"] = previous.get("message_id")
+            else:
+                activity.record("join")
+            self._levels.get(chat_id, {}).pop(user_id, None)
+            self._put(chat_id, user_id, user_data)
+            self._backend.append("add", chat_id, user_id, user_data)
+
+            logger.debug("Added pending verification for user %s in chat %s", user_id, chat_id)
+
+    def _put(self, chat_id: int, user_id: int, user_data: Dict):
+        """Store a pending user and index them, replacing any previous entry."""
+        users = self._pending_verifications.setdefault(chat_id, {})
+        previous = users.get(user_id)
+        if previous is not None:
+            self._unindex(chat_id, user_id, previous)
+
+        users[user_id] = user_data
+        self._index(chat_id, user_id, user_data)
+        if previous is not None and previous["joined_at"] == user_data["joined_at"]:
+            # Same join (e.g. a new message_id), its heap entry is still valid
+            self._join_heap.pop()
+        else:
+            heapq.heappush(self._join_heap, self._join_heap.pop())
+        self._snapshots.pop(chat_id, None)
+
+    def _pop(self, chat_id: int, user_id: int) -> Optional[Dict]:
+        """Drop a pending user from the storage and its indexes."""
+        users = self._pending_verifications.get(chat_id)
+        if not users or user_id not in users:
+            return None
+        user_data = users.pop(user_id)
+        self._unindex(chat_id, user_id, user_data)
+        self._snapshots.pop(chat_id, None)
+        return user_data
+
     def remove_pending_verification(self, chat_id: int, user_id: int):
         """Remove a user from the pending verification list."""
         with self._lock:
-            if chat_id in self._pending_verifications and user_id in self._pending_verifications[chat_id]:
-                user_data = self._pending_verifications[chat_id].pop(user_id)
-                logger.debug(f"Removed pending verification for user {user_id} in chat {chat_id}")
-                return user_data
-            return None
-    
+            user_data = self._pop(chat_id, user_id)
+            if user_data is not None:
+                self._backend.append("remove", chat_id, user_id)
+                logger.debug("Removed pending verification for user %s in chat %s", user_id, chat_id)
+            return user_data
+
+    def sync(self) -> int:
+        """
+        Apply the changes other replicas sharing the backend have made.
+        Returns the number of operations applied.
+        """
+        operations = self._backend.poll()
+        with self._lock:
+            for op, chat_id, user_id, data in operations:
+                if op == "add":
+                    self._levels.get(chat_id, {}).pop(user_id, None)
+                    self._put(chat_id, user_id, data)
+                elif op == "level":
+                    self._pop(chat_id, user_id)
+                    self._put_level(chat_id, user_id, data)
+                else:
+                    self._pop(chat_id, user_id)
+                    self._levels.get(chat_id, {}).pop(user_id, None)
+        if operations:
+            logger.debug("Applied %d operations from other replicas", len(operations))
+        return len(operations)
+
+    def set_message_id(self, chat_id: int, user_ids: Iterable[int], message_id: int):
+        """Point the stored welcome message of several pending users at one message."""
+        with self._lock:
+            users = self._pending_verifications.get(chat_id, {})
+            for user_id in user_ids:
+                user_data = users.get(user_id)
+                if user_data is None:
+                    continue
+                self._unindex_message(chat_id, user_id, user_data)
+                user_data = dict(user_data, message_id=message_id)
+                users[user_id] = user_data
+                self._index_message(chat_id, user_id, user_data)
+                self._backend.append("add", chat_id, user_id, user_data)
+            self._snapshots.pop(chat_id, None)
+
+    def get_users_by_message(self, chat_id: int, message_id: int) -> Set[int]:
+        """Get the pending users whose welcome message is `message_id`."""
+        with self._lock:
+            return set(self._message_index.get((chat_id, message_id), ()))
+
     def get_pending_verification(self, chat_id: int, user_id: int):
         """Get pending verification data for a user."""
         with self._lock:
             if chat_id in self._pending_verifications and user_id in self._pending_verifications[chat_id]:
                 return self._pending_verifications[chat_id][user_id]
             return None
-    
+
     def is_pending_verification(self, chat_id: int, user_id: int) -> bool:
         """Check if a user is pending verification."""
         with self._lock:
             return chat_id in self._pending_verifications and user_id in self._pending_verifications[chat_id]
-    
-    def get_all_pending_users(self, chat_id: int) -> Dict[int, Dict]:
-        """Get all pending users for a specific chat."""
+
+    def get_all_pending_users(self, chat_id: int) -> Mapping[int, Dict]:
+        """
+        Get a read-only view of all pending users for a specific chat.
+        The view is a snapshot, rebuilt only after the chat changes.
+        """
+        with self._lock:
+            snapshot = self._snapshots.get(chat_id)
+            if snapshot is None:
+                if chat_id not in self._pending_verifications:
+                    return _EMPTY
+                snapshot = MappingProxyType(self._pending_verifications[chat_id].copy())
+                self._snapshots[chat_id] = snapshot
+            return snapshot
+
+    def get_pending_page(self, chat_id: int, offset: int, limit: int) -> List[Tuple[int, Dict]]:
+        """
+        Get up to `limit` (user_id, user_data) pairs of a chat, in join order,
+        starting at position `offset`.
+        """
+        with self._lock:
+            users = self._pending_verifications.get(chat_id, {})
+            order = self._join_order.get(chat_id, [])
+            return [(user_id, users[user_id]) for _, user_id in order[offset:offset + limit]]
+
+    def count_pending(self, chat_id: int = None) -> int:
+        """Count pending users in one chat, or across all chats."""
+        with self._lock:
+            if chat_id is None:
+                return self._count
+            return len(self._pending_verifications.get(chat_id, {}))
+
+    def count_pending_by_chat(self) -> Dict[int, int]:
+        """Count pending users per chat, leaving out chats with none."""
+        with self._lock:
+            return {chat_id: len(users) for chat_id, users in self._pending_verifications.items() if users}
+
+    def get_username_matches(self, username: str) -> Dict[int, int]:
+        """Get every pending user with this username, as {chat_id: user_id}."""
+        with self._lock:
+            return dict(self._username_index.get(username.lstrip("@").lower(), {}))
+
+    def find_pending_by_username(self, username: str, chat_id: int = None) -> Optional[Tuple[int, int]]:
+        """
+        Find the (chat_id, user_id) of a pending user by username.
+
+        A match in `chat_id` wins. Otherwise the username must be pending in
+        exactly one chat; ambiguous usernames return None.
+        """
+        matches = self.get_username_matches(username)
+        if chat_id is not None and chat_id in matches:
+            return chat_id, matches[chat_id]
+        if len(matches) == 1:
+            return next(iter(matches.items()))
+        return None
+
+    def get_pending_older_than(self, max_age: float, now: float = None) -> List[Tuple[int, int, Dict]]:
+        """
+        Get every (chat_id, user_id, user_data) pending for longer than max_age seconds.
+
+        Walks the heap from the root and only descends into entries older
+        than the cutoff, so the cost follows the number of matches rather
+        than the number of pending users. Results are not sorted.
+        """
+        cutoff = (now if now is not None else time.time()) - max_age
+        results = []
+        with self._lock:
+            heap = self._join_heap
+            stack = [0] if heap else []
+            while stack:
+                i = stack.pop()
+                entry = heap[i]
+                if entry[0] > cutoff:
+                    continue
+                if self._is_live(entry):
+                    _, chat_id, user_id = entry
+                    results.append((chat_id, user_id, self._pending_verifications[chat_id][user_id]))
+                for child in (2 * i + 1, 2 * i + 2):
+                    if child < len(heap):
+                        stack.append(child)
+        return results
+
+    def get_oldest_join_time(self) -> Optional[float]:
+        """Get the join timestamp of the longest-pending user."""
+        with self._lock:
+            while self._join_heap and not self._is_live(self._join_heap[0]):
+                heapq.heappop(self._join_heap)
+            return self._join_heap[0][0] if self._join_heap else None
+
+    def _put_level(self, chat_id: int, user_id: int, record: Dict):
+        self._levels.setdefault(chat_id, {})[user_id] = record
+        if record.get("promote_at") is not None:
+            heapq.heappush(self._promotion_heap, (record["promote_at"], chat_id, user_id))
+
+    def set_level(self, chat_id: int, user_id: int, level: int, promote_at: float = None):
+        """
+        Record the verification level a member has been granted and when
+        they are due for the next one. Members without a next promotion
+        are no longer tracked. A member granted a level is no longer
+        pending, and the single "level" or "remove" operation records both,
+        so the level is not lost behind a later "remove" of the pending entry.
+        """
+        with self._lock:
+            pending = self._pop(chat_id, user_id)
+            if promote_at is None:
+                if self._levels.get(chat_id, {}).pop(user_id, None) is not None or pending is not None:
+                    self._backend.append("remove", chat_id, user_id)
+                return
+            record = {"level": level, "promote_at": promote_at}
+            self._put_level(chat_id, user_id, record)
+            self._backend.append("level", chat_id, user_id, record)
+            logger.debug("User %s in chat %s at level %s until %s", user_id, chat_id, level, promote_at)
+
+    def get_level(self, chat_id: int, user_id: int) -> Optional[Dict]:
+        """Get the level record of a verified member still being promoted."""
+        with self._lock:
+            return self._levels.get(chat_id, {}).get(user_id)
+
+    def clear_level(self, chat_id: int, user_id: int):
+        """Stop tracking the level of a member, e.g. after they left."""
+        with self._lock:
+            if self._levels.get(chat_id, {}).pop(user_id, None) is not None:
+                self._backend.append("remove", chat_id, user_id)
+
+    def pop_due_promotions(self, now: float = None) -> Dict[int, List[Tuple[int, Dict]]]:
+        """
+        Take every member whose next promotion is due, grouped by chat as
+        {chat_id: [(user_id, record)]}. They stay recorded at their current
+        level until set_level() is called for them.
+        """
+        now = now if now is not None else time.time()
+        due: Dict[int, List[Tuple[int, Dict]]] = {}
+        with self._lock:
+            heap = self._promotion_heap
+            while heap and heap[0][0] <= now:
+                promote_at, chat_id, user_id = heapq.heappop(heap)
+                record = self._levels.get(chat_id, {}).get(user_id)
+                if record is not None and record["promote_at"] == promote_at:
+                    due.setdefault(chat_id, []).append((user_id, record))
+        return due
+
+    def flush(self):
+        """Write any buffered changes to the backend."""
+        self._backend.flush()
+
+class ChatSettingsStorage:
+    """
+    Per-chat settings, stored as overrides of the global defaults.
+
+    Settings:
+    - notify_chat_id: where new member notifications for the chat are sent
+    - admin_ids: users allowed to verify in the chat besides its Telegram admins
+    - verification_timeout: seconds before unverified users are removed (0 disables)
+    - allow_media: whether verified members may send photos, videos and files
+    - media_delay: seconds after verification before members may send media
+    - links_delay: seconds after that before they may send links and invite users
+
+    Listeners registered with add_listener() are called with the chat id
+    after a chat's settings change, or with None when all chats may have.
+    """
+    DEFAULTS = {
+        "notify_chat_id": ADMIN_ID,
+        "admin_ids": [],
+        "verification_timeout": VERIFICATION_TIMEOUT,
+        "allow_media": True,
+        "media_delay": LEVEL_MEDIA_DELAY,
+        "links_delay": LEVEL_LINKS_DELAY,
+    }
+
+    def __init__(self, backend: StorageBackend = None):
+        self._backend = backend or MemoryBackend()
+        self._overrides: Dict[int, Dict] = self._backend.load_settings()
+        self._listeners: List[Callable[[Optional[int]], None]] = []
+        self._lock = threading.RLock()
+
+    def add_listener(self, callback: Callable[[Optional[int]], None]):
+        """Call `callback(chat_id)` whenever settings change."""
+        self._listeners.append(callback)
+
+    def _notify(self, chat_id: Optional[int]):
+        for callback in self._listeners:
+            callback(chat_id)
+
+    def load(self) -> Dict[int, Dict]:
+        """Read the settings saved in the backend, e.g. off the event loop."""
+        return self._backend.load_settings()
+
+    def reload(self, overrides: Dict[int, Dict] = None):
+        """
+        Apply the settings saved in the backend, picking up changes made by
+        other replicas. Pass what load() returned to skip the read; listeners
+        are notified on the calling thread.
+        """
+        if overrides is None:
+            overrides = self.load()
+        with self._lock:
+            changed = overrides != self._overrides
+            self._overrides = overrides
+        if changed:
+            self._notify(None)
+
+    def get(self, chat_id: int, key: str):
+        """Get one setting of a chat, falling back to the global default."""
+        with self._lock:
+            return self._overrides.get(chat_id, {}).get(key, self.DEFAULTS[key])
+
+    def get_all(self, chat_id: int) -> Dict:
+        """Get every setting of a chat, defaults included."""
+        with self._lock:
+            return {**self.DEFAULTS, **self._overrides.get(chat_id, {})}
+
+    def set(self, chat_id: int, key: str, value):
+        """Override one setting of a chat."""
+        if key not in self.DEFAULTS:
+            raise KeyError(key)
+        with self._lock:
+            overrides = dict(self._overrides.get(chat_id, {}), **{key: value})
+            self._overrides[chat_id] = overrides
+            self._backend.save_settings(chat_id, overrides)
+        logger.info("Setting %s of chat %s changed to %r", key, chat_id, value)
+        self._notify(chat_id)
+
+    def values(self, key: str) -> Set:
+        """Get every distinct value of a setting across the default and all chats."""
+        with self._lock:
+            return {self.DEFAULTS[key]} | {
+                overrides[key] for overrides in self._overrides.values() if key in overrides
+            }
+
+class StudentEmailStorage:
+    """
+    Student email addresses members verified with, each bound for good to
+    the first member who verified with it, so one address can't verify
+    several accounts.
+    """
+    def __init__(self, backend: StorageBackend = None):
+        self._backend = backend or MemoryBackend()
+        self._owners: Dict[str, int] = self._backend.load_email_owners()
+        self._lock = threading.Lock()
+
+    def owner(self, address: str) -> Optional[int]:
+        """Get the member an address is bound to, if any."""
+        with self._lock:
+            return self._owners.get(address)
+
+    def bind(self, address: str, user_id: int) -> bool:
+        """
+        Bind an address to a member. Returns False if it already belongs to
+        another member, including one bound by another replica.
+        """
         with self._lock:
-            if chat_id in self._pending_verifications:
-                return self._pending_verifications[chat_id].copy()
-            return {}
+            owner = self._owners.get(address)
+            if owner is None:
+                owner = self._backend.bind_email(address, user_id)
+                self._owners[address] = owner
+        if owner != user_id:
+            logger.warning(f"User {user_id} tried to verify with an address already bound to user {owner}")
+            return False
+        return True
 
-# Global storage instance
-verification_storage = MemberVerificationStorage()
+# Global storage instances, sharing one backend
+backend = create_backend(STORAGE_BACKEND, STORAGE_PATH, origin=REPLICA_ID if CLUSTER_ENABLED else None)
+verification_storage = MemberVerificationStorage(backend)
+chat_settings = ChatSettingsStorage(backend)
+student_emails = StudentEmailStorage(backend)
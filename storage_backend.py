@@ -0,0 +1,332 @@
+"""
+Durable storage backends for the Telegram verification bot.
+Persists pending verifications so they survive restarts of the bot process.
+"""
+from typing import Dict, List, Optional, Tuple
+import atexit
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class StorageBackend:
+    """
+    Interface for the durable layer behind MemberVerificationStorage.
+
+    The in-memory storage stays the source of truth for reads. The backend
+    only receives an append-only stream of operations and must be able to
+    rebuild the in-memory index from it on startup.
+    """
+    def load(self) -> Dict[str, Dict[int, Dict[int, Dict]]]:
+        """
+        Return the members recorded by previous runs, grouped by the
+        operation that last touched them: "add" for pending verifications,
+        "level" for verified members still moving through the levels.
+        """
+        return {}
+
+    def append(self, op: str, chat_id: int, user_id: int, data: Dict = None):
+        """Record a single operation ("add", "level" or "remove")."""
+
+    def poll(self) -> List[Tuple[str, int, int, Optional[Dict]]]:
+        """
+        Return the operations other processes recorded since the last call,
+        as (op, chat_id, user_id, data). Only shared backends have any.
+        """
+        return []
+
+    def load_settings(self) -> Dict[int, Dict]:
+        """Return the per-chat settings saved by previous runs."""
+        return {}
+
+    def save_settings(self, chat_id: int, settings: Dict):
+        """Persist the settings overridden for one chat."""
+
+    def load_offset(self) -> Tuple[int, Optional[float]]:
+        """
+        Return the id of the last update fully processed by previous runs
+        and the time it was saved, or None if that is unknown.
+        """
+        return 0, None
+
+    def save_offset(self, update_id: int):
+        """Persist the id of the last update fully processed, with the current time."""
+
+    def load_email_owners(self) -> Dict[str, int]:
+        """Return the student email addresses bound to members, as {address: user_id}."""
+        return {}
+
+    def bind_email(self, address: str, user_id: int) -> int:
+        """
+        Bind an address to a member unless it is already bound. Returns the
+        member it is bound to, which only differs from `user_id` if another
+        member got it first.
+        """
+        return user_id
+
+    def flush(self):
+        """Force every buffered operation to durable storage."""
+
+    def close(self):
+        """Flush and release any resources held by the backend."""
+
+class MemoryBackend(StorageBackend):
+    """
+    No-op backend. Pending verifications only live in memory.
+    """
+
+class SQLiteBackend(StorageBackend):
+    """
+    SQLite backend using an append-only write-ahead log of operations.
+
+    Appends only touch an in-memory buffer, so callers never wait on disk I/O.
+    A background thread commits the buffer in batches, either every
+    `flush_interval` seconds or as soon as `batch_size` operations are queued.
+    Operations still buffered when the process dies are lost, which bounds the
+    data loss on a crash to roughly one flush interval.
+
+    Several processes can share one database. Each then passes its own
+    `origin`, rows are tagged with it, and poll() returns the rows written
+    by the others. Superseded rows are only compacted once they are older
+    than `retention` seconds, so the other processes have read them first.
+    """
+    def __init__(self, path: str, flush_interval: float = 0.05, batch_size: int = 256,
+                 origin: str = None, retention: float = 0.0):
+        self.path = path
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._origin = origin
+        self._retention = retention
+        self._last_seq = 0
+        self._buffer: List[Tuple] = []
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._closed = False
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS verification_log ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "op TEXT NOT NULL, "
+            "chat_id INTEGER NOT NULL, "
+            "user_id INTEGER NOT NULL, "
+            "data TEXT, "
+            "ts REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS verification_log_member "
+            "ON verification_log (chat_id, user_id, seq)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(verification_log)")}
+        if "origin" not in columns:
+            self._conn.execute("ALTER TABLE verification_log ADD COLUMN origin TEXT")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chat_settings ("
+            "chat_id INTEGER PRIMARY KEY, "
+            "data TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bot_state ("
+            "key TEXT PRIMARY KEY, "
+            "value INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS email_owners ("
+            "address TEXT PRIMARY KEY, "
+            "user_id INTEGER NOT NULL, "
+            "bound_at REAL NOT NULL)"
+        )
+
+        self._flusher = threading.Thread(target=self._run, name="storage-flusher", daemon=True)
+        self._flusher.start()
+        logger.debug("Opened SQLite storage backend at %s", path)
+
+    def load(self) -> Dict[str, Dict[int, Dict[int, Dict]]]:
+        """
+        Rebuild the tracked members from the log in a single pass.
+
+        Only the latest operation per (chat_id, user_id) matters, so the query
+        selects it directly instead of replaying the whole history. The log is
+        compacted afterwards so it only holds the live entries.
+        """
+        members: Dict[str, Dict[int, Dict[int, Dict]]] = {}
+        with self._io_lock:
+            rows = self._conn.execute(
+                "SELECT seq, op, chat_id, user_id, data FROM verification_log "
+                "WHERE seq IN (SELECT MAX(seq) FROM verification_log GROUP BY chat_id, user_id)"
+            ).fetchall()
+            self._last_seq = max((row[0] for row in rows), default=0)
+
+            live_seqs = []
+            for seq, op, chat_id, user_id, data in rows:
+                if op == "remove":
+                    continue
+                members.setdefault(op, {}).setdefault(chat_id, {})[user_id] = json.loads(data) if data else {}
+                live_seqs.append((seq,))
+
+            self._compact(live_seqs)
+
+        logger.info("Loaded %s tracked members from %s", len(live_seqs), self.path)
+        return members
+
+    def _compact(self, live_seqs: List[Tuple[int]]):
+        """Drop every log row that no longer describes a tracked member."""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS live_seqs (seq INTEGER PRIMARY KEY)")
+            self._conn.execute("DELETE FROM live_seqs")
+            self._conn.executemany("INSERT INTO live_seqs (seq) VALUES (?)", live_seqs)
+            self._conn.execute(
+                "DELETE FROM verification_log WHERE seq NOT IN (SELECT seq FROM live_seqs) AND ts < ?",
+                (time.time() - self._retention,)
+            )
+            self._conn.execute("DELETE FROM live_seqs")
+            self._conn.execute("COMMIT")
+        except sqlite3.Error:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def poll(self) -> List[Tuple[str, int, int, Optional[Dict]]]:
+        with self._io_lock:
+            rows = self._conn.execute(
+                "SELECT seq, op, chat_id, user_id, data, origin FROM verification_log "
+                "WHERE seq > ? ORDER BY seq",
+                (self._last_seq,)
+            ).fetchall()
+        if not rows:
+            return []
+        self._last_seq = rows[-1][0]
+        return [
+            (op, chat_id, user_id, json.loads(data) if data else None)
+            for _, op, chat_id, user_id, data, origin in rows
+            if origin != self._origin
+        ]
+
+    def load_settings(self) -> Dict[int, Dict]:
+        with self._io_lock:
+            rows = self._conn.execute("SELECT chat_id, data FROM chat_settings").fetchall()
+        return {chat_id: json.loads(data) for chat_id, data in rows}
+
+    def save_settings(self, chat_id: int, settings: Dict):
+        """Write a chat's settings immediately; they change rarely."""
+        with self._io_lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chat_settings (chat_id, data) VALUES (?, ?)",
+                (chat_id, json.dumps(settings))
+            )
+
+    def load_offset(self) -> Tuple[int, Optional[float]]:
+        with self._io_lock:
+            state = dict(self._conn.execute(
+                "SELECT key, value FROM bot_state WHERE key IN ('offset', 'offset_saved_at')"
+            ).fetchall())
+        return state.get("offset", 0), state.get("offset_saved_at")
+
+    def save_offset(self, update_id: int):
+        """Write the offset immediately; callers already throttle it."""
+        with self._io_lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO bot_state (key, value) VALUES ('offset', ?), ('offset_saved_at', ?)",
+                (update_id, int(time.time()))
+            )
+
+    def load_email_owners(self) -> Dict[str, int]:
+        with self._io_lock:
+            return dict(self._conn.execute("SELECT address, user_id FROM email_owners").fetchall())
+
+    def bind_email(self, address: str, user_id: int) -> int:
+        """Bind immediately; the first replica to insert an address keeps it."""
+        with self._io_lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO email_owners (address, user_id, bound_at) VALUES (?, ?, ?)",
+                (address, user_id, time.time())
+            )
+            return self._conn.execute("SELECT user_id FROM email_owners WHERE address = ?", (address,)).fetchone()[0]
+
+    def append(self, op: str, chat_id: int, user_id: int, data: Dict = None):
+        """Queue an operation for the next batch commit."""
+        payload = json.dumps(data) if data is not None else None
+        with self._cond:
+            self._buffer.append((op, chat_id, user_id, payload, time.time(), self._origin))
+            if len(self._buffer) >= self._batch_size:
+                self._cond.notify()
+
+    def _take_buffer(self) -> List[Tuple]:
+        batch = self._buffer
+        self._buffer = []
+        return batch
+
+    def _write(self, batch: List[Tuple]):
+        if not batch:
+            return
+        with self._io_lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO verification_log (op, chat_id, user_id, data, ts, origin) VALUES (?, ?, ?, ?, ?, ?)",
+                    batch
+                )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._buffer) < self._batch_size:
+                    self._cond.wait(self._flush_interval)
+                batch = self._take_buffer()
+                closed = self._closed
+
+            try:
+                self._write(batch)
+            except sqlite3.Error as e:
+                logger.error(f"Error writing {len(batch)} operations to {self.path}: {e}")
+                with self._cond:
+                    self._buffer[:0] = batch
+
+            if closed:
+                return
+
+    def flush(self):
+        """Commit every buffered operation immediately."""
+        with self._cond:
+            batch = self._take_buffer()
+        self._write(batch)
+
+    def close(self):
+        """Stop the flusher thread, commit what is left and close the database."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._flusher.join()
+        self.flush()
+        with self._io_lock:
+            self._conn.close()
+        logger.debug("Closed SQLite storage backend at %s", self.path)
+
+def create_backend(kind: str, path: Optional[str] = None, origin: str = None) -> StorageBackend:
+    """
+    Create the storage backend selected in the configuration.
+    Pass `origin` when the database is shared with other replicas.
+    """
+    if kind == "memory":
+        if origin:
+            raise ValueError("The memory backend cannot be shared between replicas")
+        return MemoryBackend()
+
+    if kind == "sqlite":
+        # Replicas read each other's rows every few seconds, an hour is plenty
+        backend = SQLiteBackend(path, origin=origin, retention=3600 if origin else 0.0)
+        atexit.register(backend.close)
+        return backend
+
+    raise ValueError(f"Unknown storage backend: {kind}")
@@ -1,176 +1,437 @@
 import logging
 import os
-import sys
 import time
 import asyncio
-from aiohttp import web
-from telegram import Update, ChatMemberUpdated, ChatPermissions
+from telegram import Update, InlineKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import (
     ApplicationBuilder,
+    CallbackQueryHandler,
     CommandHandler,
     ChatMemberHandler,
     ContextTypes,
+    MessageHandler,
+    filters,
 )
 
+from admin_cache import admin_cache
+from audit import AuditEvent, audit_log
+from challenge import CHALLENGE_PREFIX, challenge_callback, challenge_reply, start_challenge
+from cluster import create_replica
+from config import ADMIN_ID, CLUSTER_ENABLED, EXPIRY_INTERVAL, PROMOTION_INTERVAL, TELEGRAM_API_URL
+from dashboard import dashboard
+from expiry import expiry_job
+from idempotency import action_log
+from levels import grant_level, promotion_job
+from metrics import activity, instrument_handlers, metrics
+from outbound import Priority, outbound, reply_to
+from poller import UpdatePoller
+from raid import raid_guard
+from scoring import Verdict, apply_verdict, spam_scoring
+from storage import chat_settings, verification_storage
+from templates import permissions, templates
+from update_processor import ChatOrderedUpdateProcessor
+from utils import is_admin
+from welcome import ADMIN_DECISION_PREFIX, VERIFY_START_PREFIX, Outcome, welcome_aggregator
+
 # Get telegram token from environment variables for security
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
-ADMIN_ID = 7582664657  # Telegram ID of @UMFST_Admin
-
-# Store pending users for verification
-pending_users = {}
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('bot.log')
-    ]
-)
+
 logger = logging.getLogger(__name__)
 
-async def handle_chat_member_update(update: ChatMemberUpdated, context: ContextTypes.DEFAULT_TYPE):
-    new_user = update.chat_member.new_chat_member.user
-    chat_id = update.chat_member.chat.id
+async def is_chat_admin(bot, chat_id: int, user_id: int) -> bool:
+    """
+    Check if a user may moderate a chat: the bot owner, an extra admin
+    configured for the chat, or one of the chat's Telegram administrators.
+    """
+    if user_id == ADMIN_ID or user_id in chat_settings.get(chat_id, "admin_ids"):
+        return True
+    try:
+        return await admin_cache.is_admin(bot, chat_id, user_id)
+    except TelegramError as e:
+        logger.warning(f"Could not fetch administrators of chat {chat_id}: {e}")
+        return False
+
+async def handle_chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    member_update = update.chat_member
+    old_status = member_update.old_chat_member.status
+    new_status = member_update.new_chat_member.status
+    new_user = member_update.new_chat_member.user
+    chat_id = member_update.chat.id
+
+    # Promotions and demotions change who may verify in this chat
+    if is_admin(member_update.old_chat_member) != is_admin(member_update.new_chat_member):
+        admin_cache.invalidate(chat_id)
+
+    # Only users entering the chat need verification
+    joined = old_status in ("left", "kicked") and new_status in ("member", "restricted")
+    if not joined or new_user.is_bot:
+        return
+
+    # A replayed join, or a user still pending from an earlier join, needs nothing new
+    if verification_storage.is_pending_verification(chat_id, new_user.id):
+        return
+    with action_log.once(chat_id, new_user.id, "join") as first:
+        # The same join is already being handled
+        if not first:
+            return
+        audit_log.record(AuditEvent.JOIN, chat_id, new_user.id, actor_id=member_update.from_user.id)
+        # During a join flood the raid guard restricts joiners silently in batches
+        if raid_guard.on_join(context.bot, chat_id, new_user, chat_title=member_update.chat.title):
+            return
+        # Obvious spam accounts are removed and obviously genuine ones verified without an admin
+        score = await spam_scoring.evaluate(new_user, context.bot)
+        if score.verdict != Verdict.REVIEW:
+            await apply_verdict(context.bot, chat_id, new_user, score)
+            return
 
-    if new_user and not new_user.is_bot:
         # Restrict the new user
-        await context.bot.restrict_chat_member(
+        await outbound.call(
+            context.bot.restrict_chat_member,
+            priority=Priority.MODERATION,
             chat_id=chat_id,
             user_id=new_user.id,
-            permissions=ChatPermissions(can_send_messages=False)
+            permissions=permissions.get("restricted"),
+            use_independent_chat_permissions=True
         )
+        audit_log.record(AuditEvent.RESTRICT, chat_id, new_user.id)
 
         # Store for later verification
-        pending_users[new_user.username] = new_user.id
-
-        await context.bot.send_message(
+        verification_storage.add_pending_verification(
             chat_id=chat_id,
-            text=f"Hi @{new_user.username}, please verify by sending your student ID to the admin."
+            user_id=new_user.id,
+            username=new_user.username,
+            first_name=new_user.first_name,
+            last_name=new_user.last_name
         )
-        await context.bot.send_message(
-            chat_id=ADMIN_ID,
-            text=f"New member @{new_user.username} joined. Use /verify @{new_user.username} or /reject @{new_user.username}."
+
+        # Greet joiners in one message and notify the admin once per batch
+        welcome_aggregator.add_member(
+            context.bot,
+            chat_id,
+            new_user,
+            chat_title=member_update.chat.title,
+            notify_chat_id=chat_settings.get(chat_id, "notify_chat_id")
         )
 
-async def verify(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id != ADMIN_ID:
-        return
+async def verify_member(bot, chat_id: int, user_id: int, actor_id: int = None):
+    with action_log.once(chat_id, user_id, "verify") as first:
+        if not first:
+            return
+        user_data = verification_storage.get_pending_verification(chat_id, user_id)
+        await grant_level(bot, chat_id, user_id)  # Also removes them from the pending list
+        audit_log.record(AuditEvent.VERIFY, chat_id, user_id, actor_id, user_data["joined_at"] if user_data else None)
+        if user_data:
+            activity.record_verification(user_data["joined_at"])
+            welcome_aggregator.mark_handled(bot, chat_id, user_id, user_data.get("message_id"), Outcome.VERIFIED)
+
+        try:
+            await outbound.call(
+                bot.send_message,
+                chat_id=user_id,
+                text=templates.render("verified_dm")
+            )
+        except TelegramError as e:
+            # Users who never started the bot can't be messaged
+            logger.info("Could not notify verified user %s: %s", user_id, e)
+
+async def reject_member(bot, chat_id: int, user_id: int, actor_id: int = None):
+    with action_log.once(chat_id, user_id, "reject") as first:
+        if not first:
+            return
+        # Ban the user from the group
+        await outbound.call(bot.ban_chat_member, priority=Priority.MODERATION, chat_id=chat_id, user_id=user_id)
+        activity.record("reject")
+        user_data = verification_storage.remove_pending_verification(chat_id, user_id)  # Remove from pending list
+        audit_log.record(AuditEvent.REJECT, chat_id, user_id, actor_id, user_data["joined_at"] if user_data else None)
+        if user_data:
+            welcome_aggregator.mark_handled(bot, chat_id, user_id, user_data.get("message_id"), Outcome.REJECTED)
+
+async def find_pending_member(update: Update, context: ContextTypes.DEFAULT_TYPE, usage: str):
+    """
+    Find the pending member named in a command the sender may moderate.
+    In a group only that group is searched; in a private chat, every group
+    the sender administers.
+    """
     if not context.args:
-        await update.message.reply_text("Usage: /verify @username")
-        return
+        await reply_to(update.message, usage)
+        return None
 
     username = context.args[0].lstrip('@')
-    user_id = pending_users.get(username)
+    chat = update.effective_chat
+    sender_id = update.effective_user.id
 
-    if not user_id:
-        await update.message.reply_text("❗ User not found or not pending verification.")
-        return
+    if chat.type != chat.PRIVATE:
+        if not await is_chat_admin(context.bot, chat.id, sender_id):
+            return None
+        user_id = verification_storage.get_username_matches(username).get(chat.id)
+        if user_id is None:
+            await reply_to(update.message, "❗ User not found or not pending verification in this group.")
+            return None
+        return chat.id, user_id
 
-    chat_id = update.effective_chat.id
+    matches = [
+        (chat_id, user_id)
+        for chat_id, user_id in verification_storage.get_username_matches(username).items()
+        if await is_chat_admin(context.bot, chat_id, sender_id)
+    ]
+    if not matches:
+        await reply_to(update.message, "❗ User not found or not pending verification.")
+        return None
+    if len(matches) > 1:
+        await reply_to(update.message, "❗ This user is pending in several groups. Run the command inside the group.")
+        return None
+    return matches[0]
 
-    await context.bot.restrict_chat_member(
-        chat_id=chat_id,
-        user_id=user_id,
-        permissions=ChatPermissions(
-            can_send_messages=True,
-            can_send_media_messages=True,
-            can_send_other_messages=True,
-            can_add_web_page_previews=True
-        )
-    )
-    await context.bot.send_message(
-        chat_id=user_id,
-        text="✅ You've been verified! Welcome to the UMFST student community."
-    )
-    del pending_users[username]  # Remove from pending list
+async def verify(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    pending = await find_pending_member(update, context, "Usage: /verify @username")
+    if pending:
+        await verify_member(context.bot, *pending, actor_id=update.effective_user.id)
 
 async def reject(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id != ADMIN_ID:
-        return
-    if not context.args:
-        await update.message.reply_text("Usage: /reject @username")
-        return
+    pending = await find_pending_member(update, context, "Usage: /reject @username")
+    if pending:
+        await reject_member(context.bot, *pending, actor_id=update.effective_user.id)
+        await reply_to(update.message, f"@{context.args[0].lstrip('@')} has been removed from the group.")
 
-    username = context.args[0].lstrip('@')
-    user_id = pending_users.get(username)
+async def handle_admin_decision(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Apply a Verify/Reject button tapped on an admin notification."""
+    query = update.callback_query
+    _, action, chat_id, user_id = query.data.split(":")
+    chat_id, user_id = int(chat_id), int(user_id)
 
-    if not user_id:
-        await update.message.reply_text("❗ User not found or not pending verification.")
+    if not await is_chat_admin(context.bot, chat_id, query.from_user.id):
+        await outbound.call(query.answer, text="Only admins of that group can use these buttons.", show_alert=True)
         return
 
-    chat_id = update.effective_chat.id
+    if not verification_storage.is_pending_verification(chat_id, user_id):
+        outcome, notice = "➖", "This user is no longer pending verification."
+    else:
+        try:
+            if action == "v":
+                await verify_member(context.bot, chat_id, user_id, actor_id=query.from_user.id)
+                outcome, notice = Outcome.VERIFIED, "User verified."
+            else:
+                await reject_member(context.bot, chat_id, user_id, actor_id=query.from_user.id)
+                outcome, notice = Outcome.REJECTED, "User removed from the group."
+        except TelegramError as e:
+            logger.error(f"Error applying admin decision for user {user_id} in chat {chat_id}: {e}")
+            await outbound.call(query.answer, text=f"Failed: {e}", show_alert=True)
+            return
 
-    # Ban the user from the group
-    await context.bot.ban_chat_member(chat_id=chat_id, user_id=user_id)
-    await update.message.reply_text(f"@{username} has been removed from the group.")
-    del pending_users[username]  # Remove from pending list
+    await outbound.call(query.answer, text=notice)
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "👋 Welcome to the UMFST Student Bot!\n\n"
-        "Use /verify, /rules, or /resources to get started.\n"
-        "Admins can manage new members through /verify and /reject."
+    # Mark the user's line and drop their buttons from the notification
+    marker = f"(ID: {user_id})"
+    text = "\n".join(
+        f"{outcome} {line[2:]}" if line.startswith("• ") and line.endswith(marker) else line
+        for line in query.message.text.split("\n")
     )
+    keyboard = [
+        row for row in query.message.reply_markup.inline_keyboard
+        if not row[0].callback_data.endswith(f":{chat_id}:{user_id}")
+    ]
+    try:
+        await outbound.call(
+            context.bot.edit_message_text,
+            priority=Priority.ADMIN_DM,
+            chat_id=query.message.chat.id,
+            message_id=query.message.message_id,
+            text=text,
+            reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
+        )
+    except TelegramError as e:
+        logger.debug("Could not update admin notification: %s", e)
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await reply_to(update.message, templates.render("start"))
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "📖 Available Commands:\n"
-        "/start - Introduction message\n"
-        "/verify @username - Admins verify a user\n"
-        "/reject @username - Admins reject a user\n"
-        "/rules - Community rules\n"
-        "/resources - Useful links"
-    )
+    await reply_to(update.message, templates.render("commands"))
 
 async def rules_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "📌 UMFST Community Rules:\n"
-        "1. Be respectful.\n"
-        "2. No spam or self-promotion.\n"
-        "3. Use English or Romanian only.\n"
-        "4. Verify before participating.\n"
-        "5. Follow admin instructions."
-    )
+    await reply_to(update.message, templates.render("rules"))
 
 async def resources_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "📚 UMFST Student Resources:\n"
-        "🖥️ Student Portal: https://student.umfst.ro\n"
-        "📅 Class Schedule: https://orar.umfst.ro\n"
-        "📄 Academic Calendar: https://www.umfst.ro/academic-calendar\n"
-        "🌐 UMFST Website: https://www.umfst.ro"
+    await reply_to(update.message, templates.render("resources"))
+
+async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the verification settings of the current group."""
+    chat_id = update.effective_chat.id
+    if update.effective_chat.type == update.effective_chat.PRIVATE:
+        await reply_to(update.message, "Run /settings inside the group you want to inspect.")
+        return
+    if not await is_chat_admin(context.bot, chat_id, update.effective_user.id):
+        return
+
+    lines = [f"{key}: {value}" for key, value in chat_settings.get_all(chat_id).items()]
+    await reply_to(update.message, "⚙️ Group settings:\n" + "\n".join(lines) + "\n\nChange one with /set <key> <value>.")
+
+def parse_setting(key: str, args: list):
+    """Parse the arguments of /set into the type of the setting's default."""
+    default = chat_settings.DEFAULTS[key]
+    if isinstance(default, list):
+        return [int(arg) for arg in args]
+    if len(args) != 1:
+        raise ValueError("expected a single value")
+    if isinstance(default, bool):
+        if args[0].lower() not in ("true", "false", "on", "off", "1", "0"):
+            raise ValueError("expected true or false")
+        return args[0].lower() in ("true", "on", "1")
+    return type(default)(args[0])
+
+async def set_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Change one verification setting of the current group."""
+    chat_id = update.effective_chat.id
+    if update.effective_chat.type == update.effective_chat.PRIVATE:
+        await reply_to(update.message, "Run /set inside the group you want to configure.")
+        return
+    if not await is_chat_admin(context.bot, chat_id, update.effective_user.id):
+        return
+
+    if not context.args or context.args[0] not in chat_settings.DEFAULTS:
+        keys = ", ".join(chat_settings.DEFAULTS)
+        await reply_to(update.message, f"Usage: /set <key> <value>\nKeys: {keys}")
+        return
+
+    key = context.args[0]
+    try:
+        value = parse_setting(key, context.args[1:])
+    except ValueError as e:
+        await reply_to(update.message, f"❗ Invalid value for {key}: {e}")
+        return
+
+    chat_settings.set(chat_id, key, value)
+    await reply_to(update.message, f"✅ {key} set to {value}.")
+
+def register_metrics(app, replica=None):
+    """Expose pending users and queue depths as gauges, read at scrape time."""
+    metrics.gauge(
+        "bot_pending_verifications", "Users awaiting verification, per chat.",
+        lambda: {(chat_id,): count for chat_id, count in verification_storage.count_pending_by_chat().items()},
+        ["chat_id"]
+    )
+    metrics.gauge(
+        "bot_outbound_queue_depth", "Bot API calls waiting to be sent, per priority class.",
+        lambda: {(queue,): depth for queue, depth in outbound.queue_depths().items()},
+        ["queue"]
+    )
+    metrics.gauge(
+        "bot_update_queue_depth", "Updates received but not yet dispatched to handlers.",
+        lambda: {(): app.update_queue.qsize()}
     )
+    metrics.gauge(
+        "bot_chat_queue_depth", "Updates waiting for earlier ones of the same chat.",
+        lambda: {(chat_id,): depth for chat_id, depth in app.update_processor.queue_depths().items()},
+        ["chat_id"]
+    )
+    if replica is not None:
+        metrics.gauge(
+            "bot_cluster_queue_depth", "Updates queued in the shared store, per partition.",
+            lambda: {(partition,): depth for partition, depth in replica.store.queue_depths().items()},
+            ["partition"]
+        )
 
-async def handle(request):
-    return web.Response(text="Bot is running")
+async def start_webserver(port: int = None):
+    # aiohttp is imported here rather than at startup, see main()
+    from webserver import start_webserver as serve
+    return await serve(port or int(os.environ.get("PORT", 5000)))
 
-async def start_webserver():
-    app = web.Application()
-    app.add_routes([web.get('/', handle)])
-    runner = web.AppRunner(app)
-    await runner.setup()
-    port = int(os.environ.get("PORT", 5000))
-    site = web.TCPSite(runner, '0.0.0.0', port)
-    await site.start()
-    print(f"Web server started on port {port}")
+async def run_replica(app, port: int = None):
+    """Run the bot as one of several replicas sharing the storage."""
+    replica = create_replica(app)
+    register_metrics(app, replica)
+    dashboard.mode = "cluster"
+    # Only the poller sweeps, so expired users are not kicked twice
+    app.job_queue.run_repeating(replica.leader_only(expiry_job), interval=EXPIRY_INTERVAL, first=EXPIRY_INTERVAL)
+    app.job_queue.run_repeating(replica.leader_only(promotion_job), interval=PROMOTION_INTERVAL, first=PROMOTION_INTERVAL)
 
-async def main():
+    async with app:
+        await app.start()
+        await start_webserver(port)
+        dashboard.status = "running"
+        try:
+            await replica.run()
+        finally:
+            await app.stop()
+
+async def main(started_at: float = None, exit_after_first_poll: bool = False, port: int = None):
+    """
+    Run the bot and its web server on `port` (default: $PORT or 5000)
+    until cancelled. `started_at` is the time.perf_counter()
+    reading taken when the process started, used to log how long the
+    first getUpdates took. With `exit_after_first_poll` the bot stops once
+    it is answered, for measuring startup.
+    """
     # Set up the bot application
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    # Updates of one chat stay in order, different chats are handled in parallel
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .base_url(f"{TELEGRAM_API_URL}/bot")
+        .base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+        .concurrent_updates(ChatOrderedUpdateProcessor())
+        .build()
+    )
 
     # Register all command handlers
     app.add_handler(ChatMemberHandler(handle_chat_member_update, ChatMemberHandler.CHAT_MEMBER))
+    # The welcome message button opens a self-service challenge with /start v<chat_id>
+    app.add_handler(CommandHandler(
+        "start", start_challenge, filters.ChatType.PRIVATE & filters.Regex(rf"^/start {VERIFY_START_PREFIX}-?\d+$")
+    ))
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("rules", rules_command))
     app.add_handler(CommandHandler("resources", resources_command))
     app.add_handler(CommandHandler("verify", verify))
     app.add_handler(CommandHandler("reject", reject))
+    app.add_handler(CommandHandler("settings", settings_command))
+    app.add_handler(CommandHandler("set", set_command))
+    app.add_handler(CallbackQueryHandler(handle_admin_decision, pattern=f"^{ADMIN_DECISION_PREFIX}:"))
+    app.add_handler(CallbackQueryHandler(challenge_callback, pattern=f"^{CHALLENGE_PREFIX}:"))
+    app.add_handler(MessageHandler(filters.ChatType.PRIVATE & filters.TEXT & ~filters.COMMAND, challenge_reply))
+
+    # Record the latency of every handler registered above
+    instrument_handlers(app)
+
+    if CLUSTER_ENABLED:
+        await run_replica(app, port)
+        return
+    register_metrics(app)
+    dashboard.mode = "polling"
+
+    # Periodically remove users who were never verified. Always scheduled,
+    # since any group can enable its own timeout
+    app.job_queue.run_repeating(expiry_job, interval=EXPIRY_INTERVAL, first=EXPIRY_INTERVAL)
+    # Promote verified members to their next level as it becomes due
+    app.job_queue.run_repeating(promotion_job, interval=PROMOTION_INTERVAL, first=PROMOTION_INTERVAL)
 
-    # Run web server and bot concurrently
-    await asyncio.gather(start_webserver(), app.run_polling())
+    # Run web server and bot concurrently. The poller resumes from our own
+    # checkpoint instead of run_polling, which would replay or drop updates
+    async with app:
+        await app.start()
+        poller = UpdatePoller(app, started_at=started_at)
+        polling = asyncio.create_task(poller.run())
+        try:
+            # The web server only starts once the first getUpdates is answered,
+            # so importing and starting it never delays receiving updates
+            first_poll = asyncio.create_task(poller.first_poll.wait())
+            await asyncio.wait((polling, first_poll), return_when=asyncio.FIRST_COMPLETED)
+            first_poll.cancel()
+            if polling.done():
+                # Raise whatever stopped the poller before it got that far
+                polling.result()
+            if exit_after_first_poll:
+                return
+            await start_webserver(port)
+            dashboard.status = "running"
+            await polling
+        finally:
+            polling.cancel()
+            await app.stop()
 
 if __name__ == "__main__":
+    from logs import configure_logging
+    configure_logging()
     asyncio.run(main())
@@ -0,0 +1,216 @@
+"""
+Prebuilt chat permissions and message templates.
+Everything is built once and cached until the chat settings it depends on change.
+"""
+from string import Formatter
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+import logging
+from telegram import ChatPermissions
+from telegram.constants import ParseMode
+from telegram.helpers import escape_markdown
+
+from storage import ChatSettingsStorage, chat_settings
+from utils import get_restricted_permissions, get_full_permissions
+
+logger = logging.getLogger(__name__)
+
+# Permissions withheld from verified members of chats with allow_media off.
+# Presets are applied with use_independent_chat_permissions, otherwise
+# Telegram would grant these back through can_send_other_messages and
+# can_add_web_page_previews
+MEDIA_PERMISSIONS = (
+    "can_send_audios", "can_send_documents", "can_send_photos",
+    "can_send_videos", "can_send_video_notes", "can_send_voice_notes",
+)
+
+# Permissions added at each verification level on top of the previous one
+TEXT_PERMISSIONS = ("can_send_messages",)
+MEDIA_LEVEL_PERMISSIONS = MEDIA_PERMISSIONS + ("can_send_polls", "can_send_other_messages")
+
+class PermissionRegistry:
+    """
+    Named ChatPermissions presets, shared between calls.
+
+    ChatPermissions objects are immutable, so one instance per preset and
+    chat is built on first use and reused, along with its serialized
+    payload for raw API requests. Chats only get their own instance when
+    their settings change the preset.
+    """
+    def __init__(self, settings: ChatSettingsStorage = chat_settings):
+        self._settings = settings
+        restricted = get_restricted_permissions()
+        text = self._extend(restricted, TEXT_PERMISSIONS)
+        self._base = {
+            "restricted": restricted,
+            "text": text,
+            "media": self._extend(text, MEDIA_LEVEL_PERMISSIONS),
+            "verified": get_full_permissions(),
+        }
+        self._cache: Dict[Tuple[str, Optional[int]], Tuple[ChatPermissions, Mapping]] = {}
+        settings.add_listener(self.invalidate)
+
+    @staticmethod
+    def _extend(permissions: ChatPermissions, allowed) -> ChatPermissions:
+        return ChatPermissions(**{**permissions.to_dict(), **dict.fromkeys(allowed, True)})
+
+    def _overrides(self, name: str, chat_id: Optional[int]) -> Dict[str, bool]:
+        """Per-chat changes to a preset."""
+        if name in ("media", "verified") and chat_id is not None and not self._settings.get(chat_id, "allow_media"):
+            return dict.fromkeys(MEDIA_PERMISSIONS, False)
+        return {}
+
+    def _entry(self, name: str, chat_id: Optional[int]) -> Tuple[ChatPermissions, Mapping]:
+        key = (name, chat_id)
+        entry = self._cache.get(key)
+        if entry is None:
+            permissions = self._base[name]
+            overrides = self._overrides(name, chat_id)
+            if overrides:
+                permissions = ChatPermissions(**{**permissions.to_dict(), **overrides})
+            entry = (permissions, MappingProxyType(permissions.to_dict()))
+            self._cache[key] = entry
+        return entry
+
+    def get(self, name: str, chat_id: int = None) -> ChatPermissions:
+        """
+        Get a preset as it applies in a chat: "restricted", then one per
+        verification level, "text", "media" and "verified".
+        """
+        return self._entry(name, chat_id)[0]
+
+    def payload(self, name: str, chat_id: int = None) -> Mapping:
+        """Get the serialized form of a preset, ready for a raw API request."""
+        return self._entry(name, chat_id)[1]
+
+    def invalidate(self, chat_id: int = None):
+        """Forget the presets of one chat, or of every chat."""
+        if chat_id is None:
+            self._cache.clear()
+        else:
+            for key in [key for key in self._cache if key[1] == chat_id]:
+                del self._cache[key]
+
+# Message templates: name -> (text, parse mode). Markdown templates are
+# written escaped; values filled in at render time are escaped for them.
+TEMPLATES = {
+    "help": (
+        "🤖 *Verification Bot Help* 🤖\n\n"
+        "*For Admins:*\n"
+        "/verify USER\\_ID - Approve a user and grant chat permissions\n"
+        "/reject USER\\_ID - Remove a user from the group\n"
+        "Both accept several users at once: IDs, @usernames, ID ranges (FIRST-LAST) or `all`\n"
+        "/listpending - Show users awaiting verification, with buttons to verify or reject them\n"
+        "/help - Show this help message\n\n"
+        "*How it works:*\n"
+        "1. When new users join, they are restricted from sending messages and greeted together in one message\n"
+        "2. An admin must verify them using the /verify command\n"
+        "3. Once verified, users can participate in the chat\n"
+        "4. Alternatively, admins can reject users with /reject",
+        ParseMode.MARKDOWN
+    ),
+    "welcome_pending": (
+        "To prevent spam, new members can't send messages until they are verified. "
+        "Tap the button below to verify yourself in a private chat with me, "
+        "or send your student ID to an admin.",
+        None
+    ),
+    "welcome_done": ("All new members above have been handled.", None),
+    "verified_dm": ("✅ You've been verified! Welcome to the UMFST student community.", None),
+    "start": (
+        "👋 Welcome to the UMFST Student Bot!\n\n"
+        "Use /verify, /rules, or /resources to get started.\n"
+        "Admins can manage new members through /verify and /reject.",
+        None
+    ),
+    "commands": (
+        "📖 Available Commands:\n"
+        "/start - Introduction message\n"
+        "/verify @username - Admins verify a user\n"
+        "/reject @username - Admins reject a user\n"
+        "/settings - Admins view this group's settings\n"
+        "/set <key> <value> - Admins change a group setting\n"
+        "/rules - Community rules\n"
+        "/resources - Useful links",
+        None
+    ),
+    "rules": (
+        "📌 UMFST Community Rules:\n"
+        "1. Be respectful.\n"
+        "2. No spam or self-promotion.\n"
+        "3. Use English or Romanian only.\n"
+        "4. Verify before participating.\n"
+        "5. Follow admin instructions.",
+        None
+    ),
+    "resources": (
+        "📚 UMFST Student Resources:\n"
+        "🖥️ Student Portal: https://student.umfst.ro\n"
+        "📅 Class Schedule: https://orar.umfst.ro\n"
+        "📄 Academic Calendar: https://www.umfst.ro/academic-calendar\n"
+        "🌐 UMFST Website: https://www.umfst.ro",
+        None
+    ),
+}
+
+class MessageTemplates:
+    """
+    Renders message templates.
+
+    Templates are parsed once into literal text and {fields}. Fields are
+    filled from the values passed to render() or, when a chat is given,
+    from that chat's settings. Renders that only depend on the chat are
+    cached until its settings change.
+    """
+    def __init__(self, templates: Dict[str, Tuple[str, Optional[str]]] = TEMPLATES,
+                 settings: ChatSettingsStorage = chat_settings):
+        self._settings = settings
+        self._compiled: Dict[str, Tuple[List[Tuple], Optional[str]]] = {
+            name: (list(Formatter().parse(text)), parse_mode)
+            for name, (text, parse_mode) in templates.items()
+        }
+        self._cache: Dict[Tuple[str, Optional[int]], str] = {}
+        settings.add_listener(self.invalidate)
+
+    def parse_mode(self, name: str) -> Optional[str]:
+        """Parse mode to send a template with."""
+        return self._compiled[name][1]
+
+    def render(self, name: str, chat_id: int = None, /, **values) -> str:
+        """Fill in a template, escaping the values for its parse mode."""
+        if not values:
+            key = (name, chat_id)
+            text = self._cache.get(key)
+            if text is None:
+                text = self._render(name, chat_id, values)
+                self._cache[key] = text
+            return text
+        return self._render(name, chat_id, values)
+
+    def _render(self, name: str, chat_id: Optional[int], values: Dict) -> str:
+        parts, parse_mode = self._compiled[name]
+        if chat_id is not None:
+            values = {**self._settings.get_all(chat_id), **values}
+
+        chunks = []
+        for literal, field, spec, conversion in parts:
+            chunks.append(literal)
+            if field is None:
+                continue
+            value = format(values[field], spec or "")
+            if parse_mode == ParseMode.MARKDOWN:
+                value = escape_markdown(value)
+            chunks.append(value)
+        return "".join(chunks)
+
+    def invalidate(self, chat_id: int = None):
+        """Forget the renders of one chat, or of every chat."""
+        if chat_id is None:
+            self._cache.clear()
+        else:
+            for key in [key for key in self._cache if key[1] == chat_id]:
+                del self._cache[key]
+
+# Global registry instances
+permissions = PermissionRegistry()
+templates = MessageTemplates()
@@ -0,0 +1,12 @@
+"""
+Test setup: in-memory storage and no audit file, configured before any
+bot module reads the environment.
+"""
+import os
+import sys
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("AUDIT_PATH", "")
+os.environ.setdefault("CLUSTER_ENABLED", "False")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+import cluster
+from cluster import ClusterStore, Replica
+from storage import ChatSettingsStorage
+from storage_backend import SQLiteBackend
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_ack_renews_the_lease_while_held(tmp_path):
+    clock = Clock()
+    store = ClusterStore(str(tmp_path / "cluster.db"), "a", lease_ttl=10, clock=clock)
+    other = ClusterStore(str(tmp_path / "cluster.db"), "b", lease_ttl=10, clock=clock)
+    store.enqueue([(1, 0, "{}"), (2, 0, "{}")], 3)
+    assert store.acquire_lease("partition:0")
+
+    # Each acknowledged update pushes the expiry further out
+    clock.now += 8
+    assert store.ack(store.fetch(0, 1)[0][0], "partition:0")
+    clock.now += 8
+    assert not other.acquire_lease("partition:0")
+    assert [seq for seq, _ in store.fetch(0, 10)] == [2]
+
+def test_ack_after_losing_the_lease_keeps_the_update(tmp_path):
+    clock = Clock()
+    store = ClusterStore(str(tmp_path / "cluster.db"), "a", lease_ttl=10, clock=clock)
+    other = ClusterStore(str(tmp_path / "cluster.db"), "b", lease_ttl=10, clock=clock)
+    store.enqueue([(1, 0, "{}")], 2)
+    assert store.acquire_lease("partition:0")
+
+    # A slow handler outlives the lease and another replica takes over
+    clock.now += 11
+    assert other.acquire_lease("partition:0")
+    seq = store.fetch(0, 1)[0][0]
+    assert not store.ack(seq, "partition:0")
+    assert other.fetch(0, 10) == [(seq, "{}")]
+
+def test_settings_listeners_run_on_the_event_loop(tmp_path, monkeypatch):
+    path = str(tmp_path / "verification.db")
+    ours, theirs = SQLiteBackend(path, origin="a"), SQLiteBackend(path, origin="b")
+    settings = ChatSettingsStorage(ours)
+    monkeypatch.setattr(cluster, "chat_settings", settings)
+    notified = []
+    settings.add_listener(lambda chat_id: notified.append(threading.current_thread()))
+    replica = Replica(None, ClusterStore(str(tmp_path / "cluster.db"), "a"), sync_interval=0.01)
+
+    async def scenario():
+        # Another replica changes a setting
+        ChatSettingsStorage(theirs).set(-1001, "allow_media", False)
+        task = asyncio.create_task(replica._sync_loop())
+        while not notified:
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    try:
+        asyncio.run(asyncio.wait_for(scenario(), 5))
+    finally:
+        ours.close()
+        theirs.close()
+    assert notified == [threading.main_thread()]
+    assert settings.get(-1001, "allow_media") is False
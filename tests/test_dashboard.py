@@ -0,0 +1,29 @@
+"""
+The dashboard names every chat, so it is only served with its token.
+"""
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import webserver
+from dashboard import Dashboard
+
+def test_token_is_required():
+    assert not Dashboard(token="").check_token("")
+    dashboard = Dashboard(token="s3cret")
+    assert dashboard.check_token("s3cret")
+    assert not dashboard.check_token(None)
+    assert not dashboard.check_token("guess")
+
+def test_web_server_refuses_requests_without_the_token(monkeypatch):
+    monkeypatch.setattr(webserver, "dashboard", Dashboard(token="s3cret"))
+
+    async def scenario():
+        async with TestClient(TestServer(webserver.create_app())) as client:
+            assert (await client.get("/")).status == 403
+            assert (await client.get("/api/dashboard?token=guess")).status == 403
+            assert (await client.get("/?token=s3cret")).status == 200
+            response = await client.get("/api/dashboard", headers={"X-Dashboard-Token": "s3cret"})
+            assert response.status == 200
+
+    asyncio.run(scenario())
@@ -0,0 +1,45 @@
+"""
+The expiry sweep must not kick a member verified after it took its snapshot.
+"""
+import asyncio
+
+import expiry
+from idempotency import action_log
+from storage import verification_storage
+
+class FakeBot:
+    def __init__(self):
+        self.calls = []
+
+    async def ban_chat_member(self, **kwargs):
+        self.calls.append("ban_chat_member")
+        return True
+
+    async def unban_chat_member(self, **kwargs):
+        self.calls.append("unban_chat_member")
+        return True
+
+def test_verified_after_snapshot_is_not_kicked():
+    chat_id, user_id = -1002, 5151
+    verification_storage.add_pending_verification(chat_id, user_id, first_name="Ana")
+    user_data = verification_storage.get_pending_verification(chat_id, user_id)
+    verification_storage.remove_pending_verification(chat_id, user_id)
+    bot = FakeBot()
+
+    assert not asyncio.run(expiry.kick_expired_user(bot, chat_id, user_id, user_data))
+    assert bot.calls == []
+
+def test_verification_in_progress_wins():
+    chat_id, user_id = -1002, 5252
+    verification_storage.add_pending_verification(chat_id, user_id, first_name="Ana")
+    user_data = verification_storage.get_pending_verification(chat_id, user_id)
+    bot = FakeBot()
+
+    with action_log.once(chat_id, user_id, "verify"):
+        assert not asyncio.run(expiry.kick_expired_user(bot, chat_id, user_id, user_data))
+    assert bot.calls == []
+    assert verification_storage.is_pending_verification(chat_id, user_id)
+
+    assert asyncio.run(expiry.kick_expired_user(bot, chat_id, user_id, user_data))
+    assert bot.calls == ["ban_chat_member", "unban_chat_member"]
+    assert not verification_storage.is_pending_verification(chat_id, user_id)
@@ -0,0 +1,58 @@
+"""
+A saved offset must not outlive Telegram's update ids.
+"""
+from idempotency import ProcessedUpdates
+from storage_backend import SQLiteBackend
+
+DAY = 24 * 60 * 60
+
+class Clock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def test_recent_offset_survives_a_restart(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "verification.db"))
+    try:
+        processed = ProcessedUpdates(backend)
+        assert processed.begin(500)
+        processed.finish(500)
+        processed.checkpoint()
+
+        restarted = ProcessedUpdates(backend)
+        assert restarted.offset == 500
+        assert not restarted.begin(499)
+    finally:
+        backend.close()
+
+def test_offset_older_than_a_week_is_ignored(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "verification.db"))
+    try:
+        processed = ProcessedUpdates(backend)
+        assert processed.begin(500)
+        processed.finish(500)
+        processed.checkpoint()
+
+        # The campus is on holiday; Telegram then restarts from a random id
+        clock = Clock(backend.load_offset()[1] + 8 * DAY)
+        restarted = ProcessedUpdates(backend, wall_clock=clock)
+        assert restarted.offset == 0
+        assert restarted.begin(42)
+        assert not restarted.begin(42)
+    finally:
+        backend.close()
+
+def test_offset_expires_while_running():
+    clock = Clock(1000.0)
+    processed = ProcessedUpdates(wall_clock=clock)
+    assert processed.begin(500)
+    processed.finish(500)
+    clock.now += 3 * DAY
+    assert not processed.begin(400)
+
+    clock.now += 8 * DAY
+    assert processed.begin(42)
+    processed.finish(42)
+    assert processed.offset == 42
@@ -0,0 +1,49 @@
+"""
+A verified member's level must survive a restart and reach other replicas.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import handlers
+import levels
+from storage import MemberVerificationStorage
+from storage_backend import SQLiteBackend
+
+class FakeBot:
+    async def restrict_chat_member(self, **kwargs):
+        return True
+
+    async def send_message(self, **kwargs):
+        return SimpleNamespace(message_id=1)
+
+def test_verified_level_survives_reload(tmp_path, monkeypatch):
+    chat_id, user_id = -1001, 4242
+    path = str(tmp_path / "verification.db")
+    backend = SQLiteBackend(path, origin="a")
+    replica = SQLiteBackend(path, origin="b")
+    storage = MemberVerificationStorage(backend)
+    other = MemberVerificationStorage(replica)
+    monkeypatch.setattr(handlers, "verification_storage", storage)
+    monkeypatch.setattr(levels, "verification_storage", storage)
+    try:
+        storage.add_pending_verification(chat_id, user_id, first_name="Ana")
+        asyncio.run(handlers.verify_user(FakeBot(), chat_id, user_id, actor_id=1))
+        assert not storage.is_pending_verification(chat_id, user_id)
+        level = storage.get_level(chat_id, user_id)
+        assert level is not None
+
+        backend.flush()
+        other.sync()
+        assert other.get_level(chat_id, user_id) == level
+        assert not other.is_pending_verification(chat_id, user_id)
+    finally:
+        backend.close()
+        replica.close()
+
+    backend = SQLiteBackend(path)
+    try:
+        reloaded = MemberVerificationStorage(backend)
+        assert reloaded.get_level(chat_id, user_id) == level
+        assert not reloaded.is_pending_verification(chat_id, user_id)
+    finally:
+        backend.close()
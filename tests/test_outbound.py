@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+
+from outbound import OutboundScheduler, Priority
+
+def test_retry_after_in_a_group_pauses_only_that_group():
+    sent = []
+    flooded = {-1}
+
+    async def send_message(chat_id, text):
+        if chat_id in flooded:
+            flooded.discard(chat_id)
+            raise RetryAfter(1)
+        sent.append((chat_id, text, time.monotonic()))
+
+    async def restrict_chat_member(chat_id, user_id):
+        sent.append((chat_id, "restrict", time.monotonic()))
+
+    async def run():
+        scheduler = OutboundScheduler(global_rate=1000, chat_rate_per_minute=1000)
+        started = time.monotonic()
+        flooded_call = asyncio.ensure_future(scheduler.call(send_message, chat_id=-1, text="a"))
+        await asyncio.sleep(0.1)
+        await asyncio.wait_for(asyncio.gather(
+            scheduler.call(send_message, chat_id=-2, text="b"),
+            scheduler.call(restrict_chat_member, priority=Priority.MODERATION, chat_id=-1, user_id=5),
+        ), 0.5)
+        assert time.monotonic() - started < 0.5
+        await asyncio.wait_for(flooded_call, 2)
+        return started
+
+    started = asyncio.run(run())
+    times = {text: at - started for _, text, at in sent}
+    assert times["b"] < 0.5 and times["restrict"] < 0.5
+    assert times["a"] >= 1
+
+def test_retry_after_outside_groups_pauses_everything():
+    sent = []
+    flooded = {7}
+
+    async def send_message(chat_id, text):
+        if chat_id in flooded:
+            flooded.discard(chat_id)
+            raise RetryAfter(1)
+        sent.append((text, time.monotonic()))
+
+    async def run():
+        scheduler = OutboundScheduler(global_rate=1000, chat_rate_per_minute=1000)
+        started = time.monotonic()
+        first = asyncio.ensure_future(scheduler.call(send_message, chat_id=7, text="dm"))
+        await asyncio.sleep(0.1)
+        await asyncio.wait_for(asyncio.gather(first, scheduler.call(send_message, chat_id=-2, text="b")), 3)
+        return started
+
+    started = asyncio.run(run())
+    assert all(at - started >= 1 for _, at in sent)
@@ -0,0 +1,49 @@
+import asyncio
+
+from telegram import Chat, Message, Update, User
+
+from idempotency import ProcessedUpdates
+from poller import UpdatePoller
+
+def message_update(update_id: int, chat_id: int) -> Update:
+    chat = Chat(chat_id, Chat.SUPERGROUP)
+    user = User(update_id, "Ana", False)
+    return Update(update_id, message=Message(update_id, None, chat, from_user=user, text="hi"))
+
+class FakeBot:
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.offsets = []
+
+    async def get_updates(self, offset, limit, timeout, allowed_updates, read_timeout):
+        self.offsets.append(offset)
+        return self.batches.pop(0) if self.batches else []
+
+class StalledProcessor:
+    async def join(self):
+        raise AssertionError("the poller waited for a batch to be processed")
+
+class FakeApplication:
+    def __init__(self, bot):
+        self.bot = bot
+        self.update_queue = asyncio.Queue()
+        self.update_processor = StalledProcessor()
+
+def test_next_batch_is_fetched_while_updates_are_in_flight():
+    async def run():
+        bot = FakeBot([[message_update(1, -1), message_update(2, -2)], [message_update(3, -1)]])
+        processed = ProcessedUpdates()
+        poller = UpdatePoller(FakeApplication(bot), processed=processed, batch_size=100)
+        assert await poller._poll(1) == 2
+        assert await poller._poll(1) == 1
+        assert bot.offsets == [0, 3]
+
+        # Update 1 is stuck behind a rate limit, 2 and 3 are done
+        for update_id in (1, 2, 3):
+            processed.begin(update_id)
+        processed.finish(2)
+        processed.finish(3)
+        assert processed.offset == 0
+        processed.finish(1)
+        assert processed.offset == 3
+    asyncio.run(run())
@@ -0,0 +1,99 @@
+"""
+A member who was rejected and joins again must be restricted again.
+"""
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from telegram import Chat, ChatMemberLeft, ChatMemberMember, ChatMemberUpdated, User
+
+import handlers
+import telegram_bot
+from storage import verification_storage
+
+class FakeBot:
+    """Records the Bot API calls made through the outbound scheduler."""
+    username = "test_bot"
+
+    def __init__(self):
+        self.calls = []
+
+    async def restrict_chat_member(self, **kwargs):
+        self.calls.append(("restrict_chat_member", kwargs["chat_id"], kwargs["user_id"]))
+        return True
+
+    async def ban_chat_member(self, **kwargs):
+        self.calls.append(("ban_chat_member", kwargs["chat_id"], kwargs["user_id"]))
+        return True
+
+    async def unban_chat_member(self, **kwargs):
+        self.calls.append(("unban_chat_member", kwargs["chat_id"], kwargs["user_id"]))
+        return True
+
+    async def get_user_profile_photos(self, **kwargs):
+        return SimpleNamespace(total_count=1)
+
+    async def send_message(self, **kwargs):
+        return SimpleNamespace(message_id=1)
+
+    def restricts(self, chat_id, user_id):
+        return self.calls.count(("restrict_chat_member", chat_id, user_id))
+
+def test_rejoin_after_reject_is_restricted_again():
+    chat_id = -1001
+    user = User(id=4242, first_name="Ana", is_bot=False)
+    bot = FakeBot()
+    update = SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id, title="Group"), effective_user=user)
+    context = SimpleNamespace(bot=bot)
+
+    async def scenario():
+        await handlers.welcome_new_member(update, context, user)
+        await handlers.reject_user(bot, chat_id, user.id, actor_id=1)
+        assert not verification_storage.is_pending_verification(chat_id, user.id)
+        await handlers.welcome_new_member(update, context, user)
+
+    asyncio.run(scenario())
+    assert bot.restricts(chat_id, user.id) == 2
+    assert ("unban_chat_member", chat_id, user.id) in bot.calls
+    assert verification_storage.is_pending_verification(chat_id, user.id)
+
+def test_rejoin_through_chat_member_updates_is_restricted_again():
+    chat_id = -1002
+    user = User(id=4343, first_name="Ion", is_bot=False)
+    chat = Chat(id=chat_id, type=Chat.SUPERGROUP, title="Group")
+    bot = FakeBot()
+    context = SimpleNamespace(bot=bot)
+    join = SimpleNamespace(chat_member=ChatMemberUpdated(
+        chat, user, datetime.now(timezone.utc), ChatMemberLeft(user), ChatMemberMember(user)
+    ))
+
+    async def scenario():
+        await telegram_bot.handle_chat_member_update(join, context)
+        await telegram_bot.reject_member(bot, chat_id, user.id, actor_id=1)
+        assert not verification_storage.is_pending_verification(chat_id, user.id)
+        # An admin lifts the ban and the user comes back
+        await telegram_bot.handle_chat_member_update(join, context)
+
+    asyncio.run(scenario())
+    assert bot.restricts(chat_id, user.id) == 2
+    assert verification_storage.is_pending_verification(chat_id, user.id)
+
+def test_concurrent_duplicate_join_is_audited_once(monkeypatch):
+    chat_id = -1003
+    user = User(id=4444, first_name="Maria", is_bot=False)
+    bot = FakeBot()
+    update = SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id, title="Group"), effective_user=user)
+    context = SimpleNamespace(bot=bot)
+    events = []
+    monkeypatch.setattr(handlers.audit_log, "record", lambda event, *args, **kwargs: events.append(event))
+
+    async def scenario():
+        # The same join delivered twice, e.g. as a message and a member update
+        await asyncio.gather(
+            handlers.welcome_new_member(update, context, user),
+            handlers.welcome_new_member(update, context, user),
+        )
+
+    asyncio.run(scenario())
+    assert bot.restricts(chat_id, user.id) == 1
+    assert events.count(handlers.AuditEvent.JOIN) == 1
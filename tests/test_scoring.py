@@ -0,0 +1,53 @@
+import asyncio
+
+from telegram import User
+
+from scoring import ScoringPipeline, Verdict
+
+class FakeBot:
+    def __init__(self, photos: int):
+        self.photos = photos
+
+    async def get_user_profile_photos(self, user_id, limit=None):
+        class Photos:
+            total_count = self.photos
+        return Photos()
+
+def evaluate(pipeline, user, bot=None):
+    return asyncio.run(pipeline.evaluate(user, bot))
+
+def test_weak_signals_alone_never_reject():
+    # No username, a new account and no profile photo, but nothing spammy
+    user = User(id=9_000_000_000, first_name="Ana", is_bot=False)
+    score = evaluate(ScoringPipeline(), user, FakeBot(photos=0))
+    assert score.verdict == Verdict.REVIEW
+
+def test_spam_name_rejects():
+    user = User(id=9_000_000_000, first_name="Free crypto t.me/signals", is_bot=False)
+    score = evaluate(ScoringPipeline(), user, FakeBot(photos=0))
+    assert score.verdict == Verdict.REJECT
+    assert "spam_name" in score.reasons
+
+def test_trust_is_opt_in():
+    user = User(id=4242, first_name="Ana", username="ana", is_bot=False)
+    assert evaluate(ScoringPipeline(), user, FakeBot(photos=1)).verdict == Verdict.REVIEW
+    assert evaluate(ScoringPipeline(trust_score=0), user, FakeBot(photos=1)).verdict == Verdict.TRUST
+
+def test_spam_words_inside_names_do_not_match():
+    for first_name, username in [
+        ("Sextil Puscariu", "sextil_p"),
+        ("Sexton", "sexton"),
+        ("Maria Essex", "essex_m"),
+        ("Mihai", "mihai_investitii"),
+        ("Andreea promo2024", "andreea"),
+    ]:
+        user = User(id=9_000_000_000, first_name=first_name, username=username, is_bot=False)
+        score = evaluate(ScoringPipeline(), user, FakeBot(photos=0))
+        assert "spam_name" not in score.reasons, first_name
+        assert score.verdict == Verdict.REVIEW
+
+def test_spam_name_alone_does_not_reject():
+    user = User(id=4242, first_name="Free crypto", username="ana", is_bot=False)
+    score = evaluate(ScoringPipeline(), user, FakeBot(photos=1))
+    assert score.reasons == ["spam_name"]
+    assert score.verdict == Verdict.REVIEW
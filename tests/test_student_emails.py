@@ -0,0 +1,27 @@
+from storage import StudentEmailStorage
+from storage_backend import SQLiteBackend
+
+def test_an_address_verifies_one_account():
+    emails = StudentEmailStorage()
+    assert emails.bind("ana@umfst.ro", 4242)
+    assert emails.bind("ana@umfst.ro", 4242)
+    assert not emails.bind("ana@umfst.ro", 4343)
+    assert emails.owner("ana@umfst.ro") == 4242
+
+def test_bindings_are_shared_and_survive_restarts(tmp_path):
+    path = str(tmp_path / "verification.db")
+    first = SQLiteBackend(path, origin="a")
+    second = SQLiteBackend(path, origin="b")
+    try:
+        assert StudentEmailStorage(first).bind("ana@umfst.ro", 4242)
+        # Another replica that had not seen the binding yet
+        assert not StudentEmailStorage(second).bind("ana@umfst.ro", 4343)
+    finally:
+        first.close()
+        second.close()
+
+    backend = SQLiteBackend(path)
+    try:
+        assert StudentEmailStorage(backend).owner("ana@umfst.ro") == 4242
+    finally:
+        backend.close()
@@ -0,0 +1,105 @@
+"""
+Update processor keeping updates of one chat in order while
+processing different chats in parallel.
+"""
+from collections import deque
+from typing import Awaitable, Deque, Dict, Set
+import asyncio
+import logging
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import MAX_CONCURRENT_UPDATES
+from idempotency import ProcessedUpdates, processed_updates
+from logs import correlation_id
+
+logger = logging.getLogger(__name__)
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates of each chat one at a time, in arrival order, while
+    different chats run concurrently.
+
+    Every chat with queued updates gets its own worker task, created on
+    demand and finished once the chat's queue is empty, so a busy chat
+    never holds back the others. Updates without a chat are processed right
+    away. At most `max_concurrent_updates` handlers run at the same time.
+
+    Updates already handled, recently or before a restart, are dropped
+    before reaching any handler. Each update is handled with its update id
+    as the logging correlation id.
+    """
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES,
+                 processed: ProcessedUpdates = processed_updates):
+        # The base class semaphore is only held while an update is queued,
+        # the actual limit is enforced by the workers
+        super().__init__(max_concurrent_updates)
+        self._processed = processed
+        self._slots: asyncio.BoundedSemaphore = None
+        self._queues: Dict[int, Deque[Awaitable]] = {}
+        self._workers: Set[asyncio.Task] = set()
+
+    async def initialize(self):
+        self._slots = asyncio.BoundedSemaphore(self.max_concurrent_updates)
+
+    async def shutdown(self):
+        # Let every chat finish the updates it already received
+        if self._workers:
+            await asyncio.gather(*self._workers, return_exceptions=True)
+        self._processed.checkpoint()
+
+    async def join(self):
+        """Wait until every chat has processed the updates it received."""
+        while self._workers:
+            await asyncio.gather(*list(self._workers), return_exceptions=True)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable):
+        if not isinstance(update, Update):
+            async with self._slots:
+                await coroutine
+            return
+
+        if not self._processed.begin(update.update_id):
+            coroutine.close()
+            return
+        coroutine = self._track(update.update_id, coroutine)
+
+        chat = update.effective_chat
+        if chat is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        queue = self._queues.get(chat.id)
+        if queue is None:
+            queue = deque()
+            self._queues[chat.id] = queue
+            worker = asyncio.get_running_loop().create_task(self._drain(chat.id, queue))
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+        queue.append(coroutine)
+
+    async def _track(self, update_id: int, coroutine: Awaitable):
+        token = correlation_id.set(str(update_id))
+        try:
+            await coroutine
+        finally:
+            self._processed.finish(update_id)
+            correlation_id.reset(token)
+
+    async def _drain(self, chat_id: int, queue: Deque[Awaitable]):
+        try:
+            while queue:
+                coroutine = queue.popleft()
+                async with self._slots:
+                    try:
+                        await coroutine
+                    except Exception as e:
+                        # Application.process_update reports handler errors itself
+                        logger.error(f"Unhandled error processing an update of chat {chat_id}: {e}")
+        finally:
+            del self._queues[chat_id]
+
+    def queue_depths(self) -> Dict[int, int]:
+        """Number of updates waiting per chat."""
+        return {chat_id: len(queue) for chat_id, queue in self._queues.items()}
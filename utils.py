@@ -67,6 +67,23 @@ def get_user_name(user):
     
     return f"User {user.id}"
 
+def get_display_name(user_id, user_data):
+    """
+    Generates a display name from stored verification data,
+    following the same rules as get_user_name.
+    """
+    if not user_data:
+        return f"User {user_id}"
+    
+    if user_data.get("username"):
+        return f"@{user_data['username']}"
+    
+    name_parts = [part for part in (user_data.get("first_name"), user_data.get("last_name")) if part]
+    if name_parts:
+        return " ".join(name_parts)
+    
+    return f"User {user_id}"
+
 def is_admin(chat_member):
     """
     Check if a chat member has admin privileges.
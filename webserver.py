@@ -0,0 +1,47 @@
+"""
+aiohttp server for the dashboard and /metrics.
+Imported only once the bot is polling, so starting the web server never
+delays the first getUpdates.
+"""
+import logging
+from aiohttp import web
+
+from dashboard import dashboard
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+def _authorized(request) -> bool:
+    return dashboard.check_token(request.query.get("token") or request.headers.get("X-Dashboard-Token"))
+
+async def handle(request):
+    if not _authorized(request):
+        raise web.HTTPForbidden()
+    return web.Response(text=dashboard.render_html(), content_type="text/html")
+
+async def handle_dashboard_api(request):
+    if not _authorized(request):
+        raise web.HTTPForbidden()
+    return web.Response(text=dashboard.render_json(), content_type="application/json")
+
+async def handle_metrics(request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app.add_routes([
+        web.get('/', handle),
+        web.get('/api/dashboard', handle_dashboard_api),
+        web.get('/metrics', handle_metrics)
+    ])
+    return app
+
+async def start_webserver(port: int) -> web.AppRunner:
+    """Serve the dashboard in the running event loop. Returns the runner, for cleanup()."""
+    runner = web.AppRunner(create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, '0.0.0.0', port)
+    await site.start()
+    logger.info("Web server started on port %s", port)
+    return runner
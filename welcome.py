@@ -0,0 +1,241 @@
+"""
+Combined welcome messages for members joining in bursts.
+Collects joins per chat for a short window and greets them with one message.
+"""
+from typing import Dict, Set, Tuple
+import asyncio
+import logging
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, TelegramError
+
+from config import WELCOME_WINDOW, WELCOME_MAX_BATCH
+from outbound import Priority, outbound
+from storage import verification_storage
+from templates import templates
+from utils import get_user_name
+
+logger = logging.getLogger(__name__)
+
+# Callback data prefix of the Verify/Reject buttons on admin notifications,
+# followed by ":v" or ":r" and ":<chat_id>:<user_id>"
+ADMIN_DECISION_PREFIX = "adm"
+
+# Deep link parameter of the self-service button on welcome messages,
+# followed by the chat id
+VERIFY_START_PREFIX = "v"
+
+class Outcome:
+    """
+    Markers shown next to a member once their verification is settled.
+    """
+    PENDING = "⏳"
+    VERIFIED = "✅"
+    REJECTED = "❌"
+    EXPIRED = "⌛"
+
+class WelcomeBatch:
+    """
+    Members greeted by one combined welcome message.
+    """
+    __slots__ = ("chat_id", "chat_title", "notify_chat_id", "members", "outcomes", "message_id", "edit_scheduled")
+
+    def __init__(self, chat_id: int, chat_title: str = None, notify_chat_id: int = None):
+        self.chat_id = chat_id
+        self.chat_title = chat_title
+        self.notify_chat_id = notify_chat_id
+        self.members: Dict[int, str] = {}
+        self.outcomes: Dict[int, str] = {}
+        self.message_id = None
+        self.edit_scheduled = False
+
+class WelcomeAggregator:
+    """
+    Debounces welcome messages per chat.
+
+    The first join in a chat opens a batch that is flushed `window` seconds
+    later (or as soon as it reaches `max_batch` members) as one welcome
+    message plus, optionally, one admin notification. Every member's stored
+    message_id then points at the shared message, which is edited in place
+    as members are verified, rejected or expire. Edits are debounced the
+    same way, so a bulk /verify produces a single edit.
+
+    Sent batches are only known to the running process; after a restart
+    the old messages are left as they are.
+    """
+    def __init__(self, window: float = WELCOME_WINDOW, max_batch: int = WELCOME_MAX_BATCH):
+        self._window = window
+        self._max_batch = max_batch
+        self._collecting: Dict[int, WelcomeBatch] = {}
+        self._sent: Dict[Tuple[int, int], WelcomeBatch] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _spawn(self, coroutine):
+        # Keep a reference so pending tasks are not garbage collected
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def add_member(self, bot, chat_id: int, user, chat_title: str = None, notify_chat_id: int = None):
+        """
+        Queue a greeting for a member who has just been restricted.
+        If `notify_chat_id` is set, admins there get one combined notification.
+        """
+        batch = self._collecting.get(chat_id)
+        if batch is None:
+            batch = WelcomeBatch(chat_id, chat_title, notify_chat_id)
+            self._collecting[chat_id] = batch
+            self._spawn(self._flush_later(bot, batch))
+
+        batch.members[user.id] = get_user_name(user)
+
+        if len(batch.members) >= self._max_batch:
+            del self._collecting[chat_id]
+            self._spawn(self._flush(bot, batch))
+
+    async def _flush_later(self, bot, batch: WelcomeBatch):
+        await asyncio.sleep(self._window)
+        if self._collecting.get(batch.chat_id) is batch:
+            del self._collecting[batch.chat_id]
+            await self._flush(bot, batch)
+
+    async def _flush(self, bot, batch: WelcomeBatch):
+        """Send the combined welcome and admin notification for a batch."""
+        chat_id = batch.chat_id
+
+        # Members verified or removed during the window need no greeting
+        batch.members = {
+            user_id: name for user_id, name in batch.members.items()
+            if verification_storage.is_pending_verification(chat_id, user_id)
+        }
+        if not batch.members:
+            return
+
+        try:
+            message = await outbound.call(
+                bot.send_message, chat_id=chat_id, text=self.render(batch), reply_markup=self.render_keyboard(bot, batch)
+            )
+        except TelegramError as e:
+            logger.error(f"Error sending welcome message for {len(batch.members)} members in chat {chat_id}: {e}")
+            return
+
+        batch.message_id = message.message_id
+        self._sent[(chat_id, batch.message_id)] = batch
+        verification_storage.set_message_id(chat_id, batch.members, batch.message_id)
+        logger.info("Welcomed %d new members in chat %s with one message", len(batch.members), chat_id)
+
+        if batch.notify_chat_id:
+            try:
+                await outbound.call(
+                    bot.send_message,
+                    priority=Priority.ADMIN_DM,
+                    chat_id=batch.notify_chat_id,
+                    text=self.render_admin_notification(batch),
+                    reply_markup=self.render_admin_keyboard(batch)
+                )
+            except TelegramError as e:
+                logger.error(f"Error notifying admin {batch.notify_chat_id} about chat {chat_id}: {e}")
+
+    def render(self, batch: WelcomeBatch) -> str:
+        """Build the text of a combined welcome message."""
+        lines = [
+            f"{batch.outcomes.get(user_id, Outcome.PENDING)} {name}"
+            for user_id, name in batch.members.items()
+        ]
+        if len(batch.outcomes) < len(batch.members):
+            footer = templates.render("welcome_pending", batch.chat_id)
+        else:
+            footer = templates.render("welcome_done", batch.chat_id)
+        return "👋 Welcome to the group!\n\n" + "\n".join(lines) + "\n\n" + footer
+
+    def render_keyboard(self, bot, batch: WelcomeBatch) -> InlineKeyboardMarkup:
+        """Build the button opening a verification challenge in a private chat with the bot."""
+        return InlineKeyboardMarkup([[
+            InlineKeyboardButton(
+                "🤖 Verify me now", url=f"https://t.me/{bot.username}?start={VERIFY_START_PREFIX}{batch.chat_id}"
+            )
+        ]])
+
+    def render_admin_notification(self, batch: WelcomeBatch) -> str:
+        """Build the text of the combined notification sent to admins."""
+        where = f" {batch.chat_title}" if batch.chat_title else ""
+        lines = [f"• {name} (ID: {user_id})" for user_id, name in batch.members.items()]
+        return (
+            f"🆕 {len(batch.members)} new member(s) joined{where}:\n"
+            + "\n".join(lines)
+            + "\n\nTap a button below, or use /verify or /reject with their usernames."
+        )
+
+    def render_admin_keyboard(self, batch: WelcomeBatch) -> InlineKeyboardMarkup:
+        """Build one row of Verify/Reject buttons per member of a batch."""
+        return InlineKeyboardMarkup([
+            [
+                InlineKeyboardButton(
+                    f"✅ {name}", callback_data=f"{ADMIN_DECISION_PREFIX}:v:{batch.chat_id}:{user_id}"
+                ),
+                InlineKeyboardButton(
+                    "❌ Reject", callback_data=f"{ADMIN_DECISION_PREFIX}:r:{batch.chat_id}:{user_id}"
+                )
+            ]
+            for user_id, name in batch.members.items()
+        ])
+
+    def mark_handled(self, bot, chat_id: int, user_id: int, message_id: int, outcome: str) -> bool:
+        """
+        Record the outcome for a member and schedule an edit of their welcome message.
+        Returns False if the message is not one this aggregator sent.
+        """
+        batch = self._sent.get((chat_id, message_id)) if message_id else None
+        if batch is None or user_id not in batch.members:
+            collecting = self._collecting.get(chat_id)
+            if collecting is not None:
+                collecting.members.pop(user_id, None)
+            return False
+
+        batch.outcomes[user_id] = outcome
+        if not batch.edit_scheduled:
+            batch.edit_scheduled = True
+            self._spawn(self._edit_later(bot, batch))
+        return True
+
+    async def _edit_later(self, bot, batch: WelcomeBatch):
+        await asyncio.sleep(self._window)
+        batch.edit_scheduled = False
+        chat_id, message_id = batch.chat_id, batch.message_id
+
+        try:
+            if len(batch.outcomes) < len(batch.members):
+                await outbound.call(
+                    bot.edit_message_text,
+                    priority=Priority.BACKGROUND,
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=self.render(batch),
+                    reply_markup=self.render_keyboard(bot, batch)
+                )
+                return
+
+            # Everyone is settled, the batch needs no further edits
+            del self._sent[(chat_id, message_id)]
+            if Outcome.VERIFIED in batch.outcomes.values():
+                await outbound.call(
+                    bot.edit_message_text,
+                    priority=Priority.BACKGROUND,
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=self.render(batch)
+                )
+            else:
+                # Nobody from this batch stayed, so the welcome is just clutter
+                await outbound.call(
+                    bot.delete_message,
+                    priority=Priority.BACKGROUND,
+                    chat_id=chat_id,
+                    message_id=message_id
+                )
+        except BadRequest as e:
+            logger.debug("Could not update welcome message %s in chat %s: %s", message_id, chat_id, e)
+        except TelegramError as e:
+            logger.error(f"Error updating welcome message {message_id} in chat {chat_id}: {e}")
+
+# Global welcome aggregator instance
+welcome_aggregator = WelcomeAggregator()